@@ -1,6 +1,7 @@
 # config/__init__.py
 
 from .db_conn import db_conn
+from .db_conn import async_db_pool
 from .db_conn_info import DB_CONN_INFO
 from .sftp_conn import sftp_conn
 from .sftp_conn import sftp_ssh_conn
@@ -1,17 +1,100 @@
 # tubuin\config\db_conn.py
+import atexit
+import threading
 import psycopg
-from contextlib import contextmanager
-from config.db_conn_info import DB_CONN_INFO
+from contextlib import contextmanager, asynccontextmanager
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
+from config.db_conn_info import (
+    DB_CONN_INFO,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MAX_LIFETIME,
+    DB_POOL_MAX_IDLE,
+    DB_POOL_TIMEOUT,
+    DB_SESSION_SETTINGS,
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+
 
 def make_conn():
+    # Unpooled connection, for scripts that want a connection of their own
     return psycopg.connect(
         DB_CONN_INFO,
     )
 
+
+def configure_conn(conn):
+    # Runs once per physical connection, before the pool hands it out
+    with conn.cursor() as cur:
+        for name, value in DB_SESSION_SETTINGS.items():
+            cur.execute("SELECT set_config(%s, %s, false)", (name, value))
+    conn.commit()
+
+
+async def configure_async_conn(conn):
+    async with conn.cursor() as cur:
+        for name, value in DB_SESSION_SETTINGS.items():
+            await cur.execute("SELECT set_config(%s, %s, false)", (name, value))
+    await conn.commit()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    DB_CONN_INFO,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    max_idle=DB_POOL_MAX_IDLE,
+                    timeout=DB_POOL_TIMEOUT,
+                    check=ConnectionPool.check_connection,
+                    configure=configure_conn,
+                    name="tubuin",
+                    open=True,
+                )
+                atexit.register(close_pool)
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
 @contextmanager
 def db_conn():
-    conn = make_conn()
-    try:
+    # The pool commits on a clean exit and rolls back if the block raised.
+    # Don't close the connection yourself, that throws it out of the pool.
+    with get_pool().connection() as conn:
         yield conn
+
+
+@asynccontextmanager
+async def async_db_pool(max_size: int = DB_POOL_MAX_SIZE):
+    # Async pools are bound to the event loop that opened them, so unlike get_pool() there is
+    # no process-wide instance: open one per asyncio.run() and close it with the loop.
+    pool = AsyncConnectionPool(
+        DB_CONN_INFO,
+        min_size=1,
+        max_size=max_size,
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+        max_idle=DB_POOL_MAX_IDLE,
+        timeout=DB_POOL_TIMEOUT,
+        check=AsyncConnectionPool.check_connection,
+        configure=configure_async_conn,
+        name="tubuin-async",
+        open=False,
+    )
+    await pool.open()
+    try:
+        yield pool
     finally:
-        conn.close()
\ No newline at end of file
+        await pool.close()
@@ -9,4 +9,22 @@ DB_CONN_INFO = (
     f"dbname={os.environ['DB_NAME']} "
     f"user={os.environ['DB_USER']} "
     f"password={os.environ['DB_PASS']}"
-)
\ No newline at end of file
+)
+
+# Connection pool sizing, see config/db_conn.py
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 8))
+DB_POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", 30 * 60))  # seconds
+DB_POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", 5 * 60))  # seconds
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 60))  # seconds to wait for a free connection
+
+# Session settings applied to every pooled connection, unset values keep the server default
+DB_SESSION_SETTINGS = {
+    name: value
+    for name, value in {
+        "statement_timeout": os.environ.get("DB_STATEMENT_TIMEOUT"),
+        "work_mem": os.environ.get("DB_WORK_MEM"),
+        "application_name": os.environ.get("DB_APPLICATION_NAME", "tubuin-orchestrator"),
+    }.items()
+    if value
+}
@@ -1,21 +1,58 @@
 # tubuin\flows\subflows\analytics_skills_and_player_pages.py
 from prefect import flow, task, get_run_logger
-from datetime import timedelta, datetime, timezone
-from config import db_conn, sftp_ssh_conn
-import json
+from datetime import date, timedelta, datetime, timezone
+from config import sftp_ssh_conn
+import orjson
 from pathlib import Path
+from typing import List
 
 from sql.commands import (
     UpdateAnalyticsSkillSnapshots,
-    RefreshMaterialSkillDeltas,
+    UpdateDerivedMatchSkillDeltas,
+    RebuildDerivedMatchSkillDeltas,
     UpdateAnalyticsPlayerPageJson,
+    UpdateAnalyticsPlayerPageJsonFromDaily,
+    UpdateAnalyticsPlayerDailyStats,
+    SelectPlayerDailyStatsDays,
+    DeleteStalePlayerDailyStats,
+    SelectAnalyticsPlayerPageJsonState,
+    DeleteStaleAnalyticsPlayerPageJson,
+    UpdateSnapshotMetadataWatermark,
 )
-from logic.utils.sftp import upload_gzipped_and_decompress_remotely
+from sql.statement_registry import statements
+from sql.sql_history import SQLHistory, compare
+from sql.sql_runner import SQLRunner, AsyncSQLRunner, run_async
+from logic.utils.sftp import (
+    execute_remote_cmd,
+    move_remote_files,
+    upload_gzipped_and_decompress_remotely,
+    upload_and_move_remotely,
+    read_remote_file,
+    safe_remove_remote,
+)
+from logic.artifact_manifest import MANIFEST_FILENAME, load_manifest, plan_publish, write_manifest
+from logic.player_codec import PLAYER_RECORD_CODEC
+from logic.player_export import PAGES_THROUGH_KEY
+from logic.match_cache import refresh_match_cache
+from logic.player_engine import PLAYER_PAGE_ENGINE, build_player_pages
+from logic.player_windows import PRIMARY_WINDOW, page_windows, window_params, window_subdir
 
 from .create_player_artifacts_from_db_flow import (
     create_files_from_analytics_json_flow,
 )
 
+# --- Config ---
+# Delta player page runs rebuild users with a match since the last run minus this; replays
+# can be ingested (and derived) well after their start_time.
+PLAYER_PAGE_LOOKBACK = timedelta(hours=36)
+# The player page statement runs as this many user_id hash shards on separate connections
+PLAYER_PAGE_SHARDS = 8
+PLAYER_PAGE_SHARD_RETRIES = 2
+# A day of analytics.player_daily_stats is rebuilt every run until a run started this long
+# after the day ended (PLAYER_PAGE_ENGINE=daily), same reasoning as the lookback
+PLAYER_DAILY_STATS_SETTLE = PLAYER_PAGE_LOOKBACK
+REMOTE_ARTIFACT_DIR = "/home/nodeuser/apps/go-api/private"
+
 
 @task
 def update_analytics_match_skill_snapshots() -> int:
@@ -27,17 +64,10 @@ def update_analytics_match_skill_snapshots() -> int:
 
     try:
         logger.info("🔄 Updating analytics.match_skill_snapshots...")
-        with db_conn() as conn:
-            with conn.cursor() as cur:
-                query = UpdateAnalyticsSkillSnapshots().query
-
-                cur.execute(query)
-                conn.commit()
-
-                affected_rows = cur.rowcount
-                logger.info(
-                    f"✅ Inserted {cur.rowcount} rows into match_skill_snapshots."
-                )
+        affected_rows = SQLRunner(logger=logger).run(UpdateAnalyticsSkillSnapshots())
+        logger.info(
+            f"✅ Inserted {affected_rows} rows into match_skill_snapshots."
+        )
     except Exception as e:
         logger.error(f"❌ Error during match_skill_snapshots update: {e}")
         raise
@@ -47,77 +77,236 @@ def update_analytics_match_skill_snapshots() -> int:
 
 
 @task
-def update_match_skill_deltas():
-    # IMPROVEMENT: The "materialized view" should not be a MATERIALIZED VIEW object in Postgres.
-    # It should be a regular table (derived.match_skill_deltas) that is updated incrementally.
-    # The task should execute a script that finds only the users whose skills have changed
+def update_match_skill_deltas(full_rebuild: bool = False) -> int:
+    # derived.match_skill_deltas is a regular table: only (user, category) pairs with new
+    # snapshots since the last run are upserted. full_rebuild recomputes every pair.
     logger = get_run_logger()
+    affected_rows = 0
 
     try:
-        logger.info("🔄 Refreshing derived.match_skill_deltas...")
-        with db_conn() as conn:
-            with conn.cursor() as cur:
-                query = RefreshMaterialSkillDeltas().query
-
-                cur.execute(query)
-                conn.commit()
-
-                logger.info(f"✅ Refreshed match_skill_deltas.")
+        if full_rebuild:
+            logger.info("🔄 Rebuilding derived.match_skill_deltas from all snapshots...")
+            command = RebuildDerivedMatchSkillDeltas()
+        else:
+            logger.info("🔄 Updating derived.match_skill_deltas for changed pairs...")
+            command = UpdateDerivedMatchSkillDeltas()
+        affected_rows = SQLRunner(logger=logger).run(command)
+        logger.info(f"✅ Upserted {affected_rows} rows into match_skill_deltas.")
     except Exception as e:
-        logger.error(f"❌ Error during match_skill_deltas refresh: {e}")
+        logger.error(f"❌ Error during match_skill_deltas update: {e}")
         raise
     finally:
-        logger.info(f"ℹ️ Total rows affected:")
+        logger.info(f"ℹ️ Total rows affected: {affected_rows}")
+    return affected_rows
+
+
+# --- Update Postgres Table analytics.player_daily_stats ---
+@task(name="Update analytics.player_daily_stats", retries=1, retry_delay_seconds=60)
+def update_player_daily_stats_task(
+    to_date: str,
+    full_rebuild: bool = False,
+    max_concurrency: int = PLAYER_PAGE_SHARDS,
+) -> int:
+    # The per day partial aggregates the daily engine merges into player pages. Only the days of
+    # the widest window that were never built or haven't settled yet (today, yesterday) are
+    # rebuilt, each in its own transaction, concurrently, plus settled days whose replays or skill
+    # snapshots were ingested since (backfills); days that left the window are dropped.
+    # full_rebuild rebuilds every day of the window, needed after source rows were deleted or
+    # edited in place.
+    logger = get_run_logger()
+    try:
+        logger.info("Update Analytics Player Daily Stats: Connecting to PostgreSQL...")
+        runner = SQLRunner(logger=logger)
+        window = window_params(page_windows(date.fromisoformat(to_date)))
+        select_days = SelectPlayerDailyStatsDays({
+            **window,
+            "rebuild": full_rebuild,
+            "settle": PLAYER_DAILY_STATS_SETTLE,
+        })
+        runner.run(select_days)
+        days = [row[0] for row in select_days.rows]
+        checked_at = select_days.rows[0][1] if select_days.rows else None
+        logger.info(
+            f"\t Update Analytics Player Daily Stats: {window['timestamptz_from']} - {to_date} | "
+            f"{len(days)} days to build"
+        )
+
+        rows = []
+        if days:
+            async_runner = AsyncSQLRunner(logger=logger, max_concurrency=max_concurrency)
+            rows = run_async(async_runner.run_many(
+                [UpdateAnalyticsPlayerDailyStats({"day": day}) for day in days],
+                retries=PLAYER_PAGE_SHARD_RETRIES,
+            ))
+        deleted = runner.run(DeleteStalePlayerDailyStats(window))
+        # Only once every day committed; a failed run selects the same changed days next time
+        if checked_at is not None:
+            runner.run(UpdateSnapshotMetadataWatermark({
+                "key": "player_daily_stats",
+                "last_loaded_at": checked_at,
+            }))
+        logger.info(
+            f"✅ Built {len(days)} days ({sum(rows)} rows) of player_daily_stats, dropped {deleted} days."
+        )
+        return sum(rows)
+    except Exception as e:
+        logger.error(f"❌ Error during player_daily_stats update: {e}")
+        raise
 
 
 # --- Populate Postgres Table analytics.player_page_json ---
 @task(name="Populate analytics.player_page_json", retries=1, retry_delay_seconds=60)
-def populate_analytics_player_json_task(from_date: str, to_date: str):
+def populate_analytics_player_json_task(
+    to_date: str,
+    full_rebuild: bool = False,
+    num_shards: int = PLAYER_PAGE_SHARDS,
+):
+    # Delta mode rebuilds only users active since the 'player_page_json' watermark. A full
+    # rebuild runs when asked, on the first run, and whenever the date windows moved (daily)
+    # or PLAYER_PAGE_WINDOWS changed, since every exported page must be built for its window.
+    # Either way the users are split into num_shards hash shards that run concurrently, each
+    # in its own transaction with its own retries, and every shard builds all windows ending
+    # on to_date from one scan of the widest. With PLAYER_PAGE_ENGINE=daily the shards merge
+    # analytics.player_daily_stats (update_player_daily_stats_task) instead of scanning matches.
     logger = get_run_logger()
-    conn = None  # Initialize conn to None
     try:
         logger.info("Update Analytics Player Page Json: Connecting to PostgreSQL...")
-        with db_conn() as conn:  # Attempt to get the connection object
-            # At this point, if db_conn() failed, conn is still None and we'd jump to except/finally
-            # If db_conn() succeeded, conn is a connection object.
-            with conn.cursor() as cur:  # Use cursor as a context manager
-                try:
-                    query = UpdateAnalyticsPlayerPageJson().query
-                    params = {
-                        "timestamptz_from": from_date,
-                        "timestamptz_to": to_date,
-                    }
-                    logger.info(
-                        f"\t Update Analytics Player Page Json:  {from_date} - {to_date}"
-                    )
-                    cur.execute(query, params)
-                    print(query)
-                    conn.commit()  # Commit if all successful
-                    logger.info(
-                        f"\t Update Analytics Player Page Json: Rows Inserted cur.rowcount {cur.rowcount}"
-                    )
-                    logger.info(
-                        "Update Analytics Player Page Json: Executed successfully."
-                    )
-                except Exception as e:
-                    logger.error(f"Update Analytics Player Page Json: Error {e}")
-                    conn.rollback()
-
+        runner = SQLRunner(logger=logger)
+        windows = page_windows(date.fromisoformat(to_date))
+        window = window_params(windows)
+        from_date = window["timestamptz_from"]
+        state = SelectAnalyticsPlayerPageJsonState(window)
+        runner.run(state)
+        checked_at, last_loaded_at, window_changed = state.rows[0]
+
+        full_rebuild = full_rebuild or last_loaded_at is None or window_changed
+        active_since = None if full_rebuild else last_loaded_at - PLAYER_PAGE_LOOKBACK
+        logger.info(
+            f"\t Update Analytics Player Page Json:  {from_date} - {to_date} "
+            + f"({', '.join(w.key for w in windows)}) | "
+            + ("full rebuild" if full_rebuild else f"users active since {active_since}")
+            + f" | {num_shards} shards | {PLAYER_PAGE_ENGINE} engine"
+        )
+        if PLAYER_PAGE_ENGINE == "python":
+            # Same pages from the local match cache, see logic/player_engine.py
+            refreshed = refresh_match_cache(windows[0].from_date, windows[0].to_date, logger=logger)
+            logger.info(f"\t Update Analytics Player Page Json: match cache {refreshed}")
+            shard_rows = build_player_pages(windows, active_since, num_shards)
+        else:
+            page_command = (
+                UpdateAnalyticsPlayerPageJsonFromDaily if PLAYER_PAGE_ENGINE == "daily"
+                else UpdateAnalyticsPlayerPageJson
+            )
+            shards = [
+                page_command({
+                    **window,
+                    "active_since": active_since,
+                    "shard": shard,
+                    "num_shards": num_shards,
+                })
+                for shard in range(num_shards)
+            ]
+            async_runner = AsyncSQLRunner(logger=logger, max_concurrency=num_shards)
+            shard_rows = run_async(async_runner.run_many(shards, retries=PLAYER_PAGE_SHARD_RETRIES))
+        rowcount = sum(shard_rows)
+        logger.info(
+            f"\t Update Analytics Player Page Json: Rows Inserted {rowcount} (per shard {shard_rows})"
+        )
+
+        if full_rebuild:
+            deleted = runner.run(DeleteStaleAnalyticsPlayerPageJson(window))
+            logger.info(
+                f"\t Update Analytics Player Page Json: Deleted {deleted} pages from older or removed windows"
+            )
+        # Only once every shard committed; a failed run redoes the same delta next time
+        runner.run(UpdateSnapshotMetadataWatermark({
+            "key": "player_page_json",
+            "last_loaded_at": checked_at,
+        }))
+        # Every page of this run has an older last_generated_at (its shard's now()), so the
+        # incremental export reads up to here and never sees half of a run, see PAGES_THROUGH_KEY
+        runner.run(UpdateSnapshotMetadataWatermark({
+            "key": PAGES_THROUGH_KEY,
+            "last_loaded_at": None,
+        }))
+        logger.info(
+            "Update Analytics Player Page Json: Executed successfully."
+        )
+        return rowcount
     except Exception as e:
         logger.error(f"Update Analytics Player Page Json failed: {e}")
         raise  # Re-raise for Prefect
 
 
 @task(name="Upload Artifacts (from DB JSON flow)", retries=2, retry_delay_seconds=30)
-def upload_artifacts_from_db_json_task(jsonl_path: str, index_path: str):
+def upload_artifacts_from_db_json_task(
+    manifest_path: str, stale_names: List[str] = (), window_key: str = PRIMARY_WINDOW
+):
+    # Uploads the files of artifacts.manifest.json whose sha256 differs from the manifest on
+    # the server, then publishes the new version by replacing the manifest, see
+    # logic/artifact_manifest.py. Windows other than the primary one live in a subdirectory.
     logger = get_run_logger()
-    logger.info("Upload Artifacts (from DB JSON flow)...")
+    logger.info(f"Upload Artifacts (from DB JSON flow), window {window_key}...")
+    remote_dir = "/".join(filter(None, (REMOTE_ARTIFACT_DIR, window_subdir(window_key))))
+    manifest_path = Path(manifest_path)
+    local = load_manifest(manifest_path)
+    if local is None:
+        logger.warning(f"Upload Artifacts: no manifest at {manifest_path}, nothing to upload.")
+        return False
     try:
         logger.info("in Upload Artifacts try.")
         with sftp_ssh_conn() as (sftp, ssh):
             logger.info("SFTP connection established.")
-            upload_gzipped_and_decompress_remotely(sftp, ssh, Path(jsonl_path), Path(f"/home/nodeuser/apps/go-api/private/{Path(jsonl_path).name}"))
-            upload_gzipped_and_decompress_remotely(sftp, ssh, Path(index_path), Path(f"/home/nodeuser/apps/go-api/private/{Path(index_path).name}"))
+            if remote_dir != REMOTE_ARTIFACT_DIR:
+                execute_remote_cmd(ssh, f"mkdir -p '{remote_dir}'", "window directory")
+            remote_bytes = read_remote_file(sftp, f"{remote_dir}/{MANIFEST_FILENAME}")
+            remote = orjson.loads(remote_bytes) if remote_bytes else None
+            if remote and remote.get("version") == local["version"] and remote.get("files") == local["files"]:
+                logger.info(f"Upload Artifacts: version {local['version']} is already published.")
+                return True
+
+            to_upload, to_delete = plan_publish(local, remote)
+            skipped = len(local["files"]) - len(to_upload)
+            logger.info(
+                f"Upload Artifacts: version {local['version']}, uploading {len(to_upload)} files, "
+                f"{skipped} unchanged"
+            )
+            # Each file is uploaded under a staged name first. Content-addressed objects are
+            # new names anyway, only fixed names (files mode) are renamed at publish time.
+            moves = []
+            try:
+                for name in to_upload:
+                    entry = local["files"][name]
+                    local_path = manifest_path.parent / name
+                    remote_path = Path(f"{remote_dir}/{entry['object']}")
+                    if local["publish"] == "files":
+                        staged_path = remote_path.with_name(f".{remote_path.name}.v{local['version']}.staged")
+                        moves.append((staged_path.as_posix(), remote_path.as_posix()))
+                        remote_path = staged_path
+                    if local_path.suffix == ".mpk" and PLAYER_RECORD_CODEC == "zstd":
+                        # Records are zstd compressed already, gzip would only cost time
+                        upload_and_move_remotely(sftp, ssh, local_path, remote_path)
+                    else:
+                        upload_gzipped_and_decompress_remotely(sftp, ssh, local_path, remote_path)
+
+                # Publish: the staged files and then the manifest in one remote command, readers
+                # see either version, never players.mpk of one with the index of the other
+                write_manifest(manifest_path, local)  # now with "retired" filled in
+                remote_manifest = Path(f"{remote_dir}/{MANIFEST_FILENAME}")
+                staged_manifest = remote_manifest.with_name(f".{MANIFEST_FILENAME}.v{local['version']}.staged")
+                upload_and_move_remotely(sftp, ssh, manifest_path, staged_manifest)
+                moves.append((staged_manifest.as_posix(), remote_manifest.as_posix()))
+                move_remote_files(ssh, moves)
+            finally:
+                # Gone after a successful publish, only leftovers of a failed one are removed
+                for staged_path, _ in moves:
+                    safe_remove_remote(sftp, staged_path)
+            logger.info(f"Upload Artifacts: published version {local['version']}.")
+
+            if local["publish"] == "files":
+                to_delete = list(stale_names)
+            for name in to_delete:
+                safe_remove_remote(sftp, f"{remote_dir}/{name}")
 
     except Exception as e:
         logger.error(f"❌ Error during artifact upload: {e}")
@@ -143,12 +332,14 @@ def upload_artifacts_from_db_json_task(jsonl_path: str, index_path: str):
 
 
 @task
-def flow_wrapper_create_files_from_analytics(from_date, to_date):
-    return create_files_from_analytics_json_flow(from_date, to_date)
+def flow_wrapper_create_files_from_analytics(from_date, to_date, full_rebuild=False, window_key=PRIMARY_WINDOW):
+    return create_files_from_analytics_json_flow(
+        from_date, to_date, full_rebuild=full_rebuild, window_key=window_key
+    )
 
 
 @flow(name="Analytics Skills And Player Pages Flow")
-def main_flow():
+def main_flow(full_rebuild_deltas: bool = False, full_rebuild_player_pages: bool = False):
     logger = get_run_logger()
     logger.info("🟢 Starting Skill: Deltas Refresh and Export")
 
@@ -159,7 +350,8 @@ def main_flow():
     # Step 2: update derived.match_skill_deltas
     logger.info("▶️ Step 2: Update derived.match_skill_deltas")
     mat_skill_deltas_future = update_match_skill_deltas.submit(  # type: ignore[arg-type]
-        wait_for=[snapshots_future]
+        full_rebuild=full_rebuild_deltas,
+        wait_for=[snapshots_future],
     )
 
     # A future improvement is to make this more flexible. We could pass in a short
@@ -170,46 +362,65 @@ def main_flow():
     # This would allow us to create different data "slices" on demand and would be
     # the final step before moving each major component into its own dedicated analytics table.
 
-    # Step 3: Set window which matches front end view
-    logger.info("▶️ Step 3: Setting window to 6 months for player page data")
+    # Step 3: Set the windows; 24w (approx 6 months) matches the front end view
+    logger.info("▶️ Step 3: Setting player page windows")
     today = datetime.now(timezone.utc).date()
     to_date_param = today  # 1 day is added in sql to ensure complete data
-    from_date_param = today - timedelta(weeks=24)  # Approx 6 months
-    logger.info(f"\t Window set from {from_date_param} to {to_date_param}")
-
-    # Step 4: populate/update analytics.player_page_json
+    windows = page_windows(to_date_param)
+    for w in windows:
+        logger.info(f"\t Window {w.key} set from {w.from_date} to {w.to_date}")
+
+    # Step 4: populate/update analytics.player_page_json, every window in one pass
+    page_inputs = [mat_skill_deltas_future]
+    if PLAYER_PAGE_ENGINE == "daily":
+        logger.info("▶️ Step 4a: Update analytics.player_daily_stats")
+        page_inputs.append(update_player_daily_stats_task.submit(
+            to_date=to_date_param.isoformat(),
+            full_rebuild=full_rebuild_player_pages,
+            wait_for=[snapshots_future],
+        ))
     logger.info("▶️ Step 4: Populate/Update analytics.player_page_json")
     analytics_player_json_future = populate_analytics_player_json_task.submit(
-        from_date=from_date_param.isoformat(),
         to_date=to_date_param.isoformat(),
-        wait_for=[mat_skill_deltas_future],
+        full_rebuild=full_rebuild_player_pages,
+        wait_for=page_inputs,
     )
 
-    # Step 5: create artifacts from analytics.player_page_json
-    #   JSONL and Index from analytics table
-    logger.info("▶️ Step 5: Create artifacts from analytics.player_page_json")
-    paths_future = flow_wrapper_create_files_from_analytics.submit(
-        from_date=from_date_param.isoformat(),
-        to_date=to_date_param.isoformat(),
-        wait_for=[analytics_player_json_future],
-    )
-    
-    paths = paths_future.result()
-
-    # Step 6: Upload artifacts to Production
-    #   CRITICAL
-    logger.info("▶️ Step 6: Upload artifacts to Production")
-    upload_artifacts_future = upload_artifacts_from_db_json_task.submit(
-        jsonl_path=paths[0],  # Pass the first element of the result
-        index_path=paths[1],  # Pass the second element
-        wait_for=[paths_future],
-    )
-
-    upload_artifacts_future.wait()
+    for w in windows:
+        # Step 5: create artifacts from analytics.player_page_json
+        #   JSONL and Index from analytics table
+        logger.info(f"▶️ Step 5: Create artifacts from analytics.player_page_json ({w.key})")
+        paths_future = flow_wrapper_create_files_from_analytics.submit(
+            from_date=w.from_date.isoformat(),
+            to_date=w.to_date.isoformat(),
+            full_rebuild=full_rebuild_player_pages,
+            window_key=w.key,
+            wait_for=[analytics_player_json_future],
+        )
+
+        paths = paths_future.result()
+
+        # Step 6: Upload artifacts to Production
+        #   CRITICAL
+        logger.info(f"▶️ Step 6: Upload artifacts to Production ({w.key})")
+        upload_artifacts_future = upload_artifacts_from_db_json_task.submit(
+            manifest_path=paths[0],  # Pass the first element of the result
+            stale_names=paths[1],  # Pass the second element
+            window_key=w.key,
+            wait_for=[paths_future],
+        )
+
+        upload_artifacts_future.wait()
 
     # write_json_output_future = write_json_output(wait_for=[mat_skill_deltas_future])
     # write_json_output_future.result()
 
+    for line in statements.summary_lines():
+        logger.info(line)
+    # Latest run of each step against its recent median, see sql/sql_history.py
+    for line in compare(SQLHistory().read()):
+        logger.info(f"[sql history] {line}")
+
     logger.info("✅ Main Player Data Pipeline finished.")
 
 
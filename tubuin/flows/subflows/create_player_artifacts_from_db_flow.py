@@ -1,144 +1,242 @@
 # tubuin\flows\subflows\create_player_artifacts_from_db_flow.py
-from typing import Any, Dict, Generator, List
-import orjson
-import msgpack
+from typing import List, Tuple
 from datetime import date, timedelta, datetime, timezone
 import os
 from prefect import flow, task, get_run_logger
-from config import db_conn
+from logic.artifact_manifest import MANIFEST_FILENAME, build_manifest
+from logic.player_export import index_formats, pages_generated_through, stream_player_pages, write_sharded_artifacts
+from logic.player_index import PlayerIndexWriter
+from logic.player_windows import PRIMARY_WINDOW, window_output_dir
+from logic.player_artifact import (
+    SEGMENTS_FILENAME,
+    ArtifactState,
+    Segment,
+    compact,
+    load_index,
+    remove_files,
+    segment_name,
+    write_indexes,
+)
+from logic.player_codec import (
+    PLAYER_RECORD_CODEC,
+    PlayerRecordEncoder,
+    dictionary_name,
+    write_dictionary,
+    write_format_file,
+)
 
 # --- Config ---
 MPK_FILENAME = "players.mpk"
 INDEX_FILENAME = "players.index.json"
-OUTPUT_DIR = "./output_artifacts"
+BINARY_INDEX_FILENAME = "players.index.bin"  # see logic/player_index.py
+PLAYER_ARTIFACT_MODE = os.getenv("PLAYER_ARTIFACT_MODE", "full")  # full | incremental | sharded
+PLAYER_ARTIFACT_SHARDS = int(os.getenv("PLAYER_ARTIFACT_SHARDS", "8"))  # sharded mode, see logic/player_export.py
+OUTPUT_DIR = "./output_artifacts"  # the primary window's, other windows write to a subdirectory
 
 
-# --- Dense Skill History ---
-def format_dense_skill_history_in_python(
-    skill_history_raw_map: Dict[str, List[Dict[str, Any]]],
-    overall_from_date: date,
-    overall_to_date: date,
-) -> Dict[str, List[Any]]:
+@task(name="Write Artifacts (Streaming)", retries=1)
+def write_artifacts_task(
+    from_date_obj: date, to_date_obj: date, window_key: str = PRIMARY_WINDOW
+) -> Tuple[str, List[str]]:
     """
-    Processes a raw, sparse skill history map into a dense grid format
-    with forward-filled values.
+    Rewrites players.mpk and its index from scratch, plus players.format.json (and the
+    zstd dictionary) describing its records, see logic/player_codec.py.
+    Returns (artifacts manifest path, remote names to remove).
     """
-    if not skill_history_raw_map:
-        return {"labels": [], "datasets": []}
-
-    # 1. Generate global date labels for the entire period
-    all_processing_dates_str = []
-    current_scan_date = overall_from_date
-    while current_scan_date <= overall_to_date:
-        all_processing_dates_str.append(current_scan_date.strftime("%Y-%m-%d"))
-        current_scan_date += timedelta(days=1)
-
-    if not all_processing_dates_str:
-        return {"labels": [], "datasets": []}
-
-    # 2. Process each category's sparse data into a dense dataset
-    final_datasets = []
-    for mode, daily_entries in sorted(skill_history_raw_map.items()):
-        if not daily_entries:
-            continue
+    logger = get_run_logger()
+    logger.info(f"> Write Artifacts (Streaming), window {window_key}.")
+    output_dir = window_output_dir(OUTPUT_DIR, window_key)
+    os.makedirs(output_dir, exist_ok=True)
+    jsonl_path = os.path.join(output_dir, MPK_FILENAME)
+    index_path = os.path.join(output_dir, INDEX_FILENAME)
+    binary_index_path = os.path.join(output_dir, BINARY_INDEX_FILENAME)
+    formats = index_formats()
 
-        # Create a lookup map for this mode's data points for efficiency
-        mode_skill_on_date = {entry["date"]: entry["skill"] for entry in daily_entries}
+    index = PlayerIndexWriter()
+    encoder = PlayerRecordEncoder(PLAYER_RECORD_CODEC)
 
-        dataset_data = []
-        last_known_skill = 0.0
-        initial_skill_found = False
+    logger.info("Starting artifact writing process...")
+    try:
+        with open(jsonl_path, "wb") as f_mpk:
+            mpk_size, processed_users_count, _ = stream_player_pages(
+                from_date_obj, to_date_obj, f_mpk, index, encoder, logger=logger, window_key=window_key
+            )
+
+        logger.info(f"✅ Wrote {jsonl_path} with {processed_users_count} entries ({mpk_size} bytes, {encoder.codec}).")
+        names = [MPK_FILENAME]
+        records = {MPK_FILENAME: processed_users_count}
+        dictionary_file = None
+        if encoder.dictionary is not None:
+            dictionary_file = dictionary_name()
+            write_dictionary(output_dir, dictionary_file, encoder.dictionary)
+            names.append(dictionary_file)
+        if "json" in formats:
+            index.write_json(index_path)
+            names.append(INDEX_FILENAME)
+            records[INDEX_FILENAME] = len(index)
+            logger.info(f"✅ Wrote index to {index_path} for {len(index)} users.")
+        if "binary" in formats:
+            index.write_binary(binary_index_path, mpk_size=mpk_size)
+            names.append(BINARY_INDEX_FILENAME)
+            records[BINARY_INDEX_FILENAME] = len(index)
+            logger.info(f"✅ Wrote binary index to {binary_index_path} for {len(index)} users.")
+        names.append(write_format_file(output_dir, encoder.codec, dictionary_file).name)
+        manifest_path = build_manifest(output_dir, names, records)
+        logger.info(f"✅ Wrote {manifest_path} for {len(names)} files.")
+        return str(manifest_path), []
+    except Exception as e:
+        logger.error(f"Database streaming failed: {e}")
+        raise
 
-        # 3. Iterate through the global timeline and fill in the data
-        for date_str in all_processing_dates_str:
-            if date_str in mode_skill_on_date:
-                last_known_skill = mode_skill_on_date[date_str]
-                initial_skill_found = True
-                dataset_data.append(last_known_skill)
-            else:
-                # Carry forward the last known value, but only after the first
-                # actual data point has been found.
-                dataset_data.append(last_known_skill if initial_skill_found else 0.0)
 
-        final_datasets.append({"label": mode, "data": dataset_data})
+@task(name="Write Artifacts (Incremental)", retries=1)
+def write_incremental_artifacts_task(
+    from_date_obj: date, to_date_obj: date, full_rebuild: bool = False, window_key: str = PRIMARY_WINDOW
+) -> Tuple[str, List[str]]:
+    """
+    Appends the pages generated since the last run as a new delta segment and compacts once
+    the deltas grow past DELTA_COMPACT_RATIO of the base. A new window (daily), a missing
+    state file or full_rebuild starts a new generation from a full export.
+    Returns (artifacts manifest path, remote names to remove).
+    """
+    logger = get_run_logger()
+    logger.info(f"> Write Artifacts (Incremental), window {window_key}.")
+    output_dir = window_output_dir(OUTPUT_DIR, window_key)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    state_path = output_dir / SEGMENTS_FILENAME
+    formats = index_formats()
 
-    return {"labels": all_processing_dates_str, "datasets": final_datasets}
+    try:
+        state = ArtifactState.load(state_path)
+        window = (from_date_obj.isoformat(), to_date_obj.isoformat())
+        rebuild = (
+            full_rebuild
+            or state is None
+            or (state.from_date, state.to_date) != window
+            or state.codec != PLAYER_RECORD_CODEC
+        )
+        if rebuild:
+            logger.info(f"Write Artifacts (Incremental): full export for window {window[0]} to {window[1]}")
+            new_state = ArtifactState(
+                from_date=window[0],
+                to_date=window[1],
+                generation=state.generation + 1 if state else 1,
+                seq=0,
+                generated_through=None,
+                codec=PLAYER_RECORD_CODEC,
+            )
+            index = PlayerIndexWriter()
+            encoder = PlayerRecordEncoder(PLAYER_RECORD_CODEC)
+            since = None
+        else:
+            new_state = ArtifactState(
+                from_date=state.from_date,
+                to_date=state.to_date,
+                generation=state.generation,
+                seq=state.seq + 1,
+                generated_through=state.generated_through,
+                segments=list(state.segments),
+                codec=state.codec,
+                dictionary=state.dictionary,
+            )
+            index = load_index(output_dir, state)
+            # Deltas reuse the generation's dictionary, so compaction can copy records as they are
+            dictionary = (output_dir / state.dictionary).read_bytes() if state.dictionary else None
+            encoder = PlayerRecordEncoder(state.codec, dictionary)
+            since = datetime.fromisoformat(state.generated_through) if state.generated_through else None
+
+        # Up to the page step's own stamp, not the newest page seen: a delta then holds whole
+        # page runs, each exported once, see PAGES_THROUGH_KEY
+        through = pages_generated_through()
+        segment_path = output_dir / segment_name(new_state.generation, new_state.seq)
+        with open(segment_path, "wb") as f_mpk:
+            written, processed_users_count, newest = stream_player_pages(
+                from_date_obj, to_date_obj, f_mpk, index, encoder,
+                start_offset=new_state.total_size, since=since, logger=logger, window_key=window_key,
+                through=through,
+            )
+        if not rebuild and processed_users_count == 0:
+            segment_path.unlink()
+            logger.info("Write Artifacts (Incremental): no pages changed, nothing to upload.")
+            return str(output_dir / MANIFEST_FILENAME), []
+
+        new_state.segments.append(Segment(segment_path.name, written))
+        if encoder.dictionary is not None and new_state.dictionary is None:
+            new_state.dictionary = dictionary_name(new_state.generation)
+            write_dictionary(output_dir, new_state.dictionary, encoder.dictionary)
+        if through is not None:
+            new_state.generated_through = through.isoformat()
+        elif newest is not None:
+            new_state.generated_through = newest.isoformat()
+        logger.info(
+            f"✅ Wrote {segment_path} with {processed_users_count} entries ({written} bytes), "
+            f"deltas {new_state.delta_size} / base {new_state.base_size} bytes."
+        )
+
+        if not rebuild and new_state.needs_compaction():
+            new_state, index = compact(output_dir, new_state, index)
+            logger.info(
+                f"✅ Compacted into {new_state.segments[0].name} ({new_state.base_size} bytes) "
+                f"for {len(index)} users."
+            )
+
+        write_indexes(output_dir, new_state, index, formats)
+        logger.info(f"✅ Wrote index {new_state.index} for {len(index)} users.")
+
+        # The state is what the next run trusts, save it only once every file it names exists
+        new_state.save(state_path)
+        old_names = set(state.file_names()) if state else set()
+        current_names = set(new_state.file_names())
+        stale_names = sorted(old_names - current_names)
+        remove_files(output_dir, stale_names)
+
+        # Every current file is listed, the uploader skips the ones the server already has
+        names = [new_state.dictionary] if new_state.dictionary else []
+        names += [s.name for s in new_state.segments]
+        names += [new_state.index[f] for f in formats]
+        names.append(SEGMENTS_FILENAME)
+        records = {segment_path.name: processed_users_count}
+        records.update({new_state.index[f]: len(index) for f in formats})
+        manifest_path = build_manifest(output_dir, names, records)
+        return str(manifest_path), stale_names
+    except Exception as e:
+        logger.error(f"Database streaming failed: {e}")
+        raise
 
 
-@task(name="Write Artifacts (Streaming)", retries=1)
-def write_artifacts_task(from_date_obj: date, to_date_obj: date):
-    logger = get_run_logger()
-    logger.info(f"> Write Artifacts (Streaming).")
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    jsonl_path = os.path.join(OUTPUT_DIR, MPK_FILENAME)
-    index_path = os.path.join(OUTPUT_DIR, INDEX_FILENAME)
-
-    query = """
-        SELECT user_id, json_data
-        FROM analytics.player_page_json_v4
-        WHERE data_start_date = %s AND data_end_date = %s;
+@task(name="Write Artifacts (Sharded)", retries=1)
+def write_sharded_artifacts_task(
+    from_date_obj: date,
+    to_date_obj: date,
+    num_shards: int = PLAYER_ARTIFACT_SHARDS,
+    window_key: str = PRIMARY_WINDOW,
+) -> Tuple[str, List[str]]:
     """
-
-    index_data = {}
-    current_offset = 0
-    processed_users_count = 0
-
-    logger.info("Starting artifact writing process...")
+    Writes num_shards shard files, each with its own index, in a process pool so the msgpack
+    (and zstd) encoding runs on several cores, plus players.shards.json.
+    Returns (artifacts manifest path, remote names to remove).
+    """
+    logger = get_run_logger()
+    logger.info(f"> Write Artifacts (Sharded), {num_shards} shards, window {window_key}.")
+    output_dir = window_output_dir(OUTPUT_DIR, window_key)
+    output_dir.mkdir(parents=True, exist_ok=True)
     try:
-        with db_conn() as conn:
-            with conn.cursor(name="player_json_stream") as cur:
-                cur.itersize = 1000
-                logger.info(
-                    f"Executing query to fetch data for window: {from_date_obj} to {to_date_obj}"
-                )
-                cur.execute(query, (from_date_obj, to_date_obj))
-
-                with open(jsonl_path, "wb") as f_mpk:
-                    for row in cur:
-                        user_id = row[0]
-                        player_json_dict = row[1]
-
-                        if not player_json_dict:
-                            logger.warning(
-                                f"Skipping user {user_id} due to missing JSON data."
-                            )
-                            continue
-
-                        try:
-                            # skill_history_raw = player_json_dict.pop(
-                            #     "skillHistoryRaw", {}
-                            # )
-                            # final_skill_history = format_dense_skill_history_in_python(
-                            #     skill_history_raw, from_date_obj, to_date_obj
-                            # )
-                            # player_json_dict["skillHistory"] = final_skill_history
-                            
-                            packed_bytes = msgpack.packb(player_json_dict)
-                            assert(isinstance(packed_bytes, bytes))
-
-                            line_length = len(packed_bytes)
-                            f_mpk.write(packed_bytes)
-                            
-
-                            # json_line_bytes = orjson.dumps(player_json_dict) + b"\n"
-                            # line_length = len(json_line_bytes)
-                            # f_jsonl.write(json_line_bytes)
-
-                            index_data[str(user_id)] = [current_offset, line_length]
-                            current_offset += line_length
-                            processed_users_count += 1
-
-                        except Exception as e:
-                            logger.error(
-                                f"❌ Failed to serialize/write for user {user_id}: {e}"
-                            )
-
-        with open(index_path, "wb") as f_index:
-            f_index.write(orjson.dumps(index_data))
-
-        logger.info(f"✅ Wrote {jsonl_path} with {processed_users_count} entries.")
-        logger.info(f"✅ Wrote index to {index_path} for {len(index_data)} users.")
-        return jsonl_path, index_path
+        shards, manifest_path = write_sharded_artifacts(
+            from_date_obj, to_date_obj, output_dir, num_shards, PLAYER_RECORD_CODEC, index_formats(),
+            window_key=window_key,
+        )
+        names = []
+        records = {}
+        for entry in shards:
+            logger.info(f"✅ Wrote {entry['mpk']} with {entry['players']} entries ({entry['size']} bytes).")
+            names.append(entry["mpk"])
+            if entry["dictionary"]:
+                names.append(entry["dictionary"])
+            names.extend(entry["index"].values())
+            records.update({name: entry["players"] for name in [entry["mpk"], *entry["index"].values()]})
+        names.append(manifest_path.name)
+        logger.info(f"✅ Wrote {manifest_path} for {sum(e['players'] for e in shards)} users.")
+        return str(build_manifest(output_dir, names, records)), []
     except Exception as e:
         logger.error(f"Database streaming failed: {e}")
         raise
@@ -150,22 +248,50 @@ def create_files_from_analytics_json_flow(
         datetime.now(timezone.utc).date() - timedelta(weeks=24)
     ).isoformat(),
     to_date: str = (datetime.now(timezone.utc).date()).isoformat(),
+    mode: str = PLAYER_ARTIFACT_MODE,
+    full_rebuild: bool = False,
+    window_key: str = PRIMARY_WINDOW,
 ):
+    """
+    mode="full": rewrite players.mpk and its index every run.
+    mode="incremental": append only the changed pages, see logic/player_artifact.py.
+    mode="sharded": write PLAYER_ARTIFACT_SHARDS shards in parallel, see logic/player_export.py.
+    from_date / to_date must be the window_key window's, see logic/player_windows.py.
+    Returns (artifacts manifest path, remote names to remove afterwards).
+    """
     logger = get_run_logger()
-    logger.info(f"Artifacts Flow: Starting for period {from_date} to {to_date}")
+    logger.info(f"Artifacts Flow: Starting for window {window_key}, {from_date} to {to_date} ({mode})")
 
     from_date_obj = date.fromisoformat(from_date)
     to_date_obj = date.fromisoformat(to_date)
 
     # Process the data in chunks to avoid loading everything into memory
     # The query must look for an EXACT match on the date window
-    jsonl_path, index_path = write_artifacts_task.submit(
-        from_date_obj=from_date_obj,
-        to_date_obj=to_date_obj
-    ).result()
+    if mode == "full":
+        future = write_artifacts_task.submit(
+            from_date_obj=from_date_obj,
+            to_date_obj=to_date_obj,
+            window_key=window_key,
+        )
+    elif mode == "incremental":
+        future = write_incremental_artifacts_task.submit(
+            from_date_obj=from_date_obj,
+            to_date_obj=to_date_obj,
+            full_rebuild=full_rebuild,
+            window_key=window_key,
+        )
+    elif mode == "sharded":
+        future = write_sharded_artifacts_task.submit(
+            from_date_obj=from_date_obj,
+            to_date_obj=to_date_obj,
+            window_key=window_key,
+        )
+    else:
+        raise ValueError(f"unknown mode {mode!r}, expected 'full', 'incremental' or 'sharded'")
+    manifest_path, stale_names = future.result()
 
     logger.info(f"✅ Artifacts Flow: Finished successfully.")
-    return jsonl_path, index_path
+    return manifest_path, stale_names
 
 
 if __name__ == "__main__":
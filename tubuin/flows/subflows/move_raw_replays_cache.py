@@ -1,31 +1,105 @@
 # move_raw_replays_cache.py
-from prefect import flow, task, get_run_logger
-import os
-from config import db_conn
-from sql.commands import MoveRawReplays
+from prefect import flow, get_run_logger
+import time
+from sql.commands import MoveRawReplaysCacheDefault
+from sql.sql_runner import SQLRunner
+from flows.subflows.partition_maintenance_flow import CACHE_RETENTION
+
+# --- Configuration ---
+MOVE_INITIAL_BATCH_SIZE = 10000
+MOVE_MIN_BATCH_SIZE = 1000
+MOVE_MAX_BATCH_SIZE = 100000
+MOVE_TARGET_BATCH_SECONDS = 10.0  # Batch size adapts so each committed batch takes about this long
+MOVE_TIME_BUDGET_SECONDS = 20 * 60  # Stop draining after this, the next run picks up the rest
+
+
+def next_batch_size(batch_size: int, elapsed_s: float) -> int:
+    # Scale towards the target latency, at most doubling or halving per batch
+    if elapsed_s <= 0:
+        scale = 2.0
+    else:
+        scale = min(2.0, max(0.5, MOVE_TARGET_BATCH_SECONDS / elapsed_s))
+    return int(min(MOVE_MAX_BATCH_SIZE, max(MOVE_MIN_BATCH_SIZE, batch_size * scale)))
+
+
+def drain_rows(runner, logger, make_command, time_budget_s: float, initial_batch_size: int):
+    """
+    Runs make_command(batch_size) in separately committed batches until a batch comes back
+    short or the time budget runs out. Returns (moved, inserted, batches).
+    """
+    affected_rows = 0
+    inserted_rows = 0
+    batches = 0
+    batch_size = initial_batch_size
+    started = time.monotonic()
+    while True:
+        command = make_command(batch_size)
+        batch_started = time.monotonic()
+        moved = runner.run(command)
+        elapsed = time.monotonic() - batch_started
+        inserted = command.rows[0][1] if command.rows else 0
+
+        batches += 1
+        affected_rows += moved
+        inserted_rows += inserted
+        logger.info(
+            f"\t Batch {batches}: moved {moved} (inserted {inserted}) of {batch_size} "
+            f"in {elapsed:.2f}s | total moved {affected_rows}"
+        )
+
+        if moved < batch_size:
+            logger.info(f"Move Raw Replays: {command.label} drained.")
+            break
+        # Don't start a batch that would likely overrun the budget
+        if time.monotonic() - started + elapsed > time_budget_s:
+            logger.warning(
+                f"Move Raw Replays: Time budget of {time_budget_s:.0f}s used up, "
+                "the remaining rows are left for the next run."
+            )
+            break
+        batch_size = next_batch_size(batch_size, elapsed)
+    return affected_rows, inserted_rows, batches
+
 
 @flow(name="Move Raw Replays Cache Flow")
-def move_raw_replays_flow() -> int:
+def move_raw_replays_flow(
+    time_budget_s: float = MOVE_TIME_BUDGET_SECONDS,
+    initial_batch_size: int = MOVE_INITIAL_BATCH_SIZE,
+) -> int:
+    """
+    Drains rows older than 24h from the DEFAULT partition of raw.replays_cache (late or
+    re-ingested replays) into raw.replays in separately committed batches, until a batch comes
+    back short or the time budget runs out. Row level only, so it can overlap the derive steps;
+    whole daily partitions are retired by partition_maintenance_flow. Needs migration 005.
+    Returns the number of rows moved out of the cache.
+    """
     logger = get_run_logger()
+    runner = SQLRunner(logger=logger)
     affected_rows = 0
+    inserted_rows = 0
+    batches = 0
+    started = time.monotonic()
     try:
         logger.info("Move Raw Replays: Connecting to PostgreSQL...")
-        with db_conn() as conn:
-            with conn.cursor() as cur:
-
-                cur.execute(MoveRawReplays().query)
-                conn.commit()
-                affected_rows = cur.rowcount
-                logger.info(f"\t Rows Inserted cur.rowcount {cur.rowcount}")
-                logger.info("Move Raw Replays: Executed successfully.")
+        affected_rows, inserted_rows, batches = drain_rows(
+            runner, logger,
+            lambda batch_size: MoveRawReplaysCacheDefault({
+                "batch_size": batch_size,
+                "older_than": CACHE_RETENTION,
+            }),
+            time_budget_s,
+            initial_batch_size,
+        )
+        logger.info("Move Raw Replays: Executed successfully.")
     except Exception as e:
-        conn.rollback()
-        conn.close()
         logger.error(f"Move Raw Replays: Error {e}")
         raise
     finally:
-        logger.info(f"Move Raw Replays: Affected Rows: {affected_rows}")
-        return affected_rows
+        logger.info(
+            f"Move Raw Replays: Affected Rows: {affected_rows} (inserted {inserted_rows}) "
+            f"in {batches} batches, {time.monotonic() - started:.1f}s"
+        )
+    return affected_rows
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+# tubuin\flows\subflows\partition_maintenance_flow.py
+from prefect import flow, task, get_run_logger
+from datetime import timedelta
+from sql.commands import EnsureRangePartitions, RetireRawReplaysCachePartitions, SelectRawReplaysCachePartitioned
+from sql.sql_runner import SQLRunner
+
+# --- Configuration ---
+# (table, partition period, partitions kept created ahead, unlogged partitions)
+PARTITIONED_TABLES = [
+    ("raw.replays_cache", "day", timedelta(days=7), False),
+    ("raw.replays", "month", timedelta(days=92), False),
+    ("derived.replays", "month", timedelta(days=92), False),
+    ("derived.match_players_unlogged", "month", timedelta(days=92), True),
+    ("analytics.match_skill_snapshots", "month", timedelta(days=92), False),
+]
+PARTITION_BEHIND = timedelta(days=1)  # Also fill gaps just behind now, e.g. after a missed run
+CACHE_RETENTION = timedelta(hours=24)  # Cache partitions are retired once they ended this long ago
+
+
+def cache_is_partitioned(runner: SQLRunner) -> bool:
+    command = SelectRawReplaysCachePartitioned()
+    runner.run(command)
+    return bool(command.rows and command.rows[0][0])
+
+
+@task(retries=2, retry_delay_seconds=10)
+def ensure_partitions() -> int:
+    logger = get_run_logger()
+    runner = SQLRunner(logger=logger)
+    created = 0
+    try:
+        logger.info("Ensure Partitions: Connecting to PostgreSQL...")
+        if not cache_is_partitioned(runner):
+            # Every ON CONFLICT target and the cache move rely on its (replay_id, start_time) keys
+            raise RuntimeError(
+                "raw.replays_cache is not partitioned, apply migration 005_partition_by_start_time.sql first"
+            )
+        for table, period, ahead, unlogged in PARTITIONED_TABLES:
+            rowcount = runner.run(EnsureRangePartitions({
+                "parent": table,
+                "period": period,
+                "behind": PARTITION_BEHIND,
+                "ahead": ahead,
+                "unlogged": unlogged,
+            }))
+            created += rowcount
+            logger.info(f"\t Ensure Partitions: {table} created {rowcount}")
+        logger.info(f"Ensure Partitions: Executed successfully, created {created}.")
+        return created
+    except Exception as e:
+        logger.error(f"Ensure Partitions: Error {e}")
+        raise
+
+
+def retire_cache_partitions(runner: SQLRunner, logger, older_than: timedelta = CACHE_RETENTION) -> int:
+    """
+    Moves whole raw.replays_cache partitions into raw.replays and drops them.
+    A daily partition is retired once its last row is older_than old, so rows stay in the
+    cache between older_than and older_than + 1 day. Returns the number of rows moved.
+    """
+    command = RetireRawReplaysCachePartitions({"older_than": older_than})
+    moved = runner.run(command)
+    for partition_name, partition_moved in command.rows or []:
+        logger.info(f"\t Retired {partition_name}: moved {partition_moved}")
+    return moved
+
+
+@task(retries=2, retry_delay_seconds=10)
+def retire_partitions() -> int:
+    logger = get_run_logger()
+    runner = SQLRunner(logger=logger)
+    try:
+        logger.info("Retire Cache Partitions: Connecting to PostgreSQL...")
+        moved = retire_cache_partitions(runner, logger)
+        logger.info(f"Retire Cache Partitions: Executed successfully, moved {moved}.")
+        return moved
+    except Exception as e:
+        logger.error(f"Retire Cache Partitions: Error {e}")
+        raise
+
+
+@flow(name="Partition Maintenance Flow")
+def partition_maintenance_flow():
+    """
+    Keeps partitions created ahead for every partitioned table, then retires the
+    raw.replays_cache partitions that ended more than CACHE_RETENTION ago. Both change
+    partitions, which locks the parent tables (ACCESS EXCLUSIVE for the DETACH + DROP), so
+    this runs alone, before anything else writes or scans them.
+    Returns the number of rows moved out of retired cache partitions.
+    """
+    ensure_partitions()
+    return retire_partitions()
+
+
+if __name__ == "__main__":
+    partition_maintenance_flow()
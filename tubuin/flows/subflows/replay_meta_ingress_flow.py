@@ -3,10 +3,20 @@ from prefect import flow, task, get_run_logger
 from flows.subflows.move_raw_replays_cache import move_raw_replays_flow
 from flows.subflows.update_derived_match_players_unlogged import update_derived_match_players_flow
 from flows.subflows.update_derived_replays import update_derived_replays_flow
+from flows.subflows.partition_maintenance_flow import partition_maintenance_flow
+from sql.statement_registry import statements
+from sql.sql_history import SQLHistory, compare
+
+@task(name="Partition Maintenance", retries=1, retry_delay_seconds=10)
+def partition_maintenance_task():
+    # create the upcoming partitions of the start_time partitioned tables and retire the
+    # raw.replays_cache partitions older than 24 hours into raw.replays
+    partition_maintenance_flow()
+
 
 @task(name="Move Raw.Replays_Cache", retries=2, retry_delay_seconds=10)
 def move_raw_replays_cache_task():
-    # move metas from raw.replays_cache into raw.replays after they are 24 hours old
+    # move late metas from the raw.replays_cache DEFAULT partition into raw.replays after they are 24 hours old
     move_raw_replays_flow()
 
 
@@ -29,21 +39,38 @@ def replay_meta_ingress_flow():
     logger = get_run_logger()
     logger.info("🟢 Starting Replay Meta Ingress Flow")
 
-    # 1) Move raw.replay_cache older than 24h into raw.replays
+    # Dependency graph, so wall time is the critical path rather than the sum of the steps:
+    #   move_raw_replays_cache
+    #   update_derived_match_players -> update_derived_replays
+    # The move is independent: it deletes from raw.replays_cache and inserts into raw.replays in one
+    # statement, and derived.replays reads both tables, so it sees each replay exactly once either way.
+
+    # 0) Create upcoming partitions and retire old cache partitions first: both lock the parent
+    #    tables, so don't do it while the steps below are writing or scanning them
+    logger.info("▶️ Step 0 partition_maintenance")
+    partition_maintenance_task.submit().result()
+
+    # 1) Move late raw.replay_cache rows older than 24h into raw.replays, row level locks only
     logger.info("▶️ Step 1 move_raw_replays_cache")
     raw_cache_move = move_raw_replays_cache_task.submit()
-    raw_cache_move.result()
 
     # 2) Update derived.match_players_unlogged
     logger.info("▶️ Step 2 update_derived_match_players_flow")
-    match_players_update = update_derived_match_players_task.submit(wait_for=[raw_cache_move])
-    match_players_update.result()
-    
-    # 3) Update derived.replays
+    match_players_update = update_derived_match_players_task.submit()
+
+    # 3) Update derived.replays, needs the players' skills from step 2
     logger.info("▶️ Step 3 update_derived_replays task")
     replays_update = update_derived_replays_task.submit(wait_for=[match_players_update])
+
+    raw_cache_move.result()
+    match_players_update.result()
     replays_update.result()
 
+    for line in statements.summary_lines():
+        logger.info(line)
+    # Latest run of each step against its recent median, see sql/sql_history.py
+    for line in compare(SQLHistory().read()):
+        logger.info(f"[sql history] {line}")
 
     logger.info("✅ All steps complete")
 
@@ -1,63 +1,93 @@
 # tubuin\flows\subflows\update_derived_match_players_unlogged.py
 from prefect import flow, task, get_run_logger
-import os
-from config import db_conn
 from datetime import datetime, timedelta, timezone
-from sql.commands import UpdateDerivedMatchPlayers
+from typing import Optional
+from sql.commands import (
+    UpdateDerivedMatchPlayers,
+    UpdateDerivedMatchPlayersFromStaging,
+    UpdateDerivedMatchPlayersIncremental,
+)
+from sql.sql_runner import SQLRunner
 
 
 @task(retries=3, retry_delay_seconds=10)
 def update_derived_match_players_unlogged(t_from: datetime, t_to: datetime):
     logger = get_run_logger()
-    conn = None  # Initialize conn to None
     try:
         logger.info("Update Derived Match Players Unlogged: Connecting to PostgreSQL...")
-        with db_conn() as conn:  # Attempt to get the connection object
-        # At this point, if db_conn() failed, conn is still None and we'd jump to except/finally
-        # If db_conn() succeeded, conn is a connection object.
-            with conn.cursor() as cur: # Use cursor as a context manager
-                try:
-                    query = UpdateDerivedMatchPlayers().query
-                    params = {
-                        "timestamptz_from": t_from,
-                        "timestamptz_to": t_to,
-                    }
-                    logger.info(f"\t Update Derived Match Players Unlogged:  from: {t_from} - {t_to}")
-                    cur.execute(query, params)
-                    print(query)
-                    conn.commit() # Commit if all successful
-                    logger.info(f"\t Update Derived Match Players Unlogged: Rows Inserted cur.rowcount {cur.rowcount}")
-                    logger.info("Update Derived Match Players Unlogged: Executed successfully.")
-                except Exception as e:
-                    logger.error(f"Update Derived Match Players Unlogged: Error {e}")
-                    conn.rollback()
-                finally:
-                    conn.close()
-                    
+        command = UpdateDerivedMatchPlayers({
+            "timestamptz_from": t_from,
+            "timestamptz_to": t_to,
+        })
+        logger.info(f"\t Update Derived Match Players Unlogged:  from: {t_from} - {t_to}")
+        rowcount = SQLRunner(logger=logger).run(command)
+        logger.info(f"\t Update Derived Match Players Unlogged: Rows Inserted {rowcount}")
+        logger.info("Update Derived Match Players Unlogged: Executed successfully.")
     except Exception as e:
         logger.error(f"Update Derived Match Players Unlogged: Error {e}")
-        if conn: # Only try to rollback if conn was successfully assigned
-            try:
-                conn.rollback()
-                logger.info("Transaction rolled back.")
-            except Exception as rb_e:
-                logger.error(f"Error during rollback: {rb_e}")
         raise # Re-raise the original error for Prefect to handle
 
-    finally:
-        if conn: # Only try to close if conn was successfully assigned
-            try:
-                conn.close()
-                logger.info("Database connection closed.")
-            except Exception as cl_e:
-                logger.error(f"Error during connection close: {cl_e}")
+
+@task(retries=3, retry_delay_seconds=10)
+def update_derived_match_players_from_staging() -> int:
+    # Player rows are extracted once at meta ingest, this only moves them into derived
+    logger = get_run_logger()
+    try:
+        logger.info("Update Derived Match Players From Staging: Connecting to PostgreSQL...")
+        rowcount = SQLRunner(logger=logger).run(UpdateDerivedMatchPlayersFromStaging())
+        logger.info(f"\t Update Derived Match Players From Staging: Rows Inserted {rowcount}")
+        logger.info("Update Derived Match Players From Staging: Executed successfully.")
+        return rowcount
+    except Exception as e:
+        logger.error(f"Update Derived Match Players From Staging: Error {e}")
+        raise
+
+
+@task(retries=3, retry_delay_seconds=10)
+def update_derived_match_players_incremental() -> int:
+    # Replays ingested since the watermark that have no player rows yet, i.e. ones that
+    # didn't come through the staging table. Advances the watermark in the same transaction.
+    logger = get_run_logger()
+    try:
+        logger.info("Update Derived Match Players Incremental: Connecting to PostgreSQL...")
+        command = UpdateDerivedMatchPlayersIncremental()
+        rowcount = SQLRunner(logger=logger).run(command)
+        replays = command.rows[0][1] if command.rows else 0
+        logger.info(f"\t Update Derived Match Players Incremental: Rows Inserted {rowcount} for {replays} replays")
+        logger.info("Update Derived Match Players Incremental: Executed successfully.")
+        return rowcount
+    except Exception as e:
+        logger.error(f"Update Derived Match Players Incremental: Error {e}")
+        raise
 
 
 @flow(name="Update Derived Match Players Unlogged Flow")
-def update_derived_match_players_flow():
+def update_derived_match_players_flow(
+    mode: str = "incremental",
+    t_from: Optional[datetime] = None,
+    t_to: Optional[datetime] = None,
+):
+    """
+    mode="incremental": drain the staging table, then derive whatever else was ingested since
+        the last successful run (watermark 'match_players_unlogged' in analytics.snapshot_metadata).
+    mode="staging": only drain the staging table.
+    mode="range": re-derive replays started in [t_from, t_to], default the last 7 days. Only
+        fills in missing rows and leaves the watermark alone, use it to backfill or repair.
+    """
+    if mode == "staging":
+        update_derived_match_players_from_staging()
+        return
+    if mode == "incremental":
+        # Staged replays get their rows first, so the sweep skips them at the NOT EXISTS check
+        staged = update_derived_match_players_from_staging.submit()
+        update_derived_match_players_incremental.submit(wait_for=[staged]).result()
+        return
+    if mode != "range":
+        raise ValueError(f"unknown mode {mode!r}, expected 'incremental', 'staging' or 'range'")
+
     now_utc = datetime.now(timezone.utc)
-    from_date = now_utc - timedelta(days=7)       # 7 days ago
-    to_date   = now_utc + timedelta(days=1)       # tomorrow
+    from_date = t_from or now_utc - timedelta(days=7)       # 7 days ago
+    to_date   = t_to or now_utc + timedelta(days=1)         # tomorrow
     update_derived_match_players_unlogged(from_date, to_date)
 
 
@@ -1,39 +1,81 @@
 # update_derived_replays.py
 from prefect import flow, task, get_run_logger
-import os
-from config import db_conn
 from datetime import datetime, timedelta, timezone
-from sql.commands import UpdateDerivedReplays
+from typing import Optional
+from sql.commands import UpdateDerivedReplays, UpdateDerivedReplaysIncremental
+from sql.sql_runner import SQLRunner
+
+# --- Configuration ---
+BACKFILL_CHUNK = timedelta(days=1)  # Each chunk of a backfill commits on its own
 
 
 @task(retries=3, retry_delay_seconds=10)
-def update_derived_replays(t_from: datetime):
+def update_derived_replays_incremental() -> int:
     logger = get_run_logger()
+    try:
+        logger.info("Update Derived Replays Incremental: Connecting to PostgreSQL...")
+        command = UpdateDerivedReplaysIncremental()
+        rowcount = SQLRunner(logger=logger).run(command)
+        candidates = command.rows[0][1] if command.rows else 0
+        logger.info(f"\t Update Derived Replays Incremental: Rows Inserted {rowcount} of {candidates} new replays")
+        logger.info("Update Derived Replays Incremental: Executed successfully.")
+        return rowcount
+    except Exception as e:
+        logger.error(f"Update Derived Replays Incremental: Error {e}")
+        raise
+
+
+@task(retries=3, retry_delay_seconds=10)
+def update_derived_replays(t_from: datetime, t_to: datetime, only_missing: bool = True) -> int:
+    logger = get_run_logger()
+    runner = SQLRunner(logger=logger)
+    total = 0
     try:
         logger.info("Update Derived Replays: Connecting to PostgreSQL...")
-        with db_conn() as conn:
-            with conn.cursor() as cur:
-                query = UpdateDerivedReplays().query
-                params = {
-                    "timestamptz_from": t_from,
-                }
-                logger.info(f"\t Update Derived Replays:  from: {t_from}")
-                cur.execute(query, params)
-                conn.commit()
-                logger.info(f"\t Update Derived Replays: Rows Inserted cur.rowcount {cur.rowcount}")
-                logger.info("Update Derived Replays: Executed successfully.")
+        chunk_from = t_from
+        while chunk_from < t_to:
+            # Chunks commit separately, so a retry redoes at most the failed chunk's work
+            # (with only_missing the committed chunks are cheap to skip)
+            chunk_to = min(chunk_from + BACKFILL_CHUNK, t_to)
+            command = UpdateDerivedReplays({
+                "timestamptz_from": chunk_from,
+                "timestamptz_to": chunk_to,
+                "only_missing": only_missing,
+            })
+            logger.info(f"\t Update Derived Replays:  from: {chunk_from} - {chunk_to}")
+            rowcount = runner.run(command)
+            total += rowcount
+            logger.info(f"\t Update Derived Replays: Rows Inserted {rowcount} | total {total}")
+            chunk_from = chunk_to
+        logger.info("Update Derived Replays: Executed successfully.")
+        return total
     except Exception as e:
-        conn.rollback()
-        conn.close()
         logger.error(f"Update Derived Replays: Error {e}")
         raise
 
 
 @flow(name="Update Derived Replays Flow")
-def update_derived_replays_flow():
+def update_derived_replays_flow(
+    mode: str = "incremental",
+    t_from: Optional[datetime] = None,
+    t_to: Optional[datetime] = None,
+    only_missing: bool = True,
+):
+    """
+    mode="incremental": classify replays ingested since the last successful run
+        (watermark 'derived_replays' in analytics.snapshot_metadata).
+    mode="backfill": classify replays started in [t_from, t_to), default the last 7 days, one
+        BACKFILL_CHUNK at a time. only_missing=False recomputes replays already in derived.replays.
+    """
+    if mode == "incremental":
+        return update_derived_replays_incremental()
+    if mode != "backfill":
+        raise ValueError(f"unknown mode {mode!r}, expected 'incremental' or 'backfill'")
+
     now_utc = datetime.now(timezone.utc)
-    from_date = now_utc - timedelta(days=7)       # 7 days ago
-    update_derived_replays(from_date)
+    from_date = t_from or now_utc - timedelta(days=7)       # 7 days ago
+    to_date = t_to or now_utc + timedelta(days=1)           # tomorrow
+    return update_derived_replays(from_date, to_date, only_missing)
 
 
 if __name__ == "__main__":
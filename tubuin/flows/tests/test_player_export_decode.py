@@ -0,0 +1,138 @@
+# tubuin/flows/tests/test_player_export_decode.py
+# Measures the per page cost of turning a stored json_data text into a players.mpk record,
+# on synthetic pages shaped like analytics.player_page_json_v4 rows. No database needed.
+#
+#   python -m flows.tests.test_player_export_decode --pages 20000
+#
+#   stdlib    psycopg's default jsonb loader (json.loads) + msgpack.packb, the old export path
+#   orjson    RawJsonLoader text + orjson.loads + one reusable Packer, logic/player_export.py
+#   transcode a streaming JSON -> msgpack transcoder in pure Python, no page objects built
+#
+# Time is per page, peak is the largest traced allocation while a batch is encoded one page at
+# a time. All three must produce the same bytes.
+
+import re
+import sys
+import time
+import json
+import random
+import argparse
+import tracemalloc
+from datetime import date, timedelta
+
+import msgpack
+import orjson
+
+MODES = ["Duel", "Small Team", "Large Team", "FFA", "Team FFA"]
+FACTIONS = ["Armada", "Cortex", "Legion", "Random"]
+
+
+def synthetic_page(user_id: int, rng: random.Random) -> bytes:
+    today = date(2025, 6, 1)
+    modes = rng.sample(MODES, rng.randint(1, len(MODES)))
+    days = sorted({today - timedelta(days=rng.randint(0, 167)) for _ in range(rng.randint(1, 84))})
+    page = {
+        "_version": 1,
+        "userId": user_id,
+        "skillPerMode": {m: {"mode": m, "os": round(rng.uniform(0, 50), 1), "as": round(rng.uniform(0, 50), 2),
+                             "ga": rng.randint(0, 300), "wa": 0.51, "gb": rng.randint(0, 300), "wb": 0.47,
+                             "lastPlayed": days[-1].isoformat()} for m in modes},
+        "winLossSummary": {"total": {"wins": 120, "losses": 110, "games": 230, "winRate": 52.2},
+                           "perMode": {m: {"mode": m, "wins": 30, "losses": 20, "rate": 60.0} for m in modes}},
+        "matchHistory": [{"date": "01 Jun 2025", "mode": rng.choice(modes), "map": "Supreme Isthmus v2.1",
+                          "result": rng.choice(["Win", "Loss"]), "faction": rng.choice(FACTIONS),
+                          "ranked": True, "username": f"player{user_id}"} for _ in range(10)],
+        "usernames": [{"name": f"player{user_id}", "lastSeen": days[-1].isoformat()}],
+        "activityData": {d.isoformat(): {"games": rng.randint(1, 20), "avgSkill": round(rng.uniform(0, 50), 1)}
+                         for d in days},
+        "lobbyData": {m: [rng.randint(0, 40) for _ in range(30)] for m in ["All"] + modes},
+        "factionData": {m: {"labels": FACTIONS, "datasets": [
+            {"label": "Wins", "data": [rng.randint(0, 50) for _ in FACTIONS]},
+            {"label": "Losses", "data": [rng.randint(0, 50) for _ in FACTIONS]},
+        ]} for m in ["All"] + modes},
+        "skillHistory": {"labels": [(today - timedelta(days=167 - i)).isoformat() for i in range(168)],
+                         "datasets": [{"label": m, "data": [round(rng.uniform(0, 50), 1) for _ in range(168)]}
+                                      for m in modes]},
+    }
+    return orjson.dumps(page)
+
+
+# --- Streaming transcoder: JSON tokens straight to msgpack ---
+# msgpack writes a container's element count before its elements, so a single pass still has to
+# buffer every open container's encoded elements until its closing bracket.
+_TOKEN = re.compile(rb'\s*(?:([{}\[\],:])|"((?:[^"\\]|\\.)*)"|(-?\d+)(?![.eE\d])|(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)|(true|false|null))')
+_LITERALS = {b"true": True, b"false": False, b"null": None}
+
+
+def transcode(text: bytes, packer: msgpack.Packer) -> bytes:
+    stack = []  # [is_map, count, parts]
+    out = []
+    pos = 0
+    end = len(text)
+    while pos < end:
+        m = _TOKEN.match(text, pos)
+        if m is None:
+            if text[pos:].strip():
+                raise ValueError(f"bad JSON at {pos}")
+            break
+        pos = m.end()
+        punct, string, integer, number, literal = m.groups()
+        if punct in (b",", b":"):
+            continue
+        if punct in (b"{", b"["):
+            stack.append([punct == b"{", 0, []])
+            continue
+        if punct in (b"}", b"]"):
+            is_map, count, parts = stack.pop()
+            header = packer.pack_map_header(count // 2) if is_map else packer.pack_array_header(count)
+            encoded = header + b"".join(parts)
+        elif string is not None:
+            value = string.decode() if b"\\" not in string else json.loads(b'"' + string + b'"')
+            encoded = packer.pack(value)
+        elif integer is not None:
+            encoded = packer.pack(int(integer))
+        elif number is not None:
+            encoded = packer.pack(float(number))
+        else:
+            encoded = packer.pack(_LITERALS[literal])
+        if stack:
+            stack[-1][1] += 1
+            stack[-1][2].append(encoded)
+        else:
+            out.append(encoded)
+    return b"".join(out)
+
+
+def measure(name: str, encode, pages) -> bytes:
+    started = time.perf_counter()
+    records = [encode(p) for p in pages]
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    for p in pages[:2000]:
+        encode(p)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:10} {elapsed / len(pages) * 1e6:8.1f} us/page   peak {peak / 1024:8.1f} KiB")
+    return b"".join(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time json_data text -> msgpack record paths.")
+    parser.add_argument("--pages", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    pages = [synthetic_page(i, rng) for i in range(args.pages)]
+    print(f"--- {len(pages)} pages, {sum(map(len, pages)) / len(pages) / 1024:.1f} KiB JSON each ---")
+
+    packer = msgpack.Packer()
+    results = {
+        "stdlib": measure("stdlib", lambda p: msgpack.packb(json.loads(p)), pages),
+        "orjson": measure("orjson", lambda p: packer.pack(orjson.loads(p)), pages),
+        "transcode": measure("transcode", lambda p: transcode(p, packer), pages),
+    }
+    same = len(set(results.values())) == 1
+    print("--- records identical ---" if same else "--- records differ ---")
+    sys.exit(0 if same else 1)
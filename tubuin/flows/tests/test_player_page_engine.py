@@ -0,0 +1,148 @@
+# tubuin/flows/tests/test_player_page_engine.py
+# Parity check of the other player page engines against update_analytics_player_page_json.sql.
+# Runs the scanning SQL for one user_id hash shard inside a transaction that is rolled back,
+# builds the same users' pages with the engine under test and compares them component by
+# component. Nothing is written to the database.
+#
+#   --engine python  logic/player_engine.py, from the local match cache
+#   --engine daily   update_analytics_player_page_json_from_daily.sql, in its own rolled back
+#                    transaction; --build-days first rebuilds the window's days of
+#                    analytics.player_daily_stats in that transaction instead of using the
+#                    stored ones
+#
+#   python -m flows.tests.test_player_page_engine --num-shards 64 --refresh
+#   python -m flows.tests.test_player_page_engine --engine daily --num-shards 64 --build-days
+#
+# matchHistory and usernames can legitimately differ where two matches (or names) share the
+# exact same start_time: the SQL orders those ties arbitrarily.
+
+import sys
+import logging
+import argparse
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import orjson
+
+from config.db_conn import make_conn
+from sql.queries import (
+    update_analytics_player_daily_stats,
+    update_analytics_player_page_json,
+    update_analytics_player_page_json_from_daily,
+)
+from logic.match_cache import MATCH_CACHE_DIR, load_strings, load_window, refresh_match_cache
+from logic.player_engine import active_user_ids, build_pages, fetch_current_os
+from logic.player_windows import PRIMARY_WINDOW
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+COMPONENTS = (
+    "_version", "userId", "skillPerMode", "winLossSummary", "matchHistory",
+    "usernames", "activityData", "lobbyData", "factionData",
+)
+# Both SQL engines build skillHistoryRaw, the python engine leaves it to the upsert
+DAILY_COMPONENTS = COMPONENTS + ("skillHistoryRaw",)
+
+
+def sql_pages(
+    from_date: date,
+    to_date: date,
+    shard: int,
+    num_shards: int,
+    query: str = update_analytics_player_page_json,
+    build_days: bool = False,
+) -> dict:
+    with make_conn() as conn:
+        try:
+            with conn.cursor() as cur:
+                if build_days:
+                    for i in range((to_date - from_date).days + 1):
+                        cur.execute(update_analytics_player_daily_stats, {"day": from_date + timedelta(days=i)})
+                cur.execute(query, {
+                    "timestamptz_from": from_date.isoformat(),
+                    "timestamptz_to": to_date.isoformat(),
+                    # One window spanning the whole range; narrower ones are the same code on fewer days
+                    "window_keys": [PRIMARY_WINDOW],
+                    "window_froms": [from_date.isoformat()],
+                    "active_since": None,
+                    "shard": shard,
+                    "num_shards": num_shards,
+                })
+                # now() is fixed for the transaction, so this is exactly the rows just written
+                cur.execute(
+                    "SELECT user_id, json_data FROM analytics.player_page_json_v4 WHERE last_generated_at = now();"
+                )
+                return dict(cur.fetchall())
+        finally:
+            conn.rollback()
+
+
+def engine_pages(from_date: date, to_date: date, user_ids: np.ndarray) -> dict:
+    data = load_window(from_date, to_date, user_ids=user_ids)
+    engine_users = active_user_ids(data, None)
+    if not np.array_equal(engine_users, user_ids):
+        missing = np.setdiff1d(user_ids, engine_users)
+        extra = np.setdiff1d(engine_users, user_ids)
+        print(f"active users differ: {len(missing)} only in SQL {missing[:10]}, {len(extra)} only in the cache {extra[:10]}")
+    with make_conn() as conn:
+        current_os = fetch_current_os(conn, user_ids)
+    return dict(build_pages(data, load_strings(MATCH_CACHE_DIR), user_ids, current_os))
+
+
+def compare(expected: dict, actual: dict, show: int, components=COMPONENTS) -> int:
+    missing = sorted(set(expected) - set(actual))
+    extra = sorted(set(actual) - set(expected))
+    if missing or extra:
+        print(f"pages differ: {len(missing)} only in SQL {missing[:10]}, {len(extra)} only in the engine {extra[:10]}")
+    mismatches = {name: [] for name in components}
+    for user_id, page in expected.items():
+        built = actual.get(user_id, {})
+        for name in components:
+            # OPT_SORT_KEYS: jsonb orders object keys itself; 0 and 0.0 still compare unequal
+            want = orjson.dumps(page.get(name), option=orjson.OPT_SORT_KEYS)
+            got = orjson.dumps(built.get(name), option=orjson.OPT_SORT_KEYS)
+            if want != got:
+                mismatches[name].append((user_id, want, got))
+
+    failed = 0
+    for name, found in mismatches.items():
+        print(f"{name:16} {len(expected) - len(found)}/{len(expected)} equal")
+        failed += len(found)
+        for user_id, want, got in found[:show]:
+            print(f"  user {user_id}\n    sql:    {want[:400].decode()}\n    engine: {got[:400].decode()}")
+    return failed + len(extra)
+
+
+if __name__ == "__main__":
+    today = datetime.now(timezone.utc).date()
+    parser = argparse.ArgumentParser(description="Compare python or daily engine player pages with the SQL ones.")
+    parser.add_argument("--engine", choices=("python", "daily"), default="python")
+    parser.add_argument("--from-date", type=date.fromisoformat, default=today - timedelta(weeks=24))
+    parser.add_argument("--to-date", type=date.fromisoformat, default=today)
+    parser.add_argument("--shard", type=int, default=0, help="SQL hash shard to compare")
+    parser.add_argument("--num-shards", type=int, default=64, help="More shards, fewer users")
+    parser.add_argument("--refresh", action="store_true", help="Refresh the match cache first (python)")
+    parser.add_argument("--build-days", action="store_true", help="Rebuild the daily stats in the transaction (daily)")
+    parser.add_argument("--show", type=int, default=3, help="Mismatches printed per component")
+    args = parser.parse_args()
+
+    if args.refresh and args.engine == "python":
+        print(refresh_match_cache(args.from_date, args.to_date))
+    expected = sql_pages(args.from_date, args.to_date, args.shard, args.num_shards)
+    print(f"--- SQL built {len(expected)} pages for shard {args.shard}/{args.num_shards} ---")
+    if args.engine == "python":
+        actual = engine_pages(args.from_date, args.to_date, np.array(sorted(expected), dtype=np.int32))
+        failed = compare(expected, actual, args.show)
+    else:
+        actual = sql_pages(
+            args.from_date, args.to_date, args.shard, args.num_shards,
+            query=update_analytics_player_page_json_from_daily, build_days=args.build_days,
+        )
+        print(f"--- daily built {len(actual)} pages ---")
+        failed = compare(expected, actual, args.show, DAILY_COMPONENTS)
+    print("--- parity OK ---" if not failed else f"--- {failed} component mismatches ---")
+    sys.exit(1 if failed else 0)
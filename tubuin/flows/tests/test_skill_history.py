@@ -0,0 +1,132 @@
+# tubuin/flows/tests/test_skill_history.py
+# Offline check of logic/skill_history.py densify_skill_histories against a day by day
+# reference of the SQL grid it replaced:
+#   COALESCE(avg, LAG(avg, 1, 0.0) OVER (PARTITION BY user, category ORDER BY day))
+# over every day of the window, avg NULL on days without snapshots. No database needed.
+#
+#   python -m flows.tests.test_skill_history --random 2000
+#
+# The fixed cases cover gaps, single days, both window edges, snapshots outside the window,
+# the one day carry, empty series and pages stored before skillHistoryRaw existed.
+
+import sys
+import copy
+import random
+import argparse
+from datetime import date, timedelta
+
+import orjson
+
+from logic.skill_history import DENSE_KEY, RAW_KEY, densify_skill_histories
+
+FROM_DATE = date(2025, 3, 1)
+TO_DATE = date(2025, 3, 10)
+
+
+def reference_skill_history(raw, from_date: date, to_date: date):
+    # One row per day and category, like the grid the query used to build
+    days = [from_date + timedelta(days=i) for i in range((to_date - from_date).days + 1)]
+    datasets = []
+    for category, series in sorted((raw or {}).items()):
+        avg = dict(zip(series["dates"], series["skills"]))
+        data = []
+        for i, day in enumerate(days):
+            value = avg.get(day.isoformat())
+            if value is None:
+                # LAG(avg, 1, 0.0): the previous row's avg, which may be NULL itself; 0.0 on the first row
+                value = avg.get(days[i - 1].isoformat()) if i else 0.0
+            data.append(value)
+        datasets.append({"data": data, "label": category})
+    if not datasets:
+        return {"labels": [], "datasets": []}
+    return {"labels": [d.isoformat() for d in days], "datasets": datasets}
+
+
+def raw_series(days_and_skills):
+    return {
+        "dates": [(FROM_DATE + timedelta(days=d)).isoformat() for d, _ in days_and_skills],
+        "skills": [s for _, s in days_and_skills],
+    }
+
+
+CASES = {
+    "gaps": {"Duel": raw_series([(1, 20.5), (2, 21.0), (5, 22.0), (9, 23.5)])},
+    "single day": {"Duel": raw_series([(4, 30.0)])},
+    "first day": {"Duel": raw_series([(0, 10.0), (3, 11.0)])},
+    "last day": {"Duel": raw_series([(9, 12.5)])},
+    "every day": {"Duel": raw_series([(d, 15.0 + d) for d in range(10)])},
+    "outside window": {"Duel": raw_series([(-3, 1.0), (-1, 2.0), (2, 3.0), (10, 4.0), (12, 5.0)])},
+    "only outside window": {"Duel": raw_series([(-1, 2.0), (10, 4.0)])},
+    "categories": {
+        "Small Team": raw_series([(0, 18.0), (1, 18.5)]),
+        "Duel": raw_series([(7, 25.0)]),
+        "FFA": raw_series([]),
+    },
+    "empty": {},
+    "null": None,
+}
+
+
+def check(pages, from_date: date, to_date: date) -> int:
+    expected = [reference_skill_history(p.get(RAW_KEY), from_date, to_date) if RAW_KEY in p else p.get(DENSE_KEY)
+                for p in pages]
+    densified = densify_skill_histories(copy.deepcopy(pages), from_date, to_date)
+    failed = 0
+    for page, want, got in zip(pages, expected, densified):
+        problems = []
+        if RAW_KEY in got:
+            problems.append(f"{RAW_KEY} left in the page")
+        if orjson.dumps(got.get(DENSE_KEY)) != orjson.dumps(want):
+            problems.append(f"\n    want: {orjson.dumps(want)[:400].decode()}"
+                            f"\n    got:  {orjson.dumps(got.get(DENSE_KEY))[:400].decode()}")
+        # The page keeps jsonb's key order: by length, then bytewise
+        keys = list(got)
+        if keys != sorted(keys, key=lambda k: (len(k.encode()), k.encode())) and RAW_KEY in page:
+            problems.append(f"keys out of jsonb order: {keys}")
+        if problems:
+            failed += 1
+            print(f"  user {page['userId']}: {' '.join(problems)}")
+    return failed
+
+
+def random_pages(count: int, rng: random.Random):
+    pages = []
+    for user_id in range(count):
+        raw = {}
+        for category in rng.sample(["Duel", "Small Team", "Large Team", "FFA"], rng.randint(0, 4)):
+            offsets = sorted(rng.sample(range(-3, 13), rng.randint(0, 8)))
+            raw[category] = raw_series([(d, round(rng.uniform(0, 50), 1)) for d in offsets])
+        pages.append({"userId": user_id, "_version": 1, RAW_KEY: raw})
+    return pages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare densify_skill_histories with the SQL LAG grid.")
+    parser.add_argument("--random", type=int, default=1000, help="Random pages checked after the fixed cases")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    failed = 0
+    for user_id, (name, raw) in enumerate(CASES.items()):
+        result = check([{"userId": user_id, "_version": 1, RAW_KEY: raw}], FROM_DATE, TO_DATE)
+        print(f"{name:20} {'ok' if not result else 'FAILED'}")
+        failed += result
+
+    # One batch mixing pages with and without skillHistoryRaw, an old page keeps its skillHistory
+    old = {"userId": 100, "_version": 1, DENSE_KEY: {"labels": ["2025-01-01"], "datasets": []}}
+    batch = [{"userId": 101, RAW_KEY: CASES["gaps"]}, old, {"userId": 102, RAW_KEY: CASES["categories"]}]
+    result = check(batch, FROM_DATE, TO_DATE)
+    print(f"{'mixed batch':20} {'ok' if not result else 'FAILED'}")
+    failed += result
+
+    result = check([{"userId": 200, RAW_KEY: CASES["single day"]}], FROM_DATE + timedelta(days=4), FROM_DATE + timedelta(days=4))
+    print(f"{'one day window':20} {'ok' if not result else 'FAILED'}")
+    failed += result
+
+    rng = random.Random(args.seed)
+    result = check(random_pages(args.random, rng), FROM_DATE, TO_DATE)
+    print(f"{f'{args.random} random pages':20} {'ok' if not result else f'{result} FAILED'}")
+    failed += result
+
+    print("--- densify OK ---" if not failed else f"--- {failed} pages differ ---")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,135 @@
+# tubuin\logic\artifact_manifest.py
+# artifacts.manifest.json lists every file of the current player artifact with its sha256, size
+# and record count, under a version that goes up with each publish, also past the server's
+# version after the local output directory was wiped. The uploader compares it with the
+# manifest already on the server, uploads only the files whose hash changed and publishes by
+# replacing the manifest last, in one mv.
+#
+# With ARTIFACT_PUBLISH=manifest every file is stored under a content-addressed object name
+# (players.mpk -> players.<sha256[:16]>.mpk), so a new version never overwrites a file a reader
+# of the previous version may still be opening; readers go through the manifest. Objects the
+# previous version dropped are deleted one publish later. ARTIFACT_PUBLISH=files keeps the
+# fixed names for readers that don't read the manifest yet: changed files are uploaded under
+# staged names and renamed over the live ones in the same command as the manifest.
+
+import os
+import hashlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+
+# --- Configuration ---
+MANIFEST_FILENAME = "artifacts.manifest.json"
+MANIFEST_FORMAT = 1
+ARTIFACT_PUBLISH = os.getenv("ARTIFACT_PUBLISH", "files")  # files | manifest
+HASH_CHUNK_BYTES = 4 * 1024 * 1024
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def object_name(name: str, sha256: str, publish: str = ARTIFACT_PUBLISH) -> str:
+    if publish == "files":
+        return name
+    stem, dot, suffixes = name.partition(".")
+    return f"{stem}.{sha256[:16]}{dot}{suffixes}"
+
+
+def load_manifest(path: Path) -> Optional[Dict[str, Any]]:
+    path = Path(path)
+    if not path.exists():
+        return None
+    return orjson.loads(path.read_bytes())
+
+
+def write_manifest(path: Path, manifest: Dict[str, Any]) -> Path:
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def build_manifest(
+    output_dir: Path,
+    names: Iterable[str],
+    records: Optional[Dict[str, int]] = None,
+    publish: str = ARTIFACT_PUBLISH,
+) -> Path:
+    """
+    Writes artifacts.manifest.json for the given files in output_dir, one version above the
+    previous local manifest (plan_publish raises it above the server's). Hashes of files whose size and mtime match the previous manifest
+    are reused instead of reading the file again (the unchanged base segment, say).
+    """
+    if publish not in ("files", "manifest"):
+        raise ValueError(f"unknown ARTIFACT_PUBLISH {publish!r}, expected files or manifest")
+    output_dir = Path(output_dir)
+    path = output_dir / MANIFEST_FILENAME
+    previous = load_manifest(path) or {}
+    previous_files = previous.get("files", {})
+    records = records or {}
+
+    files = {}
+    for name in names:
+        stat = (output_dir / name).stat()
+        cached = previous_files.get(name)
+        if cached and cached["size"] == stat.st_size and cached.get("mtime_ns") == stat.st_mtime_ns:
+            sha = cached["sha256"]
+        else:
+            sha = sha256_file(output_dir / name)
+            cached = None
+        files[name] = {
+            "object": object_name(name, sha, publish),
+            "sha256": sha,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "records": records.get(name, cached.get("records") if cached else None),
+        }
+
+    return write_manifest(path, {
+        "format": MANIFEST_FORMAT,
+        "version": previous.get("version", 0) + 1,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "publish": publish,
+        "files": files,
+        "retired": [],
+    })
+
+
+def plan_publish(local: Dict[str, Any], remote: Optional[Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+    """
+    Returns (names to upload, objects to delete after the manifest swap) and fills in
+    local["retired"]: the remote version's objects this version no longer references.
+    Those are only deleted by the publish after this one, so a reader that loaded the
+    previous manifest just before the swap can still open its files. local["version"] is
+    raised above the remote one if a fresh output directory started counting at 1 again.
+    """
+    remote = remote or {}
+    local["version"] = max(local["version"], remote.get("version", 0) + 1)
+    remote_files = remote.get("files", {})
+    current_objects = {entry["object"] for entry in local["files"].values()}
+
+    to_upload = [
+        name for name, entry in local["files"].items()
+        if remote_files.get(name, {}).get("sha256") != entry["sha256"]
+        or remote_files.get(name, {}).get("object") != entry["object"]
+    ]
+    if local.get("publish") == "manifest":
+        local["retired"] = sorted(
+            {entry["object"] for entry in remote_files.values()} - current_objects
+        )
+        to_delete = sorted(set(remote.get("retired", [])) - current_objects)
+    else:
+        local["retired"] = []
+        to_delete = []
+    return to_upload, to_delete
@@ -0,0 +1,175 @@
+# tubuin\logic\ingest_manifest.py
+# Durable record of what the meta ingest has done, so a rerun after a crash only pays for the delta.
+# Files are keyed by (filename, sha256): a file whose content already committed to Postgres is
+# never sent again, it only gets its pending move/archive finished.
+
+import os
+import sqlite3
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+MANIFEST_FILENAME = "ingest_manifest.sqlite3"
+PRUNE_AFTER_DAYS = 7  # Finished file entries are only needed for crash recovery
+
+# commit_status values
+PENDING = "pending"
+COMMITTED = "committed"
+DUPLICATE = "duplicate"  # replay_id was already in the DB
+FAILED = "failed"
+COMMITTED_STATUSES = (COMMITTED, DUPLICATE)
+
+# move_status values
+MOVE_PENDING = "pending"
+MOVE_DONE = "done"
+
+FileKey = Tuple[str, str]  # (filename, sha256)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id       TEXT PRIMARY KEY,
+    started_at   TEXT NOT NULL,
+    finished_at  TEXT,
+    files        INTEGER,
+    bytes        INTEGER,
+    inserted     INTEGER,
+    skipped      INTEGER,
+    reconciled   INTEGER,
+    elapsed_s    REAL
+);
+CREATE TABLE IF NOT EXISTS files (
+    filename       TEXT NOT NULL,
+    sha256         TEXT NOT NULL,
+    replay_id      TEXT,
+    batch_id       TEXT NOT NULL,
+    run_id         TEXT NOT NULL,
+    commit_status  TEXT NOT NULL,
+    move_status    TEXT NOT NULL,
+    updated_at     TEXT NOT NULL,
+    PRIMARY KEY (filename, sha256)
+);
+CREATE INDEX IF NOT EXISTS files_move_status_idx ON files (move_status, commit_status);
+"""
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class IngestManifest:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.row_factory = sqlite3.Row
+        # WAL + FULL sync: every commit survives a crash or power loss
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self.run_id = None
+
+    # --- Runs ---
+    def begin_run(self) -> str:
+        self.run_id = uuid.uuid4().hex
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO runs (run_id, started_at) VALUES (?, ?)", (self.run_id, _now())
+            )
+        return self.run_id
+
+    def finish_run(self, files: int, bytes_read: int, inserted: int, skipped: int, reconciled: int, elapsed_s: float):
+        with self._conn:
+            self._conn.execute(
+                """
+                UPDATE runs
+                SET finished_at = ?, files = ?, bytes = ?, inserted = ?, skipped = ?, reconciled = ?, elapsed_s = ?
+                WHERE run_id = ?
+                """,
+                (_now(), files, bytes_read, inserted, skipped, reconciled, elapsed_s, self.run_id),
+            )
+
+    def recent_runs(self, limit: int = 10) -> List[sqlite3.Row]:
+        cur = self._conn.execute(
+            "SELECT * FROM runs WHERE finished_at IS NOT NULL ORDER BY started_at DESC LIMIT ?", (limit,)
+        )
+        return cur.fetchall()
+
+    # --- Files ---
+    def lookup(self, keys: Iterable[FileKey]) -> Dict[FileKey, Tuple[str, str]]:
+        """
+        Returns {(filename, sha256): (commit_status, move_status)} for keys already in the manifest.
+        """
+        found = {}
+        for filename, sha256 in keys:
+            row = self._conn.execute(
+                "SELECT commit_status, move_status FROM files WHERE filename = ? AND sha256 = ?",
+                (filename, sha256),
+            ).fetchone()
+            if row:
+                found[(filename, sha256)] = (row[0], row[1])
+        return found
+
+    def record_batch(self, batch_id: str, entries: Iterable[Tuple[str, str, str]]):
+        """
+        Registers (filename, sha256, replay_id) entries as pending before anything is sent.
+        Entries already in the manifest keep their status.
+        """
+        now = _now()
+        with self._conn:
+            self._conn.executemany(
+                """
+                INSERT INTO files (filename, sha256, replay_id, batch_id, run_id, commit_status, move_status, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (filename, sha256) DO UPDATE SET batch_id = excluded.batch_id, run_id = excluded.run_id, updated_at = excluded.updated_at
+                """,
+                [(f, h, rid, batch_id, self.run_id, PENDING, MOVE_PENDING, now) for f, h, rid in entries],
+            )
+
+    def mark_commit_status(self, updates: Iterable[Tuple[FileKey, str]]):
+        now = _now()
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE files SET commit_status = ?, updated_at = ? WHERE filename = ? AND sha256 = ?",
+                [(status, now, f, h) for (f, h), status in updates],
+            )
+
+    def mark_moved(self, keys: Iterable[FileKey]):
+        now = _now()
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE files SET move_status = ?, updated_at = ? WHERE filename = ? AND sha256 = ?",
+                [(MOVE_DONE, now, f, h) for f, h in keys],
+            )
+
+    def reconcile(self, metas_dir: Path) -> int:
+        """
+        Settles entries that committed but never recorded their move. If the file is gone it was
+        moved before the crash; if it is still there the next batch skips the DB and moves it.
+        Returns how many committed files are still waiting to be moved.
+        """
+        rows = self._conn.execute(
+            "SELECT filename, sha256 FROM files WHERE move_status = ? AND commit_status IN (?, ?)",
+            (MOVE_PENDING, *COMMITTED_STATUSES),
+        ).fetchall()
+        gone = [(f, h) for f, h in rows if not os.path.exists(os.path.join(metas_dir, f))]
+        if gone:
+            self.mark_moved(gone)
+        return len(rows) - len(gone)
+
+    def prune(self, max_age_days: int = PRUNE_AFTER_DAYS) -> int:
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=max_age_days)).isoformat()
+        with self._conn:
+            cur = self._conn.execute(
+                "DELETE FROM files WHERE move_status = ? AND updated_at < ?", (MOVE_DONE, cutoff)
+            )
+        return cur.rowcount
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
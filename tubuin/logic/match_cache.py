@@ -0,0 +1,282 @@
+# tubuin\logic\match_cache.py
+# Local columnar copy of the match facts the player page query rescans for every component
+# (derived.match_players_unlogged joined to derived.replays), one directory of .npy column files
+# per day, loaded memory-mapped by logic/player_engine.py.
+#
+#   match_cache/cache.json              time zone, days held and when each was last exported
+#   match_cache/strings.json            append-only string tables of the text columns
+#   match_cache/2025-06-01/user_id.npy  one file per column, rows in no particular order
+#
+# Days are session time zone days, the same date_trunc('day', start_time) the SQL uses, so the
+# engine reads every date it prints off the partition instead of converting timestamps. A
+# refresh exports the window's missing days and re-exports recent ones until a refresh ran
+# MATCH_CACHE_SETTLE after the day ended (replays are ingested late), and drops days that left
+# the window. Changing the database time zone empties the cache.
+
+import os
+import shutil
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import orjson
+
+from config import db_conn
+
+# --- Configuration ---
+MATCH_CACHE_DIR = os.getenv("MATCH_CACHE_DIR", "./match_cache")
+MATCH_CACHE_SETTLE = timedelta(hours=36)  # Same lookback as the delta player page rebuild
+MATCH_CACHE_FETCH_ROWS = 50000
+CACHE_FORMAT = 1
+STATE_FILENAME = "cache.json"
+STRINGS_FILENAME = "strings.json"
+
+COLUMNS = {
+    "user_id": np.int32,
+    "start_time": np.int64,  # microseconds since the epoch
+    "category": np.int16,  # codes into strings.json, -1 is NULL
+    "map_name": np.int32,
+    "ranked": np.int8,  # 1 / 0, -1 is NULL
+    "avg_lobby_skill": np.float32,  # NaN is NULL
+    "skill": np.float32,
+    "won": np.int8,
+    "faction": np.int16,
+    "name": np.int32,
+}
+STRING_COLUMNS = ("category", "map_name", "faction", "name")
+COLLATED_COLUMNS = ("category", "faction")  # the SQL sorts these, the engine needs the same order
+
+# Same rows as all_relevant_matches in update_analytics_player_page_json.sql, category NULL
+# included since active_users counts those matches too
+MATCH_CACHE_DAY_QUERY = """
+    SELECT
+        mpu.user_id,
+        (extract(epoch FROM r.start_time) * 1000000)::bigint AS start_time,
+        r.category, r.map_name, r.ranked, r.avg_lobby_skill,
+        mpu.skill, mpu.won, mpu.faction, mpu.name
+    FROM derived.match_players_unlogged mpu
+    JOIN derived.replays r ON mpu.replay_id = r.replay_id AND mpu.start_time = r.start_time
+    WHERE mpu.user_id IS NOT NULL
+      AND r.start_time >= %(day)s::date::timestamptz
+      AND r.start_time < (%(day)s::date + 1)::timestamptz
+      AND mpu.start_time >= %(day)s::date::timestamptz
+      AND mpu.start_time < (%(day)s::date + 1)::timestamptz;
+"""
+COLLATION_ORDER_QUERY = "SELECT array_agg(s ORDER BY s) FROM unnest(%(values)s::text[]) AS s;"
+
+logger = logging.getLogger(__name__)
+
+
+def _write_json_atomically(path: Path, data: Any):
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(data))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class StringTable:
+    """
+    One text column's values, coded by first appearance. Codes never change, so a refresh
+    only appends and older day files stay valid. rank[code] is the value's position in the
+    database's ORDER BY.
+    """
+
+    def __init__(self, values: Optional[List[str]] = None, rank: Optional[List[int]] = None):
+        self.values = list(values or [])
+        self.rank = np.asarray(rank if rank is not None else [], dtype=np.int32)
+        self._codes = {v: i for i, v in enumerate(self.values)}
+
+    def encode(self, values: Iterable[Optional[str]]) -> List[int]:
+        codes = []
+        for value in values:
+            if value is None:
+                codes.append(-1)
+                continue
+            code = self._codes.get(value)
+            if code is None:
+                code = self._codes[value] = len(self.values)
+                self.values.append(value)
+            codes.append(code)
+        return codes
+
+    def decode(self, code: int) -> Optional[str]:
+        return self.values[code] if code >= 0 else None
+
+
+def load_strings(cache_dir: Path) -> Dict[str, StringTable]:
+    path = Path(cache_dir) / STRINGS_FILENAME
+    data = orjson.loads(path.read_bytes()) if path.exists() else {}
+    return {
+        column: StringTable(data.get(column, {}).get("values"), data.get(column, {}).get("rank"))
+        for column in STRING_COLUMNS
+    }
+
+
+def save_strings(cache_dir: Path, strings: Dict[str, StringTable]):
+    _write_json_atomically(Path(cache_dir) / STRINGS_FILENAME, {
+        column: {"values": table.values, "rank": table.rank.tolist()}
+        for column, table in strings.items()
+    })
+
+
+def load_state(cache_dir: Path) -> Dict[str, Any]:
+    path = Path(cache_dir) / STATE_FILENAME
+    state = orjson.loads(path.read_bytes()) if path.exists() else None
+    if not state or state.get("format") != CACHE_FORMAT:
+        return {"format": CACHE_FORMAT, "timezone": None, "days": {}}
+    return state
+
+
+def _to_column(values: List[Any], column: str) -> np.ndarray:
+    dtype = COLUMNS[column]
+    if dtype is np.float32:
+        return np.array([np.nan if v is None else v for v in values], dtype=dtype)
+    if column in ("ranked", "won"):
+        return np.array([-1 if v is None else int(v) for v in values], dtype=dtype)
+    return np.array(values, dtype=dtype)
+
+
+def _export_day(conn, day: date, strings: Dict[str, StringTable]) -> Dict[str, np.ndarray]:
+    names = list(COLUMNS)
+    chunks: Dict[str, List[np.ndarray]] = {name: [] for name in names}
+    with conn.cursor(name=f"match_cache_{day:%Y%m%d}") as cur:
+        cur.execute(MATCH_CACHE_DAY_QUERY, {"day": day})
+        while rows := cur.fetchmany(MATCH_CACHE_FETCH_ROWS):
+            for name, values in zip(names, zip(*rows)):
+                if name in STRING_COLUMNS:
+                    values = strings[name].encode(values)
+                chunks[name].append(_to_column(list(values), name))
+    return {
+        name: np.concatenate(parts) if parts else np.empty(0, dtype=COLUMNS[name])
+        for name, parts in chunks.items()
+    }
+
+
+def _write_day(cache_dir: Path, day: date, columns: Dict[str, np.ndarray]):
+    # Written next to the old directory and swapped in, a reader sees either one whole
+    day_dir = cache_dir / day.isoformat()
+    tmp_dir = cache_dir / f".{day.isoformat()}.tmp"
+    old_dir = cache_dir / f".{day.isoformat()}.old"
+    for leftover in (tmp_dir, old_dir):  # from a run that died mid-swap
+        shutil.rmtree(leftover, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    for name, values in columns.items():
+        np.save(tmp_dir / f"{name}.npy", values)
+    if day_dir.exists():
+        os.replace(day_dir, old_dir)
+    os.replace(tmp_dir, day_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def _settled(day: date, refreshed_at: str, tz: ZoneInfo) -> bool:
+    day_end = datetime.combine(day + timedelta(days=1), time(), tz)
+    return datetime.fromisoformat(refreshed_at) >= day_end + MATCH_CACHE_SETTLE
+
+
+def refresh_match_cache(
+    from_date: date,
+    to_date: date,
+    cache_dir: Path = MATCH_CACHE_DIR,
+    full_rebuild: bool = False,
+    logger=logger,
+) -> Dict[str, int]:
+    """
+    Brings the cache to the window from_date..to_date (both inclusive). Returns the number of
+    days exported, kept and dropped.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    state = load_state(cache_dir)
+    strings = load_strings(cache_dir)
+
+    with db_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT current_setting('TimeZone');")
+            tz_name = cur.fetchone()[0]
+        if full_rebuild or state["timezone"] != tz_name:
+            if state["days"]:
+                logger.info(f"Match cache: rebuilding ({'asked' if full_rebuild else f'time zone is now {tz_name}'})")
+            state = {"format": CACHE_FORMAT, "timezone": tz_name, "days": {}}
+        tz = ZoneInfo(tz_name)
+
+        window = [from_date + timedelta(days=i) for i in range((to_date - from_date).days + 1)]
+        stale = [d for d in state["days"] if not from_date <= date.fromisoformat(d) <= to_date]
+        todo = [
+            d for d in window
+            if d.isoformat() not in state["days"]
+            or not (cache_dir / d.isoformat()).is_dir()
+            or not _settled(d, state["days"][d.isoformat()]["refreshed_at"], tz)
+        ]
+        logger.info(
+            f"Match cache: {len(todo)} days to export, {len(window) - len(todo)} kept, {len(stale)} dropped"
+        )
+
+        for day in todo:
+            refreshed_at = datetime.now(timezone.utc).isoformat()  # before the read, errs on re-exporting
+            columns = _export_day(conn, day, strings)
+            conn.commit()  # one snapshot per day, not one transaction held across the whole export
+            # Codes first: a day file never references a string the table doesn't hold yet
+            save_strings(cache_dir, strings)
+            _write_day(cache_dir, day, columns)
+            state["days"][day.isoformat()] = {"rows": int(len(columns["user_id"])), "refreshed_at": refreshed_at}
+            _write_json_atomically(cache_dir / STATE_FILENAME, state)
+            logger.info(f"Match cache: {day} exported, {len(columns['user_id'])} rows")
+
+        for column in COLLATED_COLUMNS:
+            table = strings[column]
+            if len(table.rank) != len(table.values):
+                with conn.cursor() as cur:
+                    cur.execute(COLLATION_ORDER_QUERY, {"values": table.values})
+                    ordered = cur.fetchone()[0] or []
+                position = {v: i for i, v in enumerate(ordered)}
+                table.rank = np.array([position[v] for v in table.values], dtype=np.int32)
+        save_strings(cache_dir, strings)
+
+    for day in stale:
+        state["days"].pop(day)
+    _write_json_atomically(cache_dir / STATE_FILENAME, state)
+    for day in stale:
+        shutil.rmtree(cache_dir / day, ignore_errors=True)
+    return {"exported": len(todo), "kept": len(window) - len(todo), "dropped": len(stale)}
+
+
+def load_window(
+    from_date: date,
+    to_date: date,
+    cache_dir: Path = MATCH_CACHE_DIR,
+    shard: int = 0,
+    num_shards: int = 1,
+    user_ids: Optional[np.ndarray] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Reads the window's rows of the players in user_id shard (mod num_shards) and, if given,
+    in user_ids, as one array per column plus "day" (days since the epoch). Raises if a day of
+    the window is not in the cache.
+    """
+    cache_dir = Path(cache_dir)
+    state = load_state(cache_dir)
+    epoch = date(1970, 1, 1)
+    parts: Dict[str, List[np.ndarray]] = {name: [] for name in list(COLUMNS) + ["day"]}
+    for i in range((to_date - from_date).days + 1):
+        day = from_date + timedelta(days=i)
+        if day.isoformat() not in state["days"]:
+            raise FileNotFoundError(f"match cache has no {day}, refresh it for this window first")
+        day_dir = cache_dir / day.isoformat()
+        users = np.load(day_dir / "user_id.npy", mmap_mode="r")
+        keep = np.ones(len(users), dtype=bool)
+        if num_shards > 1:
+            keep &= users % num_shards == shard
+        if user_ids is not None:
+            keep &= np.isin(users, user_ids)
+        for name in COLUMNS:
+            parts[name].append(np.load(day_dir / f"{name}.npy", mmap_mode="r")[keep])
+        parts["day"].append(np.full(int(keep.sum()), (day - epoch).days, dtype=np.int32))
+    return {
+        name: np.concatenate(arrays) if arrays else np.empty(0, dtype=COLUMNS.get(name, np.int32))
+        for name, arrays in parts.items()
+    }
@@ -0,0 +1,192 @@
+# tubuin\logic\player_artifact.py
+# Incremental players.mpk: a base segment plus one append-only delta segment per run holding
+# only the players whose page changed. The index keeps the existing [offset, length] shape,
+# offsets address the segments as if they were concatenated in manifest order, and always
+# point at a player's newest record. players.segments.json names the current files and is
+# written (and uploaded) last, so a consumer reloading from it never sees a half-written set.
+#
+#   players-g000003-0000.mpk           base of generation 3
+#   players-g000003-0001.mpk           delta of the run after it
+#   players-g000003-0001.index.json    index as of that run (and/or .index.bin)
+#   players-g000003.dict               zstd dictionary, when the records are compressed
+
+import os
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+
+from logic.player_index import PlayerIndex, PlayerIndexWriter
+
+# --- Configuration ---
+SEGMENTS_FILENAME = "players.segments.json"
+DELTA_COMPACT_RATIO = 0.25  # Compact once the deltas add up to this fraction of the base
+MAX_DELTA_SEGMENTS = 48  # ... or once there are this many of them
+COPY_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def segment_name(generation: int, seq: int) -> str:
+    return f"players-g{generation:06d}-{seq:04d}.mpk"
+
+
+def index_names(generation: int, seq: int) -> Dict[str, str]:
+    stem = f"players-g{generation:06d}-{seq:04d}"
+    return {"json": f"{stem}.index.json", "binary": f"{stem}.index.bin"}
+
+
+@dataclass
+class Segment:
+    name: str
+    size: int
+
+
+@dataclass
+class ArtifactState:
+    """
+    Contents of players.segments.json. generated_through is the newest last_generated_at
+    exported so far; the next run exports pages generated at or after it.
+    """
+    from_date: str
+    to_date: str
+    generation: int
+    seq: int
+    generated_through: Optional[str]
+    segments: List[Segment] = field(default_factory=list)
+    index: Dict[str, Optional[str]] = field(default_factory=dict)  # format -> file name
+    codec: str = "msgpack"  # record encoding, see logic/player_codec.py
+    dictionary: Optional[str] = None  # zstd dictionary every segment of the generation uses
+
+    @property
+    def base_size(self) -> int:
+        return self.segments[0].size if self.segments else 0
+
+    @property
+    def total_size(self) -> int:
+        return sum(s.size for s in self.segments)
+
+    @property
+    def delta_size(self) -> int:
+        return self.total_size - self.base_size
+
+    def needs_compaction(self) -> bool:
+        deltas = len(self.segments) - 1
+        if deltas <= 0:
+            return False
+        return deltas >= MAX_DELTA_SEGMENTS or self.delta_size > DELTA_COMPACT_RATIO * self.base_size
+
+    def file_names(self) -> List[str]:
+        names = [s.name for s in self.segments] + [n for n in self.index.values() if n]
+        return names + [self.dictionary] if self.dictionary else names
+
+    def locate(self, offset: int) -> Tuple[str, int]:
+        """
+        Maps an index offset to (segment name, offset inside that segment).
+        """
+        start = 0
+        for segment in self.segments:
+            if offset < start + segment.size:
+                return segment.name, offset - start
+            start += segment.size
+        raise ValueError(f"offset {offset} is past the end of the artifact ({start} bytes)")
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["ArtifactState"]:
+        path = Path(path)
+        if not path.exists():
+            return None
+        data = orjson.loads(path.read_bytes())
+        data["segments"] = [Segment(**s) for s in data.get("segments", [])]
+        return cls(**data)
+
+    def save(self, path: Path):
+        path = Path(path)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(asdict(self), option=orjson.OPT_INDENT_2))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+def load_index(output_dir: Path, state: ArtifactState) -> PlayerIndexWriter:
+    # The binary index is always kept locally, it is the cheap one to reload
+    with PlayerIndex(Path(output_dir) / state.index["binary_local"]) as index:
+        return PlayerIndexWriter.from_index(index)
+
+
+def write_indexes(
+    output_dir: Path,
+    state: ArtifactState,
+    index: PlayerIndexWriter,
+    formats: Tuple[str, ...],
+):
+    """
+    Writes the run's index files and records them on state. "binary_local" is the copy the
+    next run reloads from; it is only listed for upload when "binary" is one of formats.
+    """
+    names = index_names(state.generation, state.seq)
+    index.write_binary(Path(output_dir) / names["binary"], mpk_size=state.total_size)
+    if "json" in formats:
+        index.write_json(Path(output_dir) / names["json"])
+    state.index = {
+        "json": names["json"] if "json" in formats else None,
+        "binary": names["binary"] if "binary" in formats else None,
+        "binary_local": names["binary"],
+    }
+
+
+def compact(output_dir: Path, state: ArtifactState, index: PlayerIndexWriter) -> Tuple[ArtifactState, PlayerIndexWriter]:
+    """
+    Rewrites the newest record of every indexed player into a new base segment of the next
+    generation, dropping the superseded records. Returns the new state and index; the caller
+    writes the indexes and saves the state, the old generation's files stay until then.
+    """
+    output_dir = Path(output_dir)
+    new_state = ArtifactState(
+        from_date=state.from_date,
+        to_date=state.to_date,
+        generation=state.generation + 1,
+        seq=0,
+        generated_through=state.generated_through,
+        codec=state.codec,
+        dictionary=state.dictionary,  # records are copied as they are, still need it
+    )
+    new_index = PlayerIndexWriter()
+    base_path = output_dir / segment_name(new_state.generation, 0)
+
+    # Copy in offset order, so each source segment is read front to back once
+    order = sorted(range(len(index)), key=index.offsets.__getitem__)
+    handles = {}
+    written = 0
+    try:
+        with open(base_path, "wb") as f_out:
+            for slot in order:
+                name, local_offset = state.locate(index.offsets[slot])
+                f_in = handles.get(name)
+                if f_in is None:
+                    f_in = handles[name] = open(output_dir / name, "rb", buffering=COPY_CHUNK_BYTES)
+                f_in.seek(local_offset)
+                length = index.lengths[slot]
+                record = f_in.read(length)
+                if len(record) != length:
+                    raise ValueError(f"{name}: short read at {local_offset}, segment is truncated")
+                f_out.write(record)
+                new_index.add(index.user_ids[slot], written, length)
+                written += length
+            f_out.flush()
+            os.fsync(f_out.fileno())
+    finally:
+        for f_in in handles.values():
+            f_in.close()
+
+    new_state.segments = [Segment(base_path.name, written)]
+    return new_state, new_index
+
+
+def remove_files(output_dir: Path, names: List[str]):
+    for name in names:
+        try:
+            (Path(output_dir) / name).unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,155 @@
+# tubuin\logic\player_codec.py
+# Record encoding of players.mpk. Version 1 records are plain msgpack.packb(page). Version 2
+# records are msgpack compressed as independent zstd frames with a dictionary trained on a
+# sample of the pages being written, so every record still decompresses on its own (random
+# access through the index) while the keys and mode names repeated in every page cost
+# next to nothing. The index lengths are the stored, compressed lengths.
+# players.format.json says which version a file set uses and names the dictionary.
+#
+# zstd needs the optional zstandard package (pip install zstandard).
+
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import msgpack
+import orjson
+
+# --- Configuration ---
+PLAYER_RECORD_CODEC = os.getenv("PLAYER_RECORD_CODEC", "msgpack")  # msgpack | zstd
+FORMAT_FILENAME = "players.format.json"
+DICT_SAMPLE_RECORDS = 2000  # Pages buffered to train the dictionary before the first write
+DICT_SIZE = 112 * 1024
+ZSTD_LEVEL = 19  # Written once per run, read many times: spend the CPU on the write side
+
+FORMAT_VERSIONS = {"msgpack": 1, "zstd": 2}
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("PLAYER_RECORD_CODEC=zstd needs the zstandard package: pip install zstandard") from e
+    return zstandard
+
+
+def dictionary_name(generation: Optional[int] = None) -> str:
+    return f"players-g{generation:06d}.dict" if generation is not None else "players.dict"
+
+
+class PlayerRecordEncoder:
+    """
+    Turns player pages into stored records. With zstd the first DICT_SAMPLE_RECORDS pages are
+    held back until the dictionary is trained on them (or the stream ends early); pass a
+    previously saved dictionary to keep appending to a file set without retraining.
+    encode() returns the records that are ready to write, in input order.
+    """
+
+    def __init__(self, codec: str = PLAYER_RECORD_CODEC, dictionary: Optional[bytes] = None):
+        if codec not in FORMAT_VERSIONS:
+            raise ValueError(f"unknown PLAYER_RECORD_CODEC {codec!r}, expected msgpack or zstd")
+        self.codec = codec
+        self.dictionary = dictionary
+        self._pending: List[Any] = []  # (key, packed) held back for training
+        self._compressor = None
+        self._packer = msgpack.Packer()  # one per encoder, not one per record like packb()
+        if codec == "zstd" and dictionary is not None:
+            self._start(dictionary)
+
+    def _start(self, dictionary: bytes):
+        zstd = _zstd()
+        self.dictionary = dictionary
+        self._compressor = zstd.ZstdCompressor(
+            level=ZSTD_LEVEL,
+            dict_data=zstd.ZstdCompressionDict(dictionary),
+            write_content_size=True,
+            write_checksum=False,
+            write_dict_id=True,
+        )
+
+    def _train(self):
+        zstd = _zstd()
+        samples = [packed for _, packed in self._pending]
+        try:
+            trained = zstd.train_dictionary(DICT_SIZE, samples, level=ZSTD_LEVEL)
+            dictionary = trained.as_bytes()
+        except zstd.ZstdError:
+            # Too few or too small samples to train on; a raw content dictionary still helps
+            dictionary = b"".join(samples)[-DICT_SIZE:]
+        self._start(dictionary)
+
+    def _compress(self, packed: bytes) -> bytes:
+        return self._compressor.compress(packed) if self._compressor else packed
+
+    def encode(self, key: Any, page: Dict[str, Any]) -> List[Any]:
+        """
+        Returns [(key, record bytes), ...] ready to be written, possibly empty.
+        """
+        return self._push(key, self._packer.pack(page))
+
+    def _push(self, key: Any, packed: bytes) -> List[Any]:
+        if self.codec == "msgpack" or self._compressor is not None:
+            return [(key, self._compress(packed))]
+        self._pending.append((key, packed))
+        if len(self._pending) < DICT_SAMPLE_RECORDS:
+            return []
+        return self.flush()
+
+    def flush(self) -> List[Any]:
+        """
+        Encodes whatever was held back for training. Call once the input ends.
+        """
+        if not self._pending:
+            return []
+        if self._compressor is None:
+            self._train()
+        ready = [(key, self._compress(packed)) for key, packed in self._pending]
+        self._pending = []
+        return ready
+
+
+class PlayerRecordDecoder:
+    def __init__(self, codec: str = "msgpack", dictionary: Optional[bytes] = None):
+        self.codec = codec
+        self._decompressor = None
+        if codec == "zstd":
+            zstd = _zstd()
+            self._decompressor = zstd.ZstdDecompressor(dict_data=zstd.ZstdCompressionDict(dictionary))
+
+    @classmethod
+    def from_format_file(cls, path: Path) -> "PlayerRecordDecoder":
+        path = Path(path)
+        fmt = orjson.loads(path.read_bytes())
+        dictionary = (path.parent / fmt["dictionary"]).read_bytes() if fmt.get("dictionary") else None
+        return cls(fmt["codec"], dictionary)
+
+    def decode(self, record: bytes) -> Dict[str, Any]:
+        if self._decompressor is not None:
+            record = self._decompressor.decompress(record)
+        return msgpack.unpackb(record)
+
+
+def write_format_file(output_dir: Path, codec: str, dictionary_file: Optional[str]) -> Path:
+    path = Path(output_dir) / FORMAT_FILENAME
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps({
+            "format_version": FORMAT_VERSIONS[codec],
+            "codec": codec,
+            "dictionary": dictionary_file,
+        }, option=orjson.OPT_INDENT_2))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_dictionary(output_dir: Path, name: str, dictionary: bytes) -> Path:
+    path = Path(output_dir) / name
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(dictionary)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
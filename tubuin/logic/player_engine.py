@@ -0,0 +1,464 @@
+# tubuin\logic\player_engine.py
+# Python backend of the player page step (PLAYER_PAGE_ENGINE=python): builds the same
+# analytics.player_page_json_v4 pages as update_analytics_player_page_json.sql, from the local
+# match cache (logic/match_cache.py) instead of rescanning the match tables on the database host.
+# Every component is a group-by over sorted NumPy columns (counts and maxima with reduceat,
+# lobby bins with searchsorted/bincount); only emitting the JSON walks the groups in Python.
+# Shards of user_id mod num_shards run in worker processes, like the sharded artifact export.
+# A shard loads the widest named window once and builds every narrower window from a mask of it.
+#
+# Postgres still supplies the two inputs that aren't match facts: the current skill per mode
+# (derived.match_skill_deltas) and skillHistoryRaw (analytics.match_skill_snapshots), the latter
+# joined in by the upsert itself. The arithmetic follows the SQL's types: real columns, double
+# precision expressions, and numeric ROUND (half away from zero) after the float -> numeric cast,
+# which keeps 6 significant digits of a real and 15 of a double precision.
+
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import orjson
+
+from config import db_conn
+from logic.match_cache import MATCH_CACHE_DIR, StringTable, load_strings, load_window
+from logic.player_windows import PageWindow
+
+# --- Configuration ---
+PLAYER_PAGE_ENGINE = os.getenv("PLAYER_PAGE_ENGINE", "sql")  # sql | python | daily (sql, merged from analytics.player_daily_stats)
+PLAYER_PAGE_UPSERT_BATCH = 2000
+# The constants CTE of update_analytics_player_page_json.sql, all real there
+HARD_GAME_OS_THRESHOLD = np.float32(28.0)
+K_FACTOR = float(np.float32(10.0))
+MIN_HARD_GAME_PCT = float(np.float32(0.3))
+LOBBY_OS_BINS = np.arange(0, 59, 2).astype(np.float32)
+MATCH_HISTORY_LENGTH = 10
+ACTIVITY_DAYS = 84
+
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+EPOCH = date(1970, 1, 1)
+
+SKILL_PER_MODE_QUERY = """
+    SELECT user_id, category, latest_skill
+    FROM derived.match_skill_deltas
+    WHERE user_id = ANY(%(user_ids)s::int[]);
+"""
+
+# skillHistoryRaw exactly as the SQL backend builds it, for the batch's users only
+PAGE_UPSERT_QUERY = """
+    WITH batch AS (
+        SELECT p.user_id, p.json_data
+        FROM unnest(%(user_ids)s::int[], %(pages)s::jsonb[]) AS p(user_id, json_data)
+    ),
+    users_daily_avg_skill_snapshots AS (
+        SELECT
+            mss.user_id,
+            mss.category,
+            date_trunc('day', mss.start_time)::DATE AS history_date,
+            AVG(mss.skill) AS avg_daily_skill
+        FROM analytics.match_skill_snapshots mss
+        WHERE mss.user_id IN (SELECT user_id FROM batch)
+          AND mss.start_time >= %(timestamptz_from)s::timestamptz
+          AND mss.start_time < %(timestamptz_to)s::timestamptz + INTERVAL '1 day'
+        GROUP BY mss.user_id, mss.category, date_trunc('day', mss.start_time)::DATE
+    ),
+    users_skill_history_raw_json AS (
+        SELECT g.user_id, jsonb_object_agg(g.category, jsonb_build_object('dates', g.dates, 'skills', g.skills)) AS data
+        FROM (
+            SELECT
+                user_id,
+                category,
+                jsonb_agg(to_char(history_date, 'YYYY-MM-DD') ORDER BY history_date) AS dates,
+                jsonb_agg(ROUND(avg_daily_skill::numeric, 1) ORDER BY history_date) AS skills
+            FROM users_daily_avg_skill_snapshots
+            GROUP BY user_id, category
+        ) g
+        GROUP BY g.user_id
+    )
+    INSERT INTO analytics.player_page_json_v4 (window_key, user_id, json_data, data_start_date, data_end_date, last_generated_at)
+    SELECT
+        %(window_key)s,
+        b.user_id,
+        b.json_data || jsonb_build_object('_generated', now(), 'skillHistoryRaw', COALESCE(ushrj.data, '{}'::jsonb)),
+        %(timestamptz_from)s::timestamptz,
+        %(timestamptz_to)s::timestamptz,
+        now()
+    FROM batch b
+    LEFT JOIN users_skill_history_raw_json ushrj ON b.user_id = ushrj.user_id
+    ON CONFLICT (window_key, user_id) DO UPDATE SET
+        json_data = EXCLUDED.json_data,
+        data_start_date = EXCLUDED.data_start_date,
+        data_end_date = EXCLUDED.data_end_date,
+        last_generated_at = now();
+"""
+
+logger = logging.getLogger(__name__)
+
+
+# --- SQL value semantics ---
+def _numeric(value: float, real: bool = False) -> Decimal:
+    # float4 / float8 -> numeric: Postgres prints the value with FLT_DIG / DBL_DIG digits
+    return Decimal(f"{value:.{6 if real else 15}g}")
+
+
+def _round(value: Decimal, digits: int) -> float:
+    return float(value.quantize(Decimal(1).scaleb(-digits), rounding=ROUND_HALF_UP))
+
+
+def _rate(part: int, whole: int, scale: int, digits: int):
+    # ROUND(part::DECIMAL * scale / whole, digits), or the caller's ELSE when whole is 0
+    return _round(Decimal(part) * scale / Decimal(whole), digits)
+
+
+@lru_cache(maxsize=None)
+def _iso_day(day: int) -> str:
+    return (EPOCH + timedelta(days=int(day))).isoformat()  # to_char(.., 'YYYY-MM-DD')
+
+
+@lru_cache(maxsize=None)
+def _match_day(day: int) -> str:
+    d = EPOCH + timedelta(days=int(day))
+    return f"{d.day:02d} {MONTHS[d.month - 1]} {d.year}"  # to_char(.., 'DD Mon YYYY')
+
+
+# --- Group-by helpers ---
+def _group(*keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sorts rows by keys (first key most significant, stable) and returns (order, starts): the
+    row order and where in it each run of equal keys begins.
+    """
+    order = np.lexsort(keys[::-1])
+    if not len(order):
+        return order, np.empty(0, dtype=np.intp)
+    change = np.zeros(len(order), dtype=bool)
+    change[0] = True
+    for key in keys:
+        k = key[order]
+        change[1:] |= k[1:] != k[:-1]
+    return order, np.flatnonzero(change)
+
+
+def _count(mask: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    if not len(starts):
+        return np.empty(0, dtype=np.int64)
+    return np.add.reduceat(mask.astype(np.int64), starts)
+
+
+def _rank_in_group(sorted_key: np.ndarray) -> np.ndarray:
+    # 0, 1, 2, ... within each run of equal values of an already sorted key
+    first = np.searchsorted(sorted_key, sorted_key, side="left")
+    return np.arange(len(sorted_key)) - first
+
+
+# --- Components ---
+def _skill_per_mode_and_win_loss(m, n_users, categories: StringTable, current_os: Dict[Tuple[int, str], Optional[float]], user_ids):
+    skill_per_mode: List[Dict[str, Any]] = [{} for _ in range(n_users)]
+    win_loss: List[Optional[Dict[str, Any]]] = [None] * n_users
+    order, starts = _group(m["u"], m["category"])
+    if not len(starts):
+        return skill_per_mode, win_loss
+
+    lobby = m["avg_lobby_skill"][order]
+    won = m["won"][order]
+    hard = lobby >= HARD_GAME_OS_THRESHOLD  # NaN (NULL) is neither hard nor easy
+    easy = lobby < HARD_GAME_OS_THRESHOLD
+    ga = _count(hard, starts)
+    wa = _count(hard & (won == 1), starts)
+    gb = _count(easy, starts)
+    wb = _count(easy & (won == 1), starts)
+    wins = _count(won == 1, starts)
+    losses = _count(won == 0, starts)
+    total = np.diff(np.append(starts, len(order)))
+    last_day = np.maximum.reduceat(m["day"][order], starts)
+    group_users = m["u"][order][starts]
+    group_categories = m["category"][order][starts]
+
+    # COALESCE(latest_skill, 0.0) is real, the adjusted OS expression is double precision
+    os_real = np.array([
+        current_os.get((int(user_ids[u]), categories.values[c])) or 0.0
+        for u, c in zip(group_users, group_categories)
+    ], dtype=np.float32)
+    cur = os_real.astype(np.float64)
+    ga_f, gb_f, total_f = ga.astype(np.float64), gb.astype(np.float64), total.astype(np.float64)
+    wa_r = np.where(ga > 0, wa / np.maximum(ga, 1), 0.0)
+    wb_r = np.where(gb > 0, wb / np.maximum(gb, 1), 0.0)
+    low = ga_f / total_f < MIN_HARD_GAME_PCT
+    bonus = np.where(wa_r > wb_r, (wa_r - wb_r) * (K_FACTOR * 0.25), 0.0)
+    adjusted = np.where(
+        low,
+        cur - K_FACTOR * 0.5,
+        cur + ((wa_r * ga_f + wb_r * gb_f) / total_f - 0.5) * K_FACTOR + bonus,
+    )
+
+    per_mode: List[Dict[str, Any]] = [{} for _ in range(n_users)]
+    for g in range(len(starts)):
+        u = group_users[g]
+        mode = categories.values[group_categories[g]]
+        skill_per_mode[u][mode] = {
+            "mode": mode,
+            "os": _round(_numeric(float(os_real[g]), real=True), 1),
+            "as": _round(_numeric(float(adjusted[g])), 2),
+            "ga": int(ga[g]),
+            "wa": _rate(int(wa[g]), int(ga[g]), 1, 2) if ga[g] > 0 else 0.0,
+            "gb": int(gb[g]),
+            "wb": _rate(int(wb[g]), int(gb[g]), 1, 2) if gb[g] > 0 else 0.0,
+            "lastPlayed": _iso_day(last_day[g]),
+        }
+        w, l = int(wins[g]), int(losses[g])
+        per_mode[u][mode] = {
+            "mode": mode, "wins": w, "losses": l,
+            "rate": _rate(w, w + l, 100, 1) if w + l > 0 else 0,
+        }
+
+    user_starts = np.flatnonzero(np.r_[True, group_users[1:] != group_users[:-1]])
+    user_wins = np.add.reduceat(wins, user_starts)
+    user_losses = np.add.reduceat(losses, user_starts)
+    for u, w, l in zip(group_users[user_starts], user_wins.tolist(), user_losses.tolist()):
+        win_loss[u] = {
+            "total": {
+                "wins": w, "losses": l, "games": w + l,
+                "winRate": _rate(w, w + l, 100, 1) if w + l > 0 else 0,
+            },
+            "perMode": per_mode[u],
+        }
+    return skill_per_mode, win_loss
+
+
+def _match_history(m, n_users, strings: Dict[str, StringTable]):
+    history: List[List[Dict[str, Any]]] = [[] for _ in range(n_users)]
+    order = np.lexsort((-m["start_time"], m["u"]))
+    keep = order[_rank_in_group(m["u"][order]) < MATCH_HISTORY_LENGTH]
+    ranked = {1: True, 0: False, -1: None}
+    for i in keep:
+        history[m["u"][i]].append({
+            "date": _match_day(m["day"][i]),
+            "mode": strings["category"].decode(m["category"][i]),
+            "map": strings["map_name"].decode(m["map_name"][i]),
+            "result": "Win" if m["won"][i] == 1 else "Loss",
+            "faction": strings["faction"].decode(m["faction"][i]),
+            "ranked": ranked[int(m["ranked"][i])],
+            "username": strings["name"].decode(m["name"][i]),
+        })
+    return history
+
+
+def _usernames(m, n_users, names: StringTable):
+    usernames: List[List[Dict[str, Any]]] = [[] for _ in range(n_users)]
+    rows = np.flatnonzero(m["name"] >= 0)
+    order, starts = _group(m["u"][rows], m["name"][rows])
+    if not len(starts):
+        return usernames
+    rows = rows[order]
+    last_seen = np.maximum.reduceat(m["start_time"][rows], starts)
+    last_day = np.maximum.reduceat(m["day"][rows], starts)
+    group_users = m["u"][rows][starts]
+    for g in np.lexsort((-last_seen, group_users)):
+        usernames[group_users[g]].append({
+            "name": names.values[m["name"][rows[starts[g]]]],
+            "lastSeen": _iso_day(last_day[g]),
+        })
+    return usernames
+
+
+def _activity(m, n_users):
+    activity: List[Dict[str, Any]] = [{} for _ in range(n_users)]
+    order, starts = _group(m["u"], m["day"])
+    if not len(starts):
+        return activity
+    skill = m["skill"][order].astype(np.float64)  # AVG(real) accumulates in double precision
+    has_skill = ~np.isnan(skill)
+    games = np.diff(np.append(starts, len(order)))
+    skill_sum = np.add.reduceat(np.where(has_skill, skill, 0.0), starts)
+    skill_count = _count(has_skill, starts)
+    group_users = m["u"][order][starts]
+    group_days = m["day"][order][starts]
+    # Latest ACTIVITY_DAYS days per user, groups are sorted by day ascending within a user
+    latest = np.lexsort((-group_days, group_users))
+    latest = latest[_rank_in_group(group_users[latest]) < ACTIVITY_DAYS]
+    for g in latest:
+        avg = _round(_numeric(skill_sum[g] / skill_count[g]), 1) if skill_count[g] else None
+        activity[group_users[g]][_iso_day(group_days[g])] = {"games": int(games[g]), "avgSkill": avg}
+    return activity
+
+
+def _lobby(m, n_users, categories: StringTable):
+    lobby: List[Dict[str, Any]] = [{} for _ in range(n_users)]
+    rows = np.flatnonzero(~np.isnan(m["avg_lobby_skill"]))
+    # width_bucket(avg_lobby_skill, bins) - 1: -1 below the first bin, last bin open ended
+    bins = np.searchsorted(LOBBY_OS_BINS, m["avg_lobby_skill"][rows], side="right") - 1
+    n_bins = len(LOBBY_OS_BINS)
+    users = m["u"][rows]
+    for label, key in (("All", np.zeros(len(rows), dtype=np.int16)), (None, m["category"][rows])):
+        order, starts = _group(users, key)
+        if not len(starts):
+            continue
+        group_of_row = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(order))))
+        in_range = bins[order] >= 0
+        counts = np.bincount(
+            group_of_row[in_range] * n_bins + bins[order][in_range], minlength=len(starts) * n_bins
+        ).reshape(len(starts), n_bins)
+        for g, u in enumerate(users[order][starts]):
+            name = label or categories.values[key[order][starts[g]]]
+            lobby[u][name] = counts[g].tolist()
+    return lobby
+
+
+def _factions(m, n_users, strings: Dict[str, StringTable]):
+    factions: List[Dict[str, Any]] = [{} for _ in range(n_users)]
+    rows = np.flatnonzero(m["faction"] >= 0)
+    users = m["u"][rows]
+    won = m["won"][rows]
+    rank = strings["faction"].rank[m["faction"][rows]]  # ORDER BY faction, in the database's collation
+    for label, key in (("All", np.zeros(len(rows), dtype=np.int16)), (None, m["category"][rows])):
+        order, starts = _group(users, key, rank)
+        if not len(starts):
+            continue
+        wins = _count(won[order] == 1, starts)
+        losses = _count(won[order] == 0, starts)
+        for g in range(len(starts)):
+            u = users[order][starts[g]]
+            name = label or strings["category"].values[key[order][starts[g]]]
+            entry = factions[u].get(name)
+            if entry is None:
+                entry = factions[u][name] = {
+                    "labels": [],
+                    "datasets": [{"label": "Wins", "data": []}, {"label": "Losses", "data": []}],
+                }
+            entry["labels"].append(strings["faction"].values[m["faction"][rows[order[starts[g]]]]])
+            entry["datasets"][0]["data"].append(int(wins[g]))
+            entry["datasets"][1]["data"].append(int(losses[g]))
+    return factions
+
+
+def active_user_ids(data: Dict[str, np.ndarray], active_since: Optional[datetime]) -> np.ndarray:
+    # active_users of the SQL: a match in the window (since active_since, if given), any category
+    recent = data["user_id"]
+    if active_since is not None:
+        since_us = int((active_since - datetime(1970, 1, 1, tzinfo=timezone.utc)) / timedelta(microseconds=1))
+        recent = recent[data["start_time"] >= since_us]
+    return np.unique(recent)
+
+
+def build_pages(
+    data: Dict[str, np.ndarray],
+    strings: Dict[str, StringTable],
+    user_ids: np.ndarray,
+    current_os: Dict[Tuple[int, str], Optional[float]],
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Yields (user_id, page) for every user in user_ids (sorted), built from their rows in data.
+    Pages lack _generated and skillHistoryRaw, the upsert adds both.
+    """
+    rows = np.isin(data["user_id"], user_ids) & (data["category"] >= 0)  # all_relevant_matches
+    m = {name: values[rows] for name, values in data.items()}
+    m["u"] = np.searchsorted(user_ids, m["user_id"])
+    n_users = len(user_ids)
+
+    skill_per_mode, win_loss = _skill_per_mode_and_win_loss(m, n_users, strings["category"], current_os, user_ids)
+    history = _match_history(m, n_users, strings)
+    usernames = _usernames(m, n_users, strings["name"])
+    activity = _activity(m, n_users)
+    lobby = _lobby(m, n_users, strings["category"])
+    factions = _factions(m, n_users, strings)
+
+    for u, user_id in enumerate(user_ids.tolist()):
+        yield user_id, {
+            "_version": 1,
+            "userId": user_id,
+            "skillPerMode": skill_per_mode[u],
+            "winLossSummary": win_loss[u] or {
+                "total": {"wins": 0, "losses": 0, "games": 0, "winRate": 0.0},
+                "perMode": {},
+            },
+            "matchHistory": history[u],
+            "usernames": usernames[u],
+            "activityData": activity[u],
+            "lobbyData": lobby[u],
+            "factionData": factions[u],
+        }
+
+
+def fetch_current_os(conn, user_ids: np.ndarray) -> Dict[Tuple[int, str], Optional[float]]:
+    with conn.cursor() as cur:
+        cur.execute(SKILL_PER_MODE_QUERY, {"user_ids": user_ids.tolist()})
+        return {(user_id, category): skill for user_id, category, skill in cur.fetchall()}
+
+
+def window_rows(data: Dict[str, np.ndarray], window: PageWindow) -> Dict[str, np.ndarray]:
+    # The rows of a narrower window, out of the widest window's data
+    rows = data["day"] >= (window.from_date - EPOCH).days
+    return {name: values[rows] for name, values in data.items()}
+
+
+def build_player_page_shard(
+    windows: List[PageWindow],
+    active_since: Optional[datetime],
+    shard: int,
+    num_shards: int,
+    cache_dir: str = MATCH_CACHE_DIR,
+) -> int:
+    """
+    Builds and upserts the pages of one user_id shard for every window (widest first, all
+    ending on the same day). Runs in a worker process, on that process's own connection pool.
+    Returns the number of pages written.
+    """
+    widest = load_window(windows[0].from_date, windows[0].to_date, Path(cache_dir), shard, num_shards)
+    strings = load_strings(Path(cache_dir))
+    written = 0
+    with db_conn() as conn:
+        # Users of a narrower window are all in the widest one, the current OS is fetched once
+        current_os = fetch_current_os(conn, active_user_ids(widest, active_since))
+        for window in windows:
+            data = widest if window is windows[0] else window_rows(widest, window)
+            user_ids = active_user_ids(data, active_since)
+            batch_ids, batch_pages = [], []
+
+            def flush():
+                nonlocal written
+                with conn.cursor() as cur:
+                    cur.execute(PAGE_UPSERT_QUERY, {
+                        "window_key": window.key,
+                        "user_ids": batch_ids,
+                        "pages": batch_pages,
+                        "timestamptz_from": window.from_date.isoformat(),
+                        "timestamptz_to": window.to_date.isoformat(),
+                    })
+                conn.commit()
+                written += len(batch_ids)
+                batch_ids.clear()
+                batch_pages.clear()
+
+            for user_id, page in build_pages(data, strings, user_ids, current_os):
+                batch_ids.append(user_id)
+                batch_pages.append(orjson.dumps(page).decode())
+                if len(batch_ids) >= PLAYER_PAGE_UPSERT_BATCH:
+                    flush()
+            if batch_ids:
+                flush()
+    return written
+
+
+def build_player_pages(
+    windows: List[PageWindow],
+    active_since: Optional[datetime],
+    num_shards: int,
+    cache_dir: str = MATCH_CACHE_DIR,
+    max_workers: Optional[int] = None,
+) -> List[int]:
+    """
+    Runs build_player_page_shard for every shard in a process pool. Returns pages per shard.
+    """
+    workers = min(num_shards, max_workers or os.cpu_count() or 1)
+    # spawn, not fork: a forked worker would inherit the parent's connection pool and its threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [
+            pool.submit(build_player_page_shard, windows, active_since, shard, num_shards, str(cache_dir))
+            for shard in range(num_shards)
+        ]
+        return [f.result() for f in futures]
@@ -0,0 +1,278 @@
+# tubuin\logic\player_export.py
+# Streams analytics.player_page_json_v4 into players.mpk records and their index. Kept free of
+# Prefect so the sharded export can run it in worker processes: shard k of K holds the players
+# with user_id mod K = k, written to its own .mpk / index / dictionary, and players.shards.json
+# lists the shard files. Consumers route a lookup with user_id mod num_shards, no hashing needed.
+# Each named window (logic/player_windows.py) is exported on its own, from its own rows.
+
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+from psycopg.adapt import Loader
+
+from config import db_conn
+from logic.player_index import PlayerIndexWriter
+from logic.player_codec import PlayerRecordEncoder, write_dictionary
+from logic.skill_history import densify_skill_histories
+from logic.player_windows import PRIMARY_WINDOW
+
+# --- Configuration ---
+PLAYER_INDEX_FORMAT = os.getenv("PLAYER_INDEX_FORMAT", "json")  # json | binary | both
+# Rows per round trip of the named cursor adapt so a fetch holds about PLAYER_EXPORT_FETCH_BYTES
+PLAYER_EXPORT_ITERSIZE = 1000  # first fetch
+PLAYER_EXPORT_MIN_ITERSIZE = 100
+PLAYER_EXPORT_MAX_ITERSIZE = 20000
+PLAYER_EXPORT_FETCH_BYTES = 16 * 1024 * 1024
+# Pages parsed, densified and encoded together; a fetch stays text until its slice is up, so
+# only this many page objects are alive at once, not a whole fetch of them
+PLAYER_EXPORT_DENSIFY_ROWS = 500
+SHARDS_FILENAME = "players.shards.json"
+
+# analytics.snapshot_metadata key the page step stamps once every page of a run committed.
+# All pages of a run share their shards' now(), so an export reads (previous stamp, stamp]:
+# each run exactly once, and never the shards of a run still in progress.
+PAGES_THROUGH_KEY = "player_page_json_through"
+
+PLAYER_PAGES_QUERY = """
+    SELECT user_id, json_data, last_generated_at
+    FROM analytics.player_page_json_v4
+    WHERE window_key = %(window_key)s
+      AND data_start_date = %(from_date)s AND data_end_date = %(to_date)s
+      AND (%(since)s::timestamptz IS NULL OR last_generated_at > %(since)s::timestamptz)
+      AND (%(through)s::timestamptz IS NULL OR last_generated_at <= %(through)s::timestamptz)
+      AND mod(user_id, %(num_shards)s) = %(shard)s;
+"""
+
+PAGES_THROUGH_QUERY = """
+    SELECT last_loaded_at FROM analytics.snapshot_metadata WHERE key = %(key)s;
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class RawJsonLoader(Loader):
+    # Hands json/jsonb columns over as their undecoded text instead of json.loads()-ing them
+    # into dicts; they are parsed with orjson a slice of a fetch at a time, right before packing.
+    # Not transcoded to msgpack without building the page: msgpack needs every container's
+    # length before its elements, so a streaming transcoder buffers them anyway, and in Python
+    # it is ~25x slower than orjson.loads + pack (flows/tests/test_player_export_decode.py:
+    # 84 us/page and 107 KiB peak, against 251 us / 367 KiB for json.loads + packb, and
+    # 2080 us / 61 KiB transcoding). The pages also have to be objects to densify skillHistory.
+    def load(self, data) -> bytes:
+        return bytes(data)
+
+
+def next_itersize(rows: int, nbytes: int) -> int:
+    # Size the next fetch from the average page size of the last one
+    fitting = PLAYER_EXPORT_FETCH_BYTES * rows // nbytes
+    return max(PLAYER_EXPORT_MIN_ITERSIZE, min(PLAYER_EXPORT_MAX_ITERSIZE, fitting))
+
+
+def index_formats() -> Tuple[str, ...]:
+    formats = {"json": ("json",), "binary": ("binary",), "both": ("json", "binary")}
+    if PLAYER_INDEX_FORMAT not in formats:
+        raise ValueError(f"unknown PLAYER_INDEX_FORMAT {PLAYER_INDEX_FORMAT!r}, expected json, binary or both")
+    return formats[PLAYER_INDEX_FORMAT]
+
+
+def pages_generated_through() -> Optional[datetime]:
+    """
+    The page step's PAGES_THROUGH_KEY stamp, None before its first run that recorded one.
+    """
+    with db_conn() as conn:
+        row = conn.execute(PAGES_THROUGH_QUERY, {"key": PAGES_THROUGH_KEY}).fetchone()
+    return row[0] if row else None
+
+
+def stream_player_pages(
+    from_date_obj: date,
+    to_date_obj: date,
+    f_mpk,
+    index: PlayerIndexWriter,
+    encoder: PlayerRecordEncoder,
+    start_offset: int = 0,
+    since: Optional[datetime] = None,
+    logger=logger,
+    shard: int = 0,
+    num_shards: int = 1,
+    window_key: str = PRIMARY_WINDOW,
+    through: Optional[datetime] = None,
+) -> Tuple[int, int, Optional[datetime]]:
+    """
+    Appends the encoded page of every player in the window_key window (generated after since
+    and up to through, if given, and in the given user_id shard) to f_mpk and points the index
+    at it, offsets counted from start_offset.
+    Returns (bytes written, players written, newest last_generated_at seen).
+    """
+    current_offset = start_offset
+    processed_users_count = 0
+    newest = None
+    # Rows are unique per user, only an index carried over from a previous run needs upserts
+    put = index.upsert if len(index) else index.add
+
+    def write_records(records):
+        nonlocal current_offset, processed_users_count
+        for user_id, record in records:
+            f_mpk.write(record)
+            put(user_id, current_offset, len(record))
+            current_offset += len(record)
+            processed_users_count += 1
+
+    with db_conn() as conn:
+        with conn.cursor(name="player_json_stream") as cur:
+            cur.adapters.register_loader("jsonb", RawJsonLoader)
+            cur.adapters.register_loader("json", RawJsonLoader)
+            itersize = PLAYER_EXPORT_ITERSIZE
+            logger.info(
+                f"Executing query to fetch data for window {window_key}: {from_date_obj} to {to_date_obj}"
+                + (f", generated after {since}" if since else "")
+                + (f" through {through}" if through else "")
+                + (f", shard {shard}/{num_shards}" if num_shards > 1 else "")
+            )
+            cur.execute(PLAYER_PAGES_QUERY, {
+                "window_key": window_key,
+                "from_date": from_date_obj,
+                "to_date": to_date_obj,
+                "since": since,
+                "through": through,
+                "shard": shard,
+                "num_shards": num_shards,
+            })
+
+            while True:
+                rows = cur.fetchmany(itersize)
+                if not rows:
+                    break
+                fetched_bytes = 0
+                for start in range(0, len(rows), PLAYER_EXPORT_DENSIFY_ROWS):
+                    batch_ids, batch_pages = [], []
+                    for user_id, page_json, generated_at in rows[start:start + PLAYER_EXPORT_DENSIFY_ROWS]:
+                        if newest is None or generated_at > newest:
+                            newest = generated_at
+
+                        if page_json is None or page_json in (b"{}", b"null"):
+                            logger.warning(
+                                f"Skipping user {user_id} due to missing JSON data."
+                            )
+                            continue
+                        fetched_bytes += len(page_json)
+
+                        try:
+                            batch_pages.append(orjson.loads(page_json))
+                        except orjson.JSONDecodeError as e:
+                            logger.error(f"❌ Failed to parse JSON for user {user_id}: {e}")
+                            continue
+                        batch_ids.append(user_id)
+
+                    # A slice of the fetch at once, see logic/skill_history.py
+                    densify_skill_histories(batch_pages, from_date_obj, to_date_obj)
+                    for user_id, page in zip(batch_ids, batch_pages):
+                        try:
+                            # With zstd the first pages are held back to train the dictionary
+                            records = encoder.encode(user_id, page)
+                        except Exception as e:
+                            logger.error(
+                                f"❌ Failed to serialize/write for user {user_id}: {e}"
+                            )
+                            continue
+                        write_records(records)
+                if fetched_bytes:
+                    itersize = next_itersize(len(rows), fetched_bytes)
+
+    write_records(encoder.flush())
+    return current_offset - start_offset, processed_users_count, newest
+
+
+def shard_stem(shard: int, num_shards: int) -> str:
+    return f"players-s{shard:03d}-of-{num_shards:03d}"
+
+
+def write_player_shard(
+    from_date_obj: date,
+    to_date_obj: date,
+    shard: int,
+    num_shards: int,
+    output_dir: str,
+    codec: str,
+    formats: Tuple[str, ...],
+    window_key: str = PRIMARY_WINDOW,
+) -> Dict[str, Any]:
+    """
+    Writes one shard's .mpk, index file(s) and dictionary. Runs in a worker process, on that
+    process's own connection pool. Returns the shard's players.shards.json entry.
+    """
+    output_dir = Path(output_dir)
+    stem = shard_stem(shard, num_shards)
+    index = PlayerIndexWriter()
+    encoder = PlayerRecordEncoder(codec)
+    with open(output_dir / f"{stem}.mpk", "wb") as f_mpk:
+        size, players, _ = stream_player_pages(
+            from_date_obj, to_date_obj, f_mpk, index, encoder,
+            shard=shard, num_shards=num_shards, window_key=window_key,
+        )
+
+    entry = {"shard": shard, "mpk": f"{stem}.mpk", "size": size, "players": players, "dictionary": None}
+    if encoder.dictionary is not None:
+        entry["dictionary"] = f"{stem}.dict"
+        write_dictionary(output_dir, entry["dictionary"], encoder.dictionary)
+    entry["index"] = {}
+    if "json" in formats:
+        entry["index"]["json"] = f"{stem}.index.json"
+        index.write_json(output_dir / entry["index"]["json"])
+    if "binary" in formats:
+        entry["index"]["binary"] = f"{stem}.index.bin"
+        index.write_binary(output_dir / entry["index"]["binary"], mpk_size=size)
+    return entry
+
+
+def write_sharded_artifacts(
+    from_date_obj: date,
+    to_date_obj: date,
+    output_dir: Path,
+    num_shards: int,
+    codec: str,
+    formats: Tuple[str, ...],
+    max_workers: Optional[int] = None,
+    window_key: str = PRIMARY_WINDOW,
+) -> Tuple[List[Dict[str, Any]], Path]:
+    """
+    Writes num_shards shards in a process pool, then players.shards.json (atomically, last).
+    Returns (shard entries, manifest path).
+    """
+    output_dir = Path(output_dir)
+    workers = min(num_shards, max_workers or os.cpu_count() or 1)
+    # spawn, not fork: a forked worker would inherit the parent's connection pool and its threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [
+            pool.submit(
+                write_player_shard,
+                from_date_obj, to_date_obj, shard, num_shards, str(output_dir), codec, formats, window_key,
+            )
+            for shard in range(num_shards)
+        ]
+        # result() re-raises a worker's exception; the manifest is only written if all succeeded
+        shards = [f.result() for f in futures]
+
+    manifest_path = output_dir / SHARDS_FILENAME
+    tmp_path = manifest_path.with_name(f".{manifest_path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps({
+            "window": window_key,
+            "from_date": from_date_obj.isoformat(),
+            "to_date": to_date_obj.isoformat(),
+            "num_shards": num_shards,
+            "routing": "user_id mod num_shards",
+            "codec": codec,
+            "shards": shards,
+        }, option=orjson.OPT_INDENT_2))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, manifest_path)
+    return shards, manifest_path
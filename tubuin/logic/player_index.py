@@ -0,0 +1,207 @@
+# tubuin\logic\player_index.py
+# Binary index for players.mpk: a header followed by fixed-width (user_id, offset, length)
+# records sorted by user_id, so a reader mmaps the file and binary searches it instead of
+# parsing a JSON object with one key per player.
+#
+#   header  <8sHHIQI  magic, version, record size, record count, mpk size, crc32 of the records
+#   record  <qQI      user_id, offset into players.mpk, length of the msgpack blob
+
+import os
+import mmap
+import zlib
+import struct
+import argparse
+from array import array
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+import orjson
+
+# --- Configuration ---
+INDEX_MAGIC = b"TBPIDX\x00\x01"
+INDEX_VERSION = 1
+
+_HEADER = struct.Struct("<8sHHIQI")
+_RECORD = struct.Struct("<qQI")
+
+
+class PlayerIndexError(ValueError):
+    pass
+
+
+class PlayerIndexWriter:
+    """
+    Collects (user_id, offset, length) as rows stream, in three typed arrays (20 bytes per
+    player instead of a dict entry with a str key and a list), and writes them as the binary
+    index and/or the players.index.json the API reads today.
+    """
+
+    def __init__(self):
+        self.user_ids = array("q")
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self._slots: Optional[Dict[int, int]] = None  # user_id -> slot, built on the first upsert
+
+    @classmethod
+    def from_index(cls, index: "PlayerIndex") -> "PlayerIndexWriter":
+        writer = cls()
+        for user_id, offset, length in index:
+            writer.add(user_id, offset, length)
+        return writer
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def add(self, user_id: int, offset: int, length: int):
+        if self._slots is not None:
+            self._slots[user_id] = len(self.user_ids)
+        self.user_ids.append(user_id)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def upsert(self, user_id: int, offset: int, length: int):
+        # Points an already indexed player at its newer record, appends everyone else
+        if self._slots is None:
+            self._slots = {u: slot for slot, u in enumerate(self.user_ids)}
+        slot = self._slots.get(user_id)
+        if slot is None:
+            self.add(user_id, offset, length)
+        else:
+            self.offsets[slot] = offset
+            self.lengths[slot] = length
+
+    def _sorted_order(self) -> Sequence[int]:
+        ids = self.user_ids
+        if all(ids[i] < ids[i + 1] for i in range(len(ids) - 1)):
+            return range(len(ids))
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        for prev, cur in zip(order, order[1:]):
+            if ids[prev] == ids[cur]:
+                raise PlayerIndexError(f"duplicate user_id {ids[cur]} in index")
+        return order
+
+    def write_binary(self, path: Path, mpk_size: int):
+        records = bytearray(_RECORD.size * len(self))
+        for slot, i in enumerate(self._sorted_order()):
+            _RECORD.pack_into(records, slot * _RECORD.size, self.user_ids[i], self.offsets[i], self.lengths[i])
+        header = _HEADER.pack(
+            INDEX_MAGIC, INDEX_VERSION, _RECORD.size, len(self), mpk_size, zlib.crc32(records)
+        )
+        _write_atomically(Path(path), [header, records])
+
+    def write_json(self, path: Path):
+        # Same {"user_id": [offset, length]} object as before, streamed instead of built as a dict
+        def chunks() -> Iterator[bytes]:
+            yield b"{"
+            for i in range(len(self)):
+                yield (b"," if i else b"") + orjson.dumps(str(self.user_ids[i])) + b":" \
+                    + orjson.dumps([self.offsets[i], self.lengths[i]])
+            yield b"}"
+        _write_atomically(Path(path), chunks())
+
+
+def _write_atomically(path: Path, chunks):
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class PlayerIndex:
+    """
+    Read-only view of a binary index. Opening maps the file and checks the header and
+    checksum; lookups binary search the mapped records without loading them.
+    """
+
+    def __init__(self, path: Path, verify: bool = True):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file, mmap refuses zero length
+            self._file.close()
+            raise PlayerIndexError(f"{self.path}: empty file")
+        try:
+            self._check_header(verify)
+        except Exception:
+            self.close()
+            raise
+
+    def _check_header(self, verify: bool):
+        if len(self._map) < _HEADER.size:
+            raise PlayerIndexError(f"{self.path}: truncated header")
+        magic, version, record_size, count, mpk_size, crc = _HEADER.unpack_from(self._map, 0)
+        if magic != INDEX_MAGIC:
+            raise PlayerIndexError(f"{self.path}: not a player index")
+        if version != INDEX_VERSION or record_size != _RECORD.size:
+            raise PlayerIndexError(f"{self.path}: unsupported version {version} / record size {record_size}")
+        if len(self._map) != _HEADER.size + count * record_size:
+            raise PlayerIndexError(f"{self.path}: expected {count} records, file size {len(self._map)}")
+        if verify:
+            with memoryview(self._map) as view:  # released before close(), mmap refuses otherwise
+                actual = zlib.crc32(view[_HEADER.size:])
+            if actual != crc:
+                raise PlayerIndexError(f"{self.path}: checksum mismatch")
+        self.count = count
+        self.mpk_size = mpk_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if getattr(self, "_map", None) is not None and not self._map.closed:
+            self._map.close()
+        self._file.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def record(self, slot: int) -> Tuple[int, int, int]:
+        return _RECORD.unpack_from(self._map, _HEADER.size + slot * _RECORD.size)
+
+    def lookup(self, user_id: int) -> Optional[Tuple[int, int]]:
+        """
+        Returns (offset, length) of user_id's blob in players.mpk, or None.
+        """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_id, offset, length = self.record(mid)
+            if mid_id < user_id:
+                lo = mid + 1
+            elif mid_id > user_id:
+                hi = mid
+            else:
+                return offset, length
+        return None
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.lookup(user_id) is not None
+
+    def __iter__(self) -> Iterator[Tuple[int, int, int]]:
+        for slot in range(self.count):
+            yield self.record(slot)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect a binary players index.")
+    parser.add_argument("index", type=Path, help="players.index.bin")
+    parser.add_argument("user_id", type=int, nargs="?", help="Look up one player")
+    parser.add_argument("--mpk", type=Path, help="players.mpk, prints the player's blob size and checks it fits")
+    args = parser.parse_args()
+
+    with PlayerIndex(args.index) as index:
+        print(f"{args.index}: {len(index)} players, mpk size {index.mpk_size}")
+        if args.user_id is not None:
+            found = index.lookup(args.user_id)
+            print(f"{args.user_id}: {found}")
+            if found and args.mpk:
+                with open(args.mpk, "rb") as f:
+                    f.seek(found[0])
+                    print(f"read {len(f.read(found[1]))} of {found[1]} bytes")
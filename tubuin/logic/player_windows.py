@@ -0,0 +1,63 @@
+# tubuin\logic\player_windows.py
+# Named date windows of the player pages ("7d", "30d", "24w"), all ending on the same to_date.
+# The player page step builds every window from one scan of the widest one, rows of
+# analytics.player_page_json_v4 are keyed by (window_key, user_id), and each window gets its
+# own artifact set. PRIMARY_WINDOW keeps the artifact paths it had before windows existed,
+# the others go to a subdirectory named after their key, locally and on the server.
+
+import os
+import re
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, List
+
+# --- Configuration ---
+PLAYER_PAGE_WINDOWS = os.getenv("PLAYER_PAGE_WINDOWS", "24w")  # comma separated, e.g. 24w,30d,7d
+PRIMARY_WINDOW = "24w"
+
+_WINDOW_KEY = re.compile(r"^(\d+)([dw])$")
+
+
+@dataclass(frozen=True)
+class PageWindow:
+    key: str
+    from_date: date
+    to_date: date
+
+
+def window_length(key: str) -> timedelta:
+    match = _WINDOW_KEY.match(key)
+    if not match:
+        raise ValueError(f"bad player page window {key!r}, expected <n>d or <n>w")
+    n, unit = int(match.group(1)), match.group(2)
+    return timedelta(days=n) if unit == "d" else timedelta(weeks=n)
+
+
+def page_windows(to_date: date, spec: str = PLAYER_PAGE_WINDOWS) -> List[PageWindow]:
+    """
+    The configured windows ending on to_date, widest first.
+    """
+    keys = list(dict.fromkeys(k.strip() for k in spec.split(",") if k.strip()))
+    if not keys:
+        raise ValueError("PLAYER_PAGE_WINDOWS names no window")
+    windows = [PageWindow(key, to_date - window_length(key), to_date) for key in keys]
+    return sorted(windows, key=lambda w: w.from_date)
+
+
+def window_params(windows: List[PageWindow]) -> Dict[str, Any]:
+    # The widest window is the one scan's range; the arrays name every window within it
+    return {
+        "timestamptz_from": windows[0].from_date.isoformat(),
+        "timestamptz_to": windows[0].to_date.isoformat(),
+        "window_keys": [w.key for w in windows],
+        "window_froms": [w.from_date.isoformat() for w in windows],
+    }
+
+
+def window_subdir(key: str) -> str:
+    return "" if key == PRIMARY_WINDOW else key
+
+
+def window_output_dir(output_dir: str, key: str) -> Path:
+    return Path(output_dir) / window_subdir(key)
@@ -0,0 +1,206 @@
+# tubuin\logic\replay_archive.py
+# Rolling, compressed archive segments for ingested meta JSONs.
+# Each record is one JSON line written as its own gzip member, so a segment is still a
+# valid .jsonl.gz file for sequential tools, while the segment's index
+# ({replay_id: [offset, length]}, same shape as players.index.json) allows random access.
+
+import os
+import re
+import gzip
+import argparse
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import orjson
+
+# --- Configuration ---
+SEGMENT_PREFIX = "metas"
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024  # Roll to a new segment once the active one passes this size
+COMPRESS_LEVEL = 6
+
+_SEGMENT_RE = re.compile(r"^(?P<prefix>.+)-(?P<seq>\d{6})\.jsonl\.gz$")
+
+
+def segment_path(archive_dir: Path, prefix: str, seq: int) -> Path:
+    return archive_dir / f"{prefix}-{seq:06d}.jsonl.gz"
+
+
+def index_path_for(segment: Path) -> Path:
+    return segment.with_name(segment.name.replace(".jsonl.gz", ".index.json"))
+
+
+def list_segments(archive_dir: Path, prefix: str = SEGMENT_PREFIX) -> List[Tuple[int, Path]]:
+    """
+    Returns (seq, path) for every segment in archive_dir, oldest first.
+    """
+    if not archive_dir.is_dir():
+        return []
+    segments = []
+    for p in archive_dir.iterdir():
+        m = _SEGMENT_RE.match(p.name)
+        if m and m.group("prefix") == prefix:
+            segments.append((int(m.group("seq")), p))
+    return sorted(segments)
+
+
+def _fsync_dir(directory: Path):
+    # Directory fsync makes renames durable; not supported on Windows.
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_index_atomically(path: Path, index: Dict[str, List[int]]):
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(index))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path.parent)
+
+
+class ReplayArchiveWriter:
+    """
+    Appends meta records to the newest segment in archive_dir, rolling over to a new
+    segment once SEGMENT_MAX_BYTES is reached. Records only count as archived after
+    commit(), which fsyncs the segment and then atomically replaces its index.
+    """
+
+    def __init__(
+        self,
+        archive_dir: Path,
+        prefix: str = SEGMENT_PREFIX,
+        segment_max_bytes: int = SEGMENT_MAX_BYTES,
+    ):
+        self.archive_dir = Path(archive_dir)
+        self.prefix = prefix
+        self.segment_max_bytes = segment_max_bytes
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+
+        self._file = None
+        self._segment: Optional[Path] = None
+        self._seq = 0
+        self._index: Dict[str, List[int]] = {}
+        self._offset = 0
+        self._pending = 0
+
+        segments = list_segments(self.archive_dir, self.prefix)
+        if segments:
+            seq, path = segments[-1]
+            if path.stat().st_size < self.segment_max_bytes:
+                self._open_segment(seq)
+                return
+            self._seq = seq
+        self._open_segment(self._seq + 1)
+
+    def _open_segment(self, seq: int):
+        self._seq = seq
+        self._segment = segment_path(self.archive_dir, self.prefix, seq)
+        index_path = index_path_for(self._segment)
+        self._index = orjson.loads(index_path.read_bytes()) if index_path.exists() else {}
+
+        # Anything past the last indexed record was never committed (crash between
+        # writing and commit), so drop it before appending.
+        committed_end = max((off + length for off, length in self._index.values()), default=0)
+        self._file = open(self._segment, "ab")
+        self._file.truncate(committed_end)
+        self._file.seek(committed_end)
+        self._offset = committed_end
+
+    def append(self, replay_id: str, raw_json: bytes):
+        member = gzip.compress(raw_json.strip() + b"\n", compresslevel=COMPRESS_LEVEL)
+        self._file.write(member)
+        # Newest record wins if a replay_id is archived twice
+        self._index[replay_id] = [self._offset, len(member)]
+        self._offset += len(member)
+        self._pending += 1
+
+    def commit(self) -> int:
+        """
+        Makes all appended records durable. Returns how many records were committed.
+        """
+        if not self._pending:
+            return 0
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        _write_index_atomically(index_path_for(self._segment), self._index)
+
+        committed, self._pending = self._pending, 0
+        if self._offset >= self.segment_max_bytes:
+            self._file.close()
+            self._open_segment(self._seq + 1)
+        return committed
+
+    def close(self):
+        if self._file:
+            self.commit()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ReplayArchiveReader:
+    """
+    Random access to archived metas by replay ID across all segments in archive_dir.
+    """
+
+    def __init__(self, archive_dir: Path, prefix: str = SEGMENT_PREFIX):
+        self.archive_dir = Path(archive_dir)
+        self.prefix = prefix
+        self._locations: Dict[str, Tuple[Path, int, int]] = {}
+        # Later segments override earlier ones, so the newest record wins
+        for _, segment in list_segments(self.archive_dir, self.prefix):
+            index_path = index_path_for(segment)
+            if not index_path.exists():
+                continue
+            for replay_id, (offset, length) in orjson.loads(index_path.read_bytes()).items():
+                self._locations[replay_id] = (segment, offset, length)
+
+    def __contains__(self, replay_id: str) -> bool:
+        return replay_id in self._locations
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def replay_ids(self) -> Iterator[str]:
+        return iter(self._locations)
+
+    def get_bytes(self, replay_id: str) -> Optional[bytes]:
+        location = self._locations.get(replay_id)
+        if location is None:
+            return None
+        segment, offset, length = location
+        with open(segment, "rb") as f:
+            f.seek(offset)
+            return gzip.decompress(f.read(length)).rstrip(b"\n")
+
+    def get(self, replay_id: str) -> Optional[dict]:
+        raw = self.get_bytes(replay_id)
+        return orjson.loads(raw) if raw is not None else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read a meta JSON from a replay archive.")
+    parser.add_argument("archive_dir", type=Path, help="Directory holding the archive segments")
+    parser.add_argument("replay_id", nargs="?", help="Replay ID to print. Omit to print archive stats")
+    parser.add_argument("--prefix", default=SEGMENT_PREFIX, help="Segment file prefix")
+    args = parser.parse_args()
+
+    reader = ReplayArchiveReader(args.archive_dir, prefix=args.prefix)
+    if args.replay_id is None:
+        print(f"{len(list_segments(args.archive_dir, args.prefix))} segments, {len(reader)} replays")
+    else:
+        raw = reader.get_bytes(args.replay_id)
+        if raw is None:
+            raise SystemExit(f"replay_id {args.replay_id} not found in {args.archive_dir}")
+        print(raw.decode("utf-8"))
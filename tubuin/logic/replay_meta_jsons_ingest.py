@@ -3,11 +3,19 @@
 # TO DO: upon completion, batches to msgpack?
 
 import os
+import time
+import uuid
+import hashlib
 import argparse
 from pathlib import Path
 
 # import logging
 import orjson
+from logic.replay_archive import ReplayArchiveWriter
+from logic.replay_players import STAGING_COLUMNS, STAGING_TABLE, extract_player_rows
+from logic import ingest_manifest
+from logic.ingest_manifest import IngestManifest
+from sql.statement_registry import statements
 # from watchdog.observers import Observer
 # from watchdog.events import FileSystemEventHandler
 # import time
@@ -15,6 +23,11 @@ import orjson
 # --- Configuration ---
 MIN_AGE_SEC = 5.0  # Minimum age of file in seconds before processing
 MOVE_ON_SUCCESS = True  # Move processed metas to a "processed" subdirectory
+ARCHIVE_ON_SUCCESS = True  # Append processed metas to compressed archive segments instead of moving files
+PRECHECK_EXISTING = True  # Look up replay_ids already in the DB before sending their payloads
+PRECHECK_BATCH_SIZE = 500  # Meta files per batch, one `= ANY(%s)` lookup per batch
+STAGE_PLAYERS = True  # COPY extracted player rows into raw.replay_players_staging with each new meta
+USE_MANIFEST = True  # Track batches/files in <metas>/ingest_manifest.sqlite3 so reruns skip committed work
 
 # === Console Message Settings ===
 DEBUG = False   # Verbose output for debugging
@@ -32,8 +45,7 @@ VERBOSE = False
 import psycopg
 from psycopg import sql
 from psycopg.types.json import Jsonb
-from psycopg.types.numeric import Float4, Int4
-from datetime import datetime, timezone
+from datetime import datetime
 
 # class MetaFileHandler(FileSystemEventHandler):
 #     def __init__(self, cursor, processed_dir):
@@ -68,15 +80,20 @@ def formatted_log_time():
     return s.lstrip("0")         # "3:07:05 PM"
 
 
-def build_query(table, columns, conflict_column=None):
+def build_query(table, columns, conflict_columns=None):
     """
     Returns a psycopg2.sql.Composed INSERT ... query with optional ON CONFLICT DO NOTHING.
+    conflict_columns is a column name or a list of them.
     """
-    if DEBUG: print(f"    => build_query table: {table} columns: {columns} conflict_column: {conflict_column}")
+    if DEBUG: print(f"    => build_query table: {table} columns: {columns} conflict_columns: {conflict_columns}")
     
     table_ident = sql.Identifier(*table.split("."))
     col_idents  = [sql.Identifier(c) for c in columns]
-    conflict_clause = sql.SQL("ON CONFLICT ({}) DO NOTHING").format(sql.Identifier(conflict_column)) if conflict_column else sql.SQL("")
+    if isinstance(conflict_columns, str):
+        conflict_columns = [conflict_columns]
+    conflict_clause = sql.SQL("ON CONFLICT ({}) DO NOTHING").format(
+        sql.SQL(", ").join(sql.Identifier(c) for c in conflict_columns)
+    ) if conflict_columns else sql.SQL("")
 
     query = sql.SQL("INSERT INTO {} ({}) VALUES ({}) {}").format(
         table_ident,
@@ -88,6 +105,21 @@ def build_query(table, columns, conflict_column=None):
     return query
 
 
+statements.register(
+    "insert_replays_cache",
+    # (replay_id, start_time) is the unique key of the partitioned cache, see migration 005
+    lambda: build_query("raw.replays_cache", ["replay_id", "start_time", "raw_jsonb"], ["replay_id", "start_time"]),
+)
+statements.register(
+    "existing_replay_ids",
+    lambda: sql.SQL(
+        "SELECT replay_id FROM raw.replays_cache WHERE replay_id = ANY(%s) "
+        "UNION "
+        "SELECT replay_id FROM raw.replays WHERE replay_id = ANY(%s)"
+    ),
+)
+
+
 def transform_data_for_replay_cache_query(meta):
     replay_id = meta.get("id")
     if DEBUG: print(f"    => transform_data_for_replay_cache_query meta: {replay_id}")
@@ -97,6 +129,22 @@ def transform_data_for_replay_cache_query(meta):
     return (replay_id, start_time, raw_jsonb)
 
 
+def stage_player_rows(cursor, rows):
+    """
+    Bulk-loads extracted player rows into the staging table, in the caller's transaction.
+    """
+    if not rows:
+        return 0
+    query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(*STAGING_TABLE.split(".")),
+        sql.SQL(", ").join(sql.Identifier(c) for c in STAGING_COLUMNS),
+    )
+    with cursor.copy(query) as copy:
+        for row in rows:
+            copy.write_row(row)
+    return len(rows)
+
+
 def push_to_replay_cache(meta, cursor):
     replay_id = meta.get('id', 'unknown')
     status = ""
@@ -107,10 +155,9 @@ def push_to_replay_cache(meta, cursor):
         base = f"    => push_to_replay_cache replay_id: {replay_id}"
 
     transformed_data = transform_data_for_replay_cache_query(meta)
-    query = build_query("raw.replays_cache", ["replay_id", "start_time", "raw_jsonb"], "replay_id")
 
     try:
-        cursor.execute(query, transformed_data)
+        statements.execute(cursor, "insert_replays_cache", transformed_data)
         if cursor.rowcount == 0:    # rows affected the INSERT hit the ON CONFLICT and did nothing
             status = "already exists, skipped"
             rowsSkipped += 1
@@ -122,6 +169,19 @@ def push_to_replay_cache(meta, cursor):
             status = f"{cursor.rowcount} row(s) inserted"
             rowsInserted += cursor.rowcount
 
+            if STAGE_PLAYERS:
+                replay_id, start_time, _ = transformed_data
+                try:
+                    player_rows = extract_player_rows(meta, replay_id, start_time)
+                except Exception as e:
+                    # e.g. a malformed player entry: keep the raw row, the incremental derive
+                    # sweep extracts its players from raw_jsonb, staging is only a shortcut
+                    print(f"{formatted_log_time()} replay_id {replay_id} players not staged. Error: {e}")
+                    status += ", players not staged"
+                else:
+                    staged = stage_player_rows(cursor, player_rows)
+                    status += f", {staged} player(s) staged"
+
             if DEBUG:
                 print(f"{base} {status}")
             # logging.info(f"Inserted replay_id {replay_id}")
@@ -138,12 +198,30 @@ def push_to_replay_cache(meta, cursor):
         #     "Failed to insert meta %s: %s", meta.get("id"), str(e)
         # )
         return (False, rowsInserted, rowsSkipped, status)
-    
-    except Exception as e:
-        return (False, rowsInserted, rowsSkipped, status)
 
     return (True, rowsInserted, rowsSkipped, status)
 
+def fetch_existing_replay_ids(cursor, replay_ids):
+    """
+    Returns the subset of replay_ids already present in raw.replays_cache or raw.replays.
+    One round trip per batch, so duplicates never ship their JSONB payload.
+    """
+    if not replay_ids:
+        return set()
+
+    try:
+        statements.execute(cursor, "existing_replay_ids", (replay_ids, replay_ids))
+        existing = {row[0] for row in cursor.fetchall()}
+        cursor.connection.commit()
+    except psycopg.Error as e:
+        # Fall back to sending everything, the INSERT's ON CONFLICT still protects us
+        print(f"{formatted_log_time()} replay_id precheck failed, sending all payloads. Error: {e}")
+        cursor.connection.rollback()
+        return set()
+
+    if DEBUG: print(f"    => fetch_existing_replay_ids checked: {len(replay_ids)} existing: {len(existing)}")
+    return existing
+
 def file_is_old_enough(path: str, min_age_sec: float = 2.0) -> bool:
     """
     Return True if the file’s last-modified time is at least min_age_sec seconds ago.
@@ -162,52 +240,166 @@ def get_meta_files(directory):
         if f.endswith(".json")
     ]
 
-def process_json_file(filepath, cursor, processed_dir, naughty_dir):
+def read_meta_file(filepath):
+    """
+    Returns (raw_bytes, meta) for filepath, or None if it is not ready or not valid JSON.
+    """
     if not filepath.endswith(".json"):
-        return False
-
-    if(DEBUG or (PRINT_MESSAGES and VERBOSE)): base = f"{formatted_log_time()} Processing file: {os.path.basename(filepath)}"
+        return None
 
     if not file_is_old_enough(filepath, min_age_sec=MIN_AGE_SEC):
         if(DEBUG or (PRINT_MESSAGES and VERBOSE)):
-            status = f"  ...age < {MIN_AGE_SEC}, skipped"#.ljust(28)
-            print(f"{base} {status}")
-        return False
-    else:
-        if(DEBUG or (PRINT_MESSAGES and VERBOSE)): 
-            status = f"  ...pushing"#.ljust(28)
+            print(f"{formatted_log_time()} Processing file: {os.path.basename(filepath)}   ...age < {MIN_AGE_SEC}, skipped")
+        return None
 
     with open(filepath, "rb") as f:
-            try:
-                meta = orjson.loads(f.read())
-            except orjson.JSONDecodeError as e:
-                if(DEBUG or (PRINT_MESSAGES and VERBOSE)): print(f"Error decoding JSON from {os.path.basename(filepath)}: {e}")
-                return False
-            is_success, rowsInserted, rowsSkipped, push_status = push_to_replay_cache(meta, cursor)
-            
-    if (DEBUG or (PRINT_MESSAGES and VERBOSE)): print(f"{base} {status} ...{push_status}")
-
-    if (MOVE_ON_SUCCESS and is_success):
-        # move meta file to processed directory
+        raw = f.read()
+        try:
+            return (raw, orjson.loads(raw))
+        except orjson.JSONDecodeError as e:
+            if(DEBUG or (PRINT_MESSAGES and VERBOSE)): print(f"Error decoding JSON from {os.path.basename(filepath)}: {e}")
+            return None
+
+def move_meta_file(filepath, processed_dir, naughty_dir):
+    # move meta file to processed directory
+    filename = os.path.basename(filepath)
+    try:
+        os.rename(
+            os.path.join(filepath),
+            os.path.join(processed_dir, os.path.basename(filename))
+        )
+    except FileExistsError:
+        print(f"{filename} already in processed directory, moving to naughty.")
         try:
-            filename = os.path.basename(filepath)
             os.rename(
                 os.path.join(filepath),
-                os.path.join(processed_dir, os.path.basename(filename))
+                os.path.join(naughty_dir, os.path.basename(filename))
             )
-        except FileExistsError:
-            print(f"{filename} already in processed directory, moving to naughty.")
-            try:
-                os.rename(
-                    os.path.join(filepath),
-                    os.path.join(naughty_dir, os.path.basename(filename))
-                )
-            except Exception as e:
-                print(f"meta_jsons {filename} naughty_move error: {e}")
         except Exception as e:
-            print(f"meta_jsons {filename} move error: {e}")
+            print(f"meta_jsons {filename} naughty_move error: {e}")
+            return False
+    except Exception as e:
+        print(f"meta_jsons {filename} move error: {e}")
+        return False
+    return True
+
+def archive_meta_files(archived, processed_archive):
+    """
+    Appends (filepath, raw, replay_id) entries to the processed archive and deletes the
+    originals once it is fsynced. Metas already in the DB are archived like new ones, the
+    same as the move path puts them in processed.
+    """
+    for filepath, raw, replay_id in archived:
+        processed_archive.append(replay_id, raw)
 
-    return (rowsInserted, rowsSkipped)
+    try:
+        processed_archive.commit()
+    except OSError as e:
+        # Originals stay in place and get archived again on the next run
+        print(f"meta_jsons archive commit error: {e}")
+        return False
+
+    for filepath, _, _ in archived:
+        try:
+            os.remove(filepath)
+        except Exception as e:
+            print(f"meta_jsons {os.path.basename(filepath)} remove error: {e}")
+    return True
+
+def process_meta_batch(filepaths, cursor, processed_dir, naughty_dir, processed_archive=None, manifest=None):
+    """
+    Decodes a batch of meta files, pre-checks their replay_ids in one query and
+    only pushes the metas that are not in the DB yet. Known metas are still moved,
+    or archived when an archive is given.
+    With a manifest, files whose content already committed in an earlier run skip the DB entirely.
+    Returns (rowsInserted, rowsSkipped, rowsReconciled, bytesRead).
+    """
+    rowsInserted = 0
+    rowsSkipped = 0
+    rowsReconciled = 0
+    bytesRead = 0
+
+    loaded = []
+    for filepath in filepaths:
+        result = read_meta_file(filepath)
+        if result is not None:
+            raw, meta = result
+            key = (os.path.basename(filepath), hashlib.sha256(raw).hexdigest())
+            loaded.append((filepath, raw, meta, key))
+            bytesRead += len(raw)
+
+    known = {}
+    if manifest is not None:
+        known = manifest.lookup(key for _, _, _, key in loaded)
+        manifest.record_batch(
+            uuid.uuid4().hex,
+            [(*key, meta.get("id")) for _, _, meta, key in loaded if key not in known],
+        )
+
+    # Files already committed in an earlier run only need their move finished
+    to_push = [meta["id"] for _, _, meta, key in loaded
+               if meta.get("id") and known.get(key, ("",))[0] not in ingest_manifest.COMMITTED_STATUSES]
+
+    existing_ids = set()
+    if PRECHECK_EXISTING:
+        existing_ids = fetch_existing_replay_ids(cursor, to_push)
+
+    archived = []
+    moved = []
+    commit_statuses = []
+    for filepath, raw, meta, key in loaded:
+        previous_status = known.get(key, ("",))[0]
+        pushed = False
+        if previous_status in ingest_manifest.COMMITTED_STATUSES:
+            is_success, push_status = True, f"{previous_status} in an earlier run, reconciled"
+            rowsReconciled += 1
+        elif meta.get("id") in existing_ids:
+            is_success, push_status = True, "already exists, precheck skipped"
+            is_duplicate = True
+            rowsSkipped += 1
+        else:
+            is_success, inserted, skipped, push_status = push_to_replay_cache(meta, cursor)
+            pushed = True
+            rowsInserted += inserted
+            rowsSkipped += skipped
+            is_duplicate = is_success and inserted == 0
+
+        if (DEBUG or (PRINT_MESSAGES and VERBOSE)): print(f"{formatted_log_time()} Processing file: {os.path.basename(filepath)}   ...pushing ...{push_status}")
+
+        if not is_success:
+            commit_statuses.append((key, ingest_manifest.FAILED))
+            continue
+        if previous_status not in ingest_manifest.COMMITTED_STATUSES:
+            status = ingest_manifest.DUPLICATE if is_duplicate else ingest_manifest.COMMITTED
+            if manifest is not None and pushed:
+                # Each push is its own Postgres transaction: record it as soon as it committed,
+                # so a crash later in the batch doesn't leave it pending
+                manifest.mark_commit_status([(key, status)])
+            else:
+                commit_statuses.append((key, status))
+
+        if processed_archive is not None:
+            replay_id = meta.get("id") or Path(filepath).stem
+            archived.append((filepath, raw, replay_id))
+            moved.append(key)
+        elif MOVE_ON_SUCCESS:
+            if move_meta_file(filepath, processed_dir, naughty_dir):
+                moved.append(key)
+
+    if manifest is not None:
+        # Precheck hits and failures, nothing was committed for them
+        manifest.mark_commit_status(commit_statuses)
+
+    if archived and not archive_meta_files(archived, processed_archive):
+        moved = []
+
+    if manifest is not None:
+        manifest.mark_moved(moved)
+
+    return (rowsInserted, rowsSkipped, rowsReconciled, bytesRead)
+
+def process_json_file(filepath, cursor, processed_dir, naughty_dir):
+    return process_meta_batch([filepath], cursor, processed_dir, naughty_dir)
 
 def process_meta_jsons_folder(cursor, metas_dir: Path, processed_dir: Path, naughty_dir: Path): #, startListener: bool):
     print("Meta files in:", metas_dir)
@@ -215,18 +407,52 @@ def process_meta_jsons_folder(cursor, metas_dir: Path, processed_dir: Path, naug
     print("Processed files will go to:", processed_dir)
     processed_dir.mkdir(exist_ok=True)
 
+    started = time.perf_counter()
+    manifest = None
+    if USE_MANIFEST:
+        manifest = IngestManifest(metas_dir / ingest_manifest.MANIFEST_FILENAME)
+        manifest.begin_run()
+        pending_moves = manifest.reconcile(metas_dir)
+        if pending_moves: print(f"{formatted_log_time()} Manifest: {pending_moves} committed file(s) still need to be moved")
+
     filenames = get_meta_files(metas_dir)
     if DEBUG: print(f"filename count: {len(filenames)}")
 
+    processed_archive = None
+    if ARCHIVE_ON_SUCCESS:
+        processed_archive = ReplayArchiveWriter(processed_dir)
+
     totalRowsInserted = 0
     totalRowsSkipped = 0
-    for filename in filenames:
-        full_path = os.path.join(metas_dir, filename)
-        rowsInserted, rowsSkipped = process_json_file(full_path, cursor, processed_dir, naughty_dir)
-        totalRowsInserted += rowsInserted
-        totalRowsSkipped += rowsSkipped
-
-    print(f"{formatted_log_time()} Total: {len(filenames)} Inserted: {totalRowsInserted} Skipped: {totalRowsSkipped} MOVE_ON_SUCCESS: {MOVE_ON_SUCCESS}")
+    totalRowsReconciled = 0
+    totalBytesRead = 0
+    try:
+        for i in range(0, len(filenames), PRECHECK_BATCH_SIZE):
+            batch = [os.path.join(metas_dir, filename) for filename in filenames[i:i + PRECHECK_BATCH_SIZE]]
+            rowsInserted, rowsSkipped, rowsReconciled, bytesRead = process_meta_batch(
+                batch, cursor, processed_dir, naughty_dir, processed_archive, manifest
+            )
+            totalRowsInserted += rowsInserted
+            totalRowsSkipped += rowsSkipped
+            totalRowsReconciled += rowsReconciled
+            totalBytesRead += bytesRead
+    finally:
+        if ARCHIVE_ON_SUCCESS:
+            processed_archive.close()
+
+    elapsed = time.perf_counter() - started
+    filesPerSec = len(filenames) / elapsed if elapsed > 0 else 0.0
+    mbPerSec = totalBytesRead / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+    if manifest is not None:
+        manifest.finish_run(len(filenames), totalBytesRead, totalRowsInserted, totalRowsSkipped, totalRowsReconciled, elapsed)
+        manifest.prune()
+        manifest.close()
+
+    print(f"{formatted_log_time()} Total: {len(filenames)} Inserted: {totalRowsInserted} Skipped: {totalRowsSkipped} Reconciled: {totalRowsReconciled} MOVE_ON_SUCCESS: {MOVE_ON_SUCCESS} ARCHIVE_ON_SUCCESS: {ARCHIVE_ON_SUCCESS}")
+    print(f"{formatted_log_time()} Throughput: {filesPerSec:.1f} files/s {mbPerSec:.2f} MB/s Time: {elapsed:.2f}s")
+    if PRINT_MESSAGES:
+        for line in statements.summary_lines():
+            print(f"{formatted_log_time()} {line}")
     # # Then watch for new files
     # if startListener:
     #     watch_folder(cursor)
@@ -268,5 +494,4 @@ if __name__ == "__main__":
                 print("\n=> Interrupted by user. Shutting down...")
             finally:
                 cursor.close()
-                conn.close()
                 print("meta file Ingest exited")
@@ -0,0 +1,86 @@
+# tubuin\logic\replay_players.py
+# Extracts per-player rows from a decoded replay meta, once, at ingest time.
+# Mirrors the JSONB expansion in sql/update_derived_match_player_unlogged.sql so the
+# derived step can consume raw.replay_players_staging instead of re-exploding raw_jsonb.
+
+import re
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+# Same character class as regexp_replace(player ->> 'skill', '[\[\]#~()\s]+', '', 'g')
+SKILL_STRIP_RE = re.compile(r"[\[\]#~()\s]+")
+
+STAGING_TABLE = "raw.replay_players_staging"
+STAGING_COLUMNS = [
+    "replay_id", "start_time", "user_id", "name", "player_id",
+    "ally_team_id", "skill", "rank", "country_code", "faction", "won",
+]
+
+PlayerRow = Tuple[
+    str, datetime, Optional[int], Optional[str], Optional[int],
+    Optional[int], Optional[float], Optional[int], Optional[str], Optional[str], Optional[bool],
+]
+
+
+def _text(value: Any) -> Optional[str]:
+    # Equivalent of jsonb ->> for scalars
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _nullif_int(value: Any) -> Optional[int]:
+    # NULLIF(x ->> 'key', '')::int
+    text = _text(value)
+    if text is None or text == "":
+        return None
+    return int(text)
+
+
+def _skill(value: Any) -> Optional[float]:
+    # NULLIF(regexp_replace(x ->> 'skill', ...), '')::real
+    text = _text(value)
+    if text is None:
+        return None
+    text = SKILL_STRIP_RE.sub("", text)
+    return float(text) if text else None
+
+
+def _bool(value: Any) -> Optional[bool]:
+    # (x ->> 'key')::boolean
+    text = _text(value)
+    if text is None:
+        return None
+    lowered = text.strip().lower()
+    if lowered in ("t", "true", "y", "yes", "on", "1"):
+        return True
+    if lowered in ("f", "false", "n", "no", "off", "0"):
+        return False
+    raise ValueError(f"invalid boolean value: {text!r}")
+
+
+def extract_player_rows(meta: dict, replay_id: str, start_time: datetime) -> List[PlayerRow]:
+    """
+    Returns one row per player in meta['AllyTeams'][*]['Players'], in STAGING_COLUMNS order.
+    """
+    rows: List[PlayerRow] = []
+    for team in meta.get("AllyTeams") or []:
+        ally_team_id = _nullif_int(team.get("allyTeamId"))
+        won = _bool(team.get("winningTeam"))
+        for player in team.get("Players") or []:
+            rows.append((
+                replay_id,
+                start_time,
+                _nullif_int(player.get("userId")),
+                _text(player.get("name")),
+                _nullif_int(player.get("playerId")),
+                ally_team_id,
+                _skill(player.get("skill")),
+                _nullif_int(player.get("rank")),
+                _text(player.get("countryCode")),
+                _text(player.get("faction")),
+                won,
+            ))
+    return rows
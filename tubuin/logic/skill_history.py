@@ -0,0 +1,96 @@
+# tubuin\logic\skill_history.py
+# Dense skillHistory built at export time from the sparse skillHistoryRaw the player page query
+# stores ({category: {"dates": [...], "skills": [...]}}, only the days a player has snapshots).
+# A fetched batch of pages is densified together: every (player, category) series becomes a row
+# of one day-grid array, so the gap filling is a handful of array operations per batch instead
+# of a Python loop per day and player, and the database no longer builds the grid.
+#
+# The fill reproduces the SQL grid it replaces exactly:
+#   COALESCE(avg, LAG(avg, 1, 0.0) OVER (PARTITION BY user, category ORDER BY day))
+# a missing day takes the previous day's value, only one day far (further gaps are null), and a
+# missing first day of the window is 0.0. Values were rounded by the query already.
+
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# --- Configuration ---
+RAW_KEY = "skillHistoryRaw"
+DENSE_KEY = "skillHistory"
+CARRY_DAYS = 1  # LAG(avg, 1) carries one day; None carries the last value across any gap
+
+
+def empty_skill_history() -> Dict[str, List[Any]]:
+    return {"labels": [], "datasets": []}
+
+
+def _jsonb_key_order(page: Dict[str, Any]) -> Dict[str, Any]:
+    # jsonb stores object keys by length, then bytewise; keep the order the SQL-built page had
+    return dict(sorted(page.items(), key=lambda kv: (len(kv[0].encode()), kv[0].encode())))
+
+
+def densify_skill_histories(
+    pages: List[Dict[str, Any]],
+    from_date: date,
+    to_date: date,
+    carry_days: Optional[int] = CARRY_DAYS,
+) -> List[Dict[str, Any]]:
+    """
+    Replaces skillHistoryRaw with the dense skillHistory in every page of the batch, for the
+    window from_date..to_date (both inclusive). Datasets are ordered by category, labels are
+    shared by all pages. Updates the list in place and returns it.
+    """
+    days = np.arange(np.datetime64(from_date, "D"), np.datetime64(to_date, "D") + 1)
+    num_days = len(days)
+    labels = np.datetime_as_string(days, unit="D").tolist()
+
+    owners: List[int] = []  # page of each series
+    names: List[str] = []  # category of each series
+    series_ids, day_ids, values = [], [], []
+    densified = []  # pages written before the query stored skillHistoryRaw keep their skillHistory
+    for page_no, page in enumerate(pages):
+        if RAW_KEY not in page:
+            continue
+        densified.append(page_no)
+        for category, series in sorted((page.pop(RAW_KEY) or {}).items()):
+            dates = np.array(series["dates"], dtype="datetime64[D]")
+            series_ids.append(np.full(len(dates), len(names)))
+            day_ids.append((dates - days[0]).astype(np.int64))
+            values.append(np.asarray(series["skills"], dtype=np.float64))
+            owners.append(page_no)
+            names.append(category)
+
+    datasets: List[List[Dict[str, Any]]] = [[] for _ in pages]
+    if names and num_days:
+        rows = np.concatenate(series_ids)
+        cols = np.concatenate(day_ids)
+        known = np.concatenate(values)
+        inside = (cols >= 0) & (cols < num_days)  # the grid only ever had the window's days
+
+        grid = np.full((len(names), num_days), np.nan)
+        has = np.zeros((len(names), num_days), dtype=bool)
+        grid[rows[inside], cols[inside]] = known[inside]
+        has[rows[inside], cols[inside]] = True
+
+        # Index of the last day with data at or before each day, -1 before the first one
+        day_no = np.arange(num_days)
+        last = np.maximum.accumulate(np.where(has, day_no, -1), axis=1)
+        filled = np.take_along_axis(grid, np.maximum(last, 0), axis=1)
+        reachable = last >= 0
+        if carry_days is not None:
+            reachable &= day_no - last <= carry_days
+        filled[~reachable] = np.nan
+        filled[~has[:, 0], 0] = 0.0  # LAG's default, only the first row of a partition gets it
+
+        data = np.where(np.isnan(filled), None, filled).tolist()
+        for page_no, category, row in zip(owners, names, data):
+            datasets[page_no].append({"data": row, "label": category})
+
+    for page_no in densified:
+        page = pages[page_no]
+        page[DENSE_KEY] = (
+            {"labels": labels, "datasets": datasets[page_no]} if datasets[page_no] else empty_skill_history()
+        )
+        pages[page_no] = _jsonb_key_order(page)
+    return pages
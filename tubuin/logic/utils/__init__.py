@@ -1,2 +1,3 @@
 # tubuin/logic/utils/__init__.py
-from .sftp import upload_gzipped_and_decompress_remotely
\ No newline at end of file
+from .sftp import upload_gzipped_and_decompress_remotely
+from .sftp import upload_and_move_remotely
\ No newline at end of file
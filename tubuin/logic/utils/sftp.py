@@ -33,6 +33,15 @@ def safe_remove_remote(sftp: paramiko.SFTPClient, remote_path: str):
             logger.warning(f"Failed to clean up remote file {remote_path}: {e}")
 
 
+def read_remote_file(sftp: paramiko.SFTPClient, remote_path: str) -> Optional[bytes]:
+    """Returns a remote file's content, or None if it doesn't exist."""
+    try:
+        with sftp.open(remote_path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
 def compress_to_gz(local_path: Path) -> Path:
     """Compresses a file and returns the path to the new .gz file."""
     gz_path = local_path.with_suffix(local_path.suffix + ".gz")
@@ -60,6 +69,15 @@ def execute_remote_cmd(ssh: paramiko.SSHClient, cmd: str, desc: str = ""):
         raise RuntimeError(error_msg)
 
 
+def move_remote_files(ssh: paramiko.SSHClient, moves):
+    """
+    Renames (src, dst) remote paths in order in one SSH command, stopping at the first failure,
+    so a set of staged files replaces the live ones together rather than one upload at a time.
+    """
+    move_cmd = " && ".join(f"mv -f {src} {dst}" for src, dst in moves)
+    execute_remote_cmd(ssh, move_cmd, "staged move/rename")
+
+
 def upload_gzipped_and_decompress_remotely(
     sftp: paramiko.SFTPClient,
     ssh: paramiko.SSHClient,
@@ -119,3 +137,40 @@ def upload_gzipped_and_decompress_remotely(
 
         if remote_uncompressed_path_str:
             safe_remove_remote(sftp, remote_uncompressed_path_str)
+
+
+def upload_and_move_remotely(
+    sftp: paramiko.SFTPClient,
+    ssh: paramiko.SSHClient,
+    local_path: Path,
+    remote_path: Path,
+):
+    """
+    Uploads a file as is, for files that are already compressed and would not get any
+    smaller from gzip, with the same temp file + SSH 'mv' final rename.
+    """
+    if not local_path.is_file():
+        raise FileNotFoundError(f"Local file not found: {local_path}")
+
+    remote_temp_path_str: Optional[str] = None
+
+    try:
+        rand_hex = os.urandom(4).hex()
+        remote_temp_path_str = remote_path.with_name(
+            f".{remote_path.name}.{rand_hex}.tmp"
+        ).as_posix()
+
+        sftp.put(str(local_path), remote_temp_path_str)
+        logger.info(f"Uploaded file to {remote_temp_path_str}")
+
+        move_cmd = f"mv -f {remote_temp_path_str} {remote_path.as_posix()}"
+        execute_remote_cmd(ssh, move_cmd, "final move/rename")
+
+        logger.info(f"Upload successful: {local_path} -> {remote_path}")
+
+    except Exception:
+        logger.exception("SFTP upload/move failed")
+        raise
+    finally:
+        if remote_temp_path_str:
+            safe_remove_remote(sftp, remote_temp_path_str)
@@ -3,9 +3,31 @@ from sql.queries import *
 from sql.sql_command import SQLCommand
 
 
-class MoveRawReplays(SQLCommand):
-    label = "Move Raw Replays"
-    query = move_raw_replays_cache_replays
+class MoveRawReplaysCacheDefault(SQLCommand):
+    label = "Move Raw Replays Cache Default"
+    query = move_raw_replays_cache_default
+    rowcount_from = "moved"  # one row: (moved, inserted)
+
+
+class EnsureRangePartitions(SQLCommand):
+    label = "Ensure Range Partitions"
+    query = ensure_range_partitions
+    rowcount_from = "created"
+    explain = False
+
+
+class RetireRawReplaysCachePartitions(SQLCommand):
+    label = "Retire Raw Replays Cache Partitions"
+    query = retire_raw_replays_cache_partitions
+    rowcount_from = "moved"  # one row per retired partition: (partition_name, moved)
+    explain = False  # EXPLAIN ANALYZE would run the DDL
+
+
+class SelectRawReplaysCachePartitioned(SQLCommand):
+    label = "Select Raw Replays Cache Partitioned"
+    query = select_raw_replays_cache_partitioned
+    fetch = True  # one row: (partitioned)
+    explain = False
 
 
 class UpdateDerivedMatchPlayers(SQLCommand):
@@ -13,22 +35,86 @@ class UpdateDerivedMatchPlayers(SQLCommand):
     query = update_derived_match_player_unlogged
 
 
+class UpdateDerivedMatchPlayersFromStaging(SQLCommand):
+    label = "Update Derived Match Players From Staging"
+    query = update_derived_match_player_unlogged_from_staging
+
+
+class UpdateDerivedMatchPlayersIncremental(SQLCommand):
+    label = "Update Derived Match Players Incremental"
+    query = update_derived_match_player_unlogged_incremental
+    rowcount_from = "inserted"  # one row: (inserted, replays, watermarks)
+
+
 class UpdateDerivedReplays(SQLCommand):
     label = "Update Derived Replays"
     query = update_derived_replays
 
 
+class UpdateDerivedReplaysIncremental(SQLCommand):
+    label = "Update Derived Replays Incremental"
+    query = update_derived_replays_incremental
+    rowcount_from = "inserted"  # one row: (inserted, candidates, watermarks)
+
+
 class UpdateAnalyticsSkillSnapshots(SQLCommand):
     label = "Update Analytics Match Skill Snapshots"
     query = update_analytics_match_skill_snapshots
 
 
-class RefreshMaterialSkillDeltas(SQLCommand):
-    label = "Refresh Materialized View: Match Skill Deltas"
-    commit = False
-    query = refresh_mat_derived_match_skill_deltas
+class UpdateDerivedMatchSkillDeltas(SQLCommand):
+    label = "Update Derived Match Skill Deltas"
+    query = update_derived_match_skill_deltas
+    rowcount_from = "upserted"  # one row: (upserted, changed_pairs, watermarks)
+
+
+class RebuildDerivedMatchSkillDeltas(SQLCommand):
+    label = "Rebuild Derived Match Skill Deltas"
+    query = rebuild_derived_match_skill_deltas
+    rowcount_from = "upserted"  # one row: (upserted, removed, watermarks)
 
 class UpdateAnalyticsPlayerPageJson(SQLCommand):
     label = "Update Analytics Player Page JSON"
-    commit = False
-    query = update_analytics_player_page_json
\ No newline at end of file
+    query = update_analytics_player_page_json
+
+
+class UpdateAnalyticsPlayerPageJsonFromDaily(SQLCommand):
+    label = "Update Analytics Player Page JSON From Daily"
+    query = update_analytics_player_page_json_from_daily
+
+
+class UpdateAnalyticsPlayerDailyStats(SQLCommand):
+    label = "Update Analytics Player Daily Stats"
+    query = update_analytics_player_daily_stats
+    rowcount_from = "inserted"  # one row: (inserted, deleted, skill_rows, days)
+
+
+class SelectPlayerDailyStatsDays(SQLCommand):
+    label = "Select Player Daily Stats Days"
+    query = select_player_daily_stats_days
+    fetch = True  # one row per day to (re)build: (day, checked_at)
+    explain = False
+
+
+class DeleteStalePlayerDailyStats(SQLCommand):
+    label = "Delete Stale Player Daily Stats"
+    query = delete_stale_player_daily_stats
+    rowcount_from = "days"  # one row: (days, stats_rows, skill_rows)
+
+
+class SelectAnalyticsPlayerPageJsonState(SQLCommand):
+    label = "Select Analytics Player Page JSON State"
+    query = select_analytics_player_page_json_state
+    fetch = True  # one row: (checked_at, last_loaded_at, window_changed)
+    explain = False
+
+
+class DeleteStaleAnalyticsPlayerPageJson(SQLCommand):
+    label = "Delete Stale Analytics Player Page JSON"
+    query = delete_stale_analytics_player_page_json
+
+
+class UpdateSnapshotMetadataWatermark(SQLCommand):
+    label = "Update Snapshot Metadata Watermark"
+    query = update_snapshot_metadata_watermark
+    explain = False
@@ -0,0 +1,12 @@
+-- delete_stale_analytics_player_page_json.sql
+-- After a full rebuild every user active in a window has a page for it; pages still on an
+-- older window, or on a window that is no longer configured, belong to users who aged out of
+-- it and would never be exported again.
+DELETE FROM analytics.player_page_json_v4 p
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM unnest(%(window_keys)s::text[], %(window_froms)s::timestamptz[]) AS w(window_key, from_date)
+    WHERE w.window_key = p.window_key
+      AND p.data_start_date = w.from_date::date
+      AND p.data_end_date = %(timestamptz_to)s::date
+);
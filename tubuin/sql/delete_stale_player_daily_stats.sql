@@ -0,0 +1,15 @@
+-- delete_stale_player_daily_stats.sql
+-- Drops the days that left the widest player page window.
+WITH stats AS (
+    DELETE FROM analytics.player_daily_stats WHERE day < %(timestamptz_from)s::date RETURNING 1
+),
+skill AS (
+    DELETE FROM analytics.player_daily_skill WHERE day < %(timestamptz_from)s::date RETURNING 1
+),
+days AS (
+    DELETE FROM analytics.player_daily_stats_days WHERE day < %(timestamptz_from)s::date RETURNING 1
+)
+SELECT
+    (SELECT count(*) FROM days) AS days,
+    (SELECT count(*) FROM stats) AS stats_rows,
+    (SELECT count(*) FROM skill) AS skill_rows;
@@ -0,0 +1,9 @@
+-- Creates the missing partitions of %(parent)s covering now() - behind .. now() + ahead,
+-- one per %(period)s. Already existing partitions are left alone, so this is safe to rerun.
+SELECT maintenance.create_range_partitions(
+    %(parent)s::regclass,
+    %(period)s,
+    now() - %(behind)s::interval,
+    now() + %(ahead)s::interval,
+    %(unlogged)s
+) AS created;
@@ -0,0 +1,19 @@
+-- 001_raw_replay_players_staging.sql
+-- Player rows extracted in Python by the meta ingest (logic/replay_players.py).
+-- update_derived_match_player_unlogged_from_staging.sql drains this table into
+-- derived.match_players_unlogged, so raw_jsonb is only ever expanded once per replay.
+
+CREATE TABLE IF NOT EXISTS raw.replay_players_staging (
+    replay_id     text        NOT NULL,
+    start_time    timestamptz NOT NULL,
+    user_id       int,
+    name          text,
+    player_id     int,
+    ally_team_id  int,
+    skill         real,
+    rank          int,
+    country_code  text,
+    faction       text,
+    won           boolean,
+    staged_at     timestamptz NOT NULL DEFAULT now()
+);
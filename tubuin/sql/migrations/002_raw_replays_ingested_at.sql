@@ -0,0 +1,17 @@
+-- 002_raw_replays_ingested_at.sql
+-- Records when each replay arrived, so derived tables can be updated from a watermark on
+-- ingestion time instead of rescanning a start_time window of raw_jsonb every run.
+-- Existing rows all get the time of this migration, so the first incremental run after it
+-- sweeps them once (cheaply: they already have derived rows and are skipped).
+
+ALTER TABLE raw.replays_cache ADD COLUMN IF NOT EXISTS ingested_at timestamptz NOT NULL DEFAULT now();
+ALTER TABLE raw.replays       ADD COLUMN IF NOT EXISTS ingested_at timestamptz NOT NULL DEFAULT now();
+
+-- raw.replays only grows in ingested_at order (the move carries the cache's value over in
+-- start_time order, close enough for a BRIN range), raw.replays_cache is small and churns.
+CREATE INDEX IF NOT EXISTS replays_cache_ingested_at_idx ON raw.replays_cache (ingested_at);
+CREATE INDEX IF NOT EXISTS replays_ingested_at_brin ON raw.replays USING brin (ingested_at);
+
+INSERT INTO analytics.snapshot_metadata (key, last_loaded_at)
+VALUES ('match_players_unlogged', now())
+ON CONFLICT (key) DO NOTHING;
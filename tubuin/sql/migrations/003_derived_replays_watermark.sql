@@ -0,0 +1,8 @@
+-- 003_derived_replays_watermark.sql
+-- Watermark for update_derived_replays_incremental.sql. Seeded to now(): replays from before
+-- this point are covered by the 36h lookback (002 stamped them all with its own time) or by
+-- a backfill run of update_derived_replays_flow(mode="backfill").
+
+INSERT INTO analytics.snapshot_metadata (key, last_loaded_at)
+VALUES ('derived_replays', now())
+ON CONFLICT (key) DO NOTHING;
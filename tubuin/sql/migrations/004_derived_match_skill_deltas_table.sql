@@ -0,0 +1,41 @@
+-- 004_derived_match_skill_deltas_table.sql
+-- Replaces the derived.match_skill_deltas materialized view with a regular table that
+-- update_derived_match_skill_deltas.sql keeps up to date for the (user, category) pairs whose
+-- snapshots changed. rebuild_derived_match_skill_deltas.sql is the full-recompute fallback.
+-- The columns are the ones analytics.player_page_json reads from the old view.
+
+BEGIN;
+
+-- When each snapshot row arrived; snapshots can be inserted with an old start_time (lookback),
+-- so start_time can't tell which pairs changed.
+ALTER TABLE analytics.match_skill_snapshots ADD COLUMN IF NOT EXISTS inserted_at timestamptz NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS match_skill_snapshots_inserted_at_idx ON analytics.match_skill_snapshots (inserted_at);
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_matviews WHERE schemaname = 'derived' AND matviewname = 'match_skill_deltas') THEN
+        DROP MATERIALIZED VIEW derived.match_skill_deltas;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS derived.match_skill_deltas (
+    user_id             int         NOT NULL,
+    category            text        NOT NULL,
+    latest_skill        real,
+    latest_played_time  timestamptz NOT NULL,
+    updated_at          timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, category)
+);
+
+-- Initial fill in the same transaction, so readers never see an empty table
+INSERT INTO derived.match_skill_deltas (user_id, category, latest_skill, latest_played_time)
+SELECT DISTINCT ON (user_id, category) user_id, category, skill, start_time
+FROM analytics.match_skill_snapshots
+ORDER BY user_id, category, start_time DESC
+ON CONFLICT (user_id, category) DO NOTHING;
+
+INSERT INTO analytics.snapshot_metadata (key, last_loaded_at)
+VALUES ('match_skill_deltas', now())
+ON CONFLICT (key) DO NOTHING;
+
+COMMIT;
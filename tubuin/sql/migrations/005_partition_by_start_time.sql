@@ -0,0 +1,212 @@
+-- 005_partition_by_start_time.sql
+-- Range-partitions the start_time-filtered tables so windowed queries prune to the partitions
+-- they touch, and raw.replays_cache is retired by dropping whole partitions instead of DELETEs.
+--
+--   raw.replays_cache                daily    retired by maintenance.retire_cache_partitions()
+--   raw.replays                      monthly
+--   derived.replays                  monthly
+--   derived.match_players_unlogged   monthly  (unlogged partitions), gains start_time
+--   analytics.match_skill_snapshots  monthly
+--
+-- Partitioned tables can only have unique indexes that include the partition key, so the
+-- replay_id keys become (replay_id, start_time) and every ON CONFLICT target follows. start_time
+-- comes from the meta itself, so a replay_id always arrives with the same start_time.
+-- Required by the pipeline: ingest and every derive step use those targets, and the partition
+-- maintenance step (Step 0 of the ingress flow) stops with an error until this was applied.
+--
+-- Each table is rebuilt: the old one is renamed to <name>_unpartitioned (its indexes get an
+-- _old suffix), a partitioned copy is created with partitions covering its data plus the
+-- next ones, and the rows are copied. Run it in a maintenance window, ingest stopped.
+-- Drop the *_unpartitioned tables once the new ones are verified (reassign any sequence
+-- they own with ALTER SEQUENCE ... OWNED BY first). Non-unique indexes other than the ones
+-- created below, and views over these tables, have to be recreated against the new tables.
+-- flows/subflows/partition_maintenance_flow.py keeps partitions created ahead from then on.
+
+BEGIN;
+
+CREATE SCHEMA IF NOT EXISTS maintenance;
+
+-- Creates the missing partitions of p_parent, one per p_period ('day', 'week', 'month'),
+-- covering p_from .. p_to. Named <table>_pYYYYMMDD after their (UTC) lower bound.
+CREATE OR REPLACE FUNCTION maintenance.create_range_partitions(
+    p_parent   regclass,
+    p_period   text,
+    p_from     timestamptz,
+    p_to       timestamptz,
+    p_unlogged boolean DEFAULT false
+) RETURNS int
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_schema  text;
+    v_table   text;
+    v_start   timestamptz;
+    v_end     timestamptz;
+    v_name    text;
+    v_created int := 0;
+BEGIN
+    SELECT n.nspname, c.relname INTO v_schema, v_table
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.oid = p_parent;
+
+    v_start := date_trunc(p_period, p_from AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+    WHILE v_start < p_to LOOP
+        v_end  := v_start + ('1 ' || p_period)::interval;
+        v_name := v_table || '_p' || to_char(v_start AT TIME ZONE 'UTC', 'YYYYMMDD');
+        IF to_regclass(format('%I.%I', v_schema, v_name)) IS NULL THEN
+            EXECUTE format(
+                'CREATE %s TABLE %I.%I PARTITION OF %s FOR VALUES FROM (%L) TO (%L)',
+                CASE WHEN p_unlogged THEN 'UNLOGGED' ELSE '' END,
+                v_schema, v_name, p_parent, v_start, v_end
+            );
+            v_created := v_created + 1;
+        END IF;
+        v_start := v_end;
+    END LOOP;
+    RETURN v_created;
+END $$;
+
+-- Moves every raw.replays_cache partition that ends before now() - p_older_than into
+-- raw.replays, then detaches and drops it: no dead tuples, nothing left to vacuum.
+-- Returns one row per retired partition.
+CREATE OR REPLACE FUNCTION maintenance.retire_cache_partitions(p_older_than interval)
+RETURNS TABLE (partition_name text, moved bigint)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_part  record;
+BEGIN
+    FOR v_part IN
+        SELECT c.oid::regclass AS rel, c.relname,
+               substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \(''([^'']+)''\)')::timestamptz AS upper_bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'raw.replays_cache'::regclass
+          AND pg_get_expr(c.relpartbound, c.oid) <> 'DEFAULT'
+        ORDER BY upper_bound
+    LOOP
+        CONTINUE WHEN v_part.upper_bound > now() - p_older_than;
+
+        EXECUTE format(
+            'INSERT INTO raw.replays (replay_id, start_time, raw_jsonb, ingested_at) '
+            'SELECT replay_id, start_time, raw_jsonb, ingested_at FROM %s '
+            'ON CONFLICT (replay_id, start_time) DO NOTHING',
+            v_part.rel
+        );
+        GET DIAGNOSTICS moved = ROW_COUNT;
+        EXECUTE format('ALTER TABLE raw.replays_cache DETACH PARTITION %s', v_part.rel);
+        EXECUTE format('DROP TABLE %s', v_part.rel);
+
+        partition_name := v_part.relname;
+        RETURN NEXT;
+    END LOOP;
+END $$;
+
+-- Renames p_table to <name>_unpartitioned (indexes to <index>_old) and creates an empty
+-- partitioned copy under the original name, partitioned by range on start_time.
+CREATE OR REPLACE FUNCTION maintenance.swap_in_partitioned_copy(p_table regclass)
+RETURNS void
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_schema text;
+    v_table  text;
+    v_index  record;
+BEGIN
+    SELECT n.nspname, c.relname INTO v_schema, v_table
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.oid = p_table;
+
+    FOR v_index IN
+        SELECT ic.relname FROM pg_index x JOIN pg_class ic ON ic.oid = x.indexrelid
+        WHERE x.indrelid = p_table
+    LOOP
+        EXECUTE format('ALTER INDEX %I.%I RENAME TO %I', v_schema, v_index.relname, left(v_index.relname, 59) || '_old');
+    END LOOP;
+    EXECUTE format('ALTER TABLE %I.%I RENAME TO %I', v_schema, v_table, v_table || '_unpartitioned');
+    EXECUTE format(
+        'CREATE TABLE %I.%I (LIKE %I.%I INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE INCLUDING COMMENTS) '
+        'PARTITION BY RANGE (start_time)',
+        v_schema, v_table, v_schema, v_table || '_unpartitioned'
+    );
+END $$;
+
+-- --- raw.replays_cache (daily) ---
+SELECT maintenance.swap_in_partitioned_copy('raw.replays_cache');
+SELECT maintenance.create_range_partitions(
+    'raw.replays_cache', 'day',
+    COALESCE((SELECT min(start_time) FROM raw.replays_cache_unpartitioned), now()),
+    now() + interval '7 days'
+);
+CREATE TABLE raw.replays_cache_default PARTITION OF raw.replays_cache DEFAULT;
+INSERT INTO raw.replays_cache SELECT * FROM raw.replays_cache_unpartitioned;
+CREATE UNIQUE INDEX replays_cache_replay_id_start_time_key ON raw.replays_cache (replay_id, start_time);
+CREATE INDEX replays_cache_ingested_at_idx ON raw.replays_cache (ingested_at);
+
+-- --- raw.replays (monthly) ---
+SELECT maintenance.swap_in_partitioned_copy('raw.replays');
+SELECT maintenance.create_range_partitions(
+    'raw.replays', 'month',
+    COALESCE((SELECT min(start_time) FROM raw.replays_unpartitioned), now()),
+    now() + interval '3 months'
+);
+CREATE TABLE raw.replays_default PARTITION OF raw.replays DEFAULT;
+INSERT INTO raw.replays SELECT * FROM raw.replays_unpartitioned;
+CREATE UNIQUE INDEX replays_replay_id_start_time_key ON raw.replays (replay_id, start_time);
+CREATE INDEX replays_ingested_at_brin ON raw.replays USING brin (ingested_at);
+
+-- --- derived.replays (monthly) ---
+SELECT maintenance.swap_in_partitioned_copy('derived.replays');
+SELECT maintenance.create_range_partitions(
+    'derived.replays', 'month',
+    COALESCE((SELECT min(start_time) FROM derived.replays_unpartitioned), now()),
+    now() + interval '3 months'
+);
+CREATE TABLE derived.replays_default PARTITION OF derived.replays DEFAULT;
+INSERT INTO derived.replays SELECT * FROM derived.replays_unpartitioned;
+ALTER TABLE derived.replays ADD PRIMARY KEY (replay_id, start_time);
+CREATE INDEX replays_start_time_category_idx ON derived.replays (start_time, category);
+
+-- --- derived.match_players_unlogged (monthly, unlogged partitions) ---
+-- Players had no start_time; take it from their replay so the table can be partitioned and
+-- joins on (replay_id, start_time) can prune. Players whose replay is nowhere are dropped.
+ALTER TABLE derived.match_players_unlogged ADD COLUMN IF NOT EXISTS start_time timestamptz;
+UPDATE derived.match_players_unlogged mp SET start_time = r.start_time
+FROM derived.replays_unpartitioned r WHERE r.replay_id = mp.replay_id;
+UPDATE derived.match_players_unlogged mp SET start_time = r.start_time
+FROM raw.replays_unpartitioned r WHERE r.replay_id = mp.replay_id AND mp.start_time IS NULL;
+UPDATE derived.match_players_unlogged mp SET start_time = r.start_time
+FROM raw.replays_cache_unpartitioned r WHERE r.replay_id = mp.replay_id AND mp.start_time IS NULL;
+
+SELECT maintenance.swap_in_partitioned_copy('derived.match_players_unlogged');
+ALTER TABLE derived.match_players_unlogged ALTER COLUMN start_time SET NOT NULL;
+SELECT maintenance.create_range_partitions(
+    'derived.match_players_unlogged', 'month',
+    COALESCE((SELECT min(start_time) FROM derived.match_players_unlogged_unpartitioned), now()),
+    now() + interval '3 months',
+    true
+);
+CREATE UNLOGGED TABLE derived.match_players_unlogged_default PARTITION OF derived.match_players_unlogged DEFAULT;
+INSERT INTO derived.match_players_unlogged
+SELECT * FROM derived.match_players_unlogged_unpartitioned WHERE start_time IS NOT NULL;
+CREATE UNIQUE INDEX mpu_rup_unotnull ON derived.match_players_unlogged (replay_id, user_id, player_id, start_time) WHERE user_id IS NOT NULL;
+CREATE UNIQUE INDEX mpu_rp_uisnull ON derived.match_players_unlogged (replay_id, player_id, start_time) WHERE user_id IS NULL;
+CREATE INDEX mpu_user_id_idx ON derived.match_players_unlogged (user_id);
+
+-- --- analytics.match_skill_snapshots (monthly) ---
+SELECT maintenance.swap_in_partitioned_copy('analytics.match_skill_snapshots');
+SELECT maintenance.create_range_partitions(
+    'analytics.match_skill_snapshots', 'month',
+    COALESCE((SELECT min(start_time) FROM analytics.match_skill_snapshots_unpartitioned), now()),
+    now() + interval '3 months'
+);
+CREATE TABLE analytics.match_skill_snapshots_default PARTITION OF analytics.match_skill_snapshots DEFAULT;
+INSERT INTO analytics.match_skill_snapshots SELECT * FROM analytics.match_skill_snapshots_unpartitioned;
+CREATE UNIQUE INDEX match_skill_snapshots_user_id_category_start_time_key
+    ON analytics.match_skill_snapshots (user_id, category, start_time);
+CREATE INDEX match_skill_snapshots_inserted_at_idx ON analytics.match_skill_snapshots (inserted_at);
+
+COMMIT;
+
+ANALYZE raw.replays_cache;
+ANALYZE raw.replays;
+ANALYZE derived.replays;
+ANALYZE derived.match_players_unlogged;
+ANALYZE analytics.match_skill_snapshots;
@@ -0,0 +1,24 @@
+-- 006_player_page_windows.sql
+-- analytics.player_page_json_v4 holds one page per (window_key, user_id) for the named windows
+-- of logic/player_windows.py. The pages already stored are the 24 week window's.
+
+BEGIN;
+
+ALTER TABLE analytics.player_page_json_v4 ADD COLUMN IF NOT EXISTS window_key text NOT NULL DEFAULT '24w';
+
+-- The primary key was user_id alone (whatever its name), ON CONFLICT now targets both columns
+DO $$
+DECLARE
+    v_pkey text;
+BEGIN
+    SELECT conname INTO v_pkey
+    FROM pg_constraint
+    WHERE conrelid = 'analytics.player_page_json_v4'::regclass AND contype = 'p';
+    IF v_pkey IS NOT NULL THEN
+        EXECUTE format('ALTER TABLE analytics.player_page_json_v4 DROP CONSTRAINT %I', v_pkey);
+    END IF;
+END $$;
+
+ALTER TABLE analytics.player_page_json_v4 ADD PRIMARY KEY (window_key, user_id);
+
+COMMIT;
@@ -0,0 +1,50 @@
+-- 007_player_daily_stats.sql
+-- Per player, per day partial aggregates the daily player page engine (PLAYER_PAGE_ENGINE=daily)
+-- merges into pages instead of rescanning the window's matches every run.
+-- update_analytics_player_daily_stats.sql (re)builds one day of both tables, days are session
+-- time zone days, the same date_trunc('day', start_time) the page statement uses.
+
+BEGIN;
+
+-- One row per (day, user_id, category). category NULL rows hold the matches without a category,
+-- which only make a player active, every other column is left empty for them.
+CREATE TABLE IF NOT EXISTS analytics.player_daily_stats (
+    day              date        NOT NULL,
+    user_id          int         NOT NULL,
+    category         text,
+    last_start_time  timestamptz NOT NULL,
+    games            int         NOT NULL,
+    wins             int,
+    losses           int,
+    ga               int,  -- games (and wins) in lobbies at or above the hard game threshold
+    wa               int,
+    gb               int,  -- and below it
+    wb               int,
+    skill_sum        double precision,  -- of the player's skill in the day's matches, for activityData
+    skill_count      int,
+    lobby_bins       int[],  -- games per lobbyData bin, NULL without any avg_lobby_skill
+    factions         jsonb,  -- {faction: [wins, losses]}
+    usernames        jsonb,  -- {name: last seen, microseconds since the epoch}
+    recent_matches   jsonb   -- the newest matchHistory entries of the day, each with "t" (start_time, us)
+);
+CREATE INDEX IF NOT EXISTS player_daily_stats_day_idx ON analytics.player_daily_stats (day);
+CREATE INDEX IF NOT EXISTS player_daily_stats_user_day_idx ON analytics.player_daily_stats (user_id, day);
+
+-- Daily averages of analytics.match_skill_snapshots, already rounded as skillHistoryRaw holds them
+CREATE TABLE IF NOT EXISTS analytics.player_daily_skill (
+    day        date    NOT NULL,
+    user_id    int     NOT NULL,
+    category   text    NOT NULL,
+    avg_skill  numeric
+);
+CREATE INDEX IF NOT EXISTS player_daily_skill_day_idx ON analytics.player_daily_skill (day);
+CREATE INDEX IF NOT EXISTS player_daily_skill_user_day_idx ON analytics.player_daily_skill (user_id, day);
+
+-- Which days are built, when, and in which time zone; a day without matches has no rows above
+CREATE TABLE IF NOT EXISTS analytics.player_daily_stats_days (
+    day           date        PRIMARY KEY,
+    refreshed_at  timestamptz NOT NULL,
+    time_zone     text        NOT NULL
+);
+
+COMMIT;
@@ -0,0 +1,32 @@
+-- move_raw_replays_cache_default.sql
+-- Partitioned cache: moves one batch of %(batch_size)s rows older than %(older_than)s from
+-- raw.replays_cache_default into raw.replays. Daily partitions only exist from shortly before
+-- now, so late or re-ingested replays with an older start_time land in the DEFAULT partition,
+-- which retire_cache_partitions() never drops. Rows left there would also make creating a
+-- partition for their range fail. Run repeatedly until moved < batch_size, each batch in its own
+-- transaction.
+WITH to_move AS (
+  SELECT replay_id
+  FROM raw.replays_cache_default
+  WHERE start_time < NOW() - %(older_than)s::interval
+  ORDER BY start_time ASC
+  LIMIT %(batch_size)s
+),
+deleted AS (
+  DELETE FROM raw.replays_cache_default
+  USING to_move
+  WHERE raw.replays_cache_default.replay_id = to_move.replay_id
+  RETURNING raw.replays_cache_default.replay_id, raw.replays_cache_default.start_time,
+            raw.replays_cache_default.raw_jsonb, raw.replays_cache_default.ingested_at
+),
+inserted AS (
+  INSERT INTO raw.replays (replay_id, start_time, raw_jsonb, ingested_at)
+  SELECT replay_id, start_time, raw_jsonb, ingested_at
+  FROM deleted
+  ORDER BY start_time ASC
+  ON CONFLICT (replay_id, start_time) DO NOTHING
+  RETURNING 1
+)
+SELECT
+  (SELECT count(*) FROM deleted)  AS moved,
+  (SELECT count(*) FROM inserted) AS inserted;
@@ -2,11 +2,27 @@
 from . import __getattr__
 from abc import ABC, abstractmethod
 
-move_raw_replays_cache_replays = __getattr__("move_raw_replays_cache_replays")
+move_raw_replays_cache_default = __getattr__("move_raw_replays_cache_default")
 update_derived_match_player_unlogged = __getattr__("update_derived_match_player_unlogged")
+update_derived_match_player_unlogged_from_staging = __getattr__("update_derived_match_player_unlogged_from_staging")
+update_derived_match_player_unlogged_incremental = __getattr__("update_derived_match_player_unlogged_incremental")
 update_derived_replays = __getattr__("update_derived_replays")
+update_derived_replays_incremental = __getattr__("update_derived_replays_incremental")
+
+# Partition Maintenance
+ensure_range_partitions = __getattr__("ensure_range_partitions")
+retire_raw_replays_cache_partitions = __getattr__("retire_raw_replays_cache_partitions")
+select_raw_replays_cache_partitioned = __getattr__("select_raw_replays_cache_partitioned")
 
 # Stats Generation
 update_analytics_match_skill_snapshots = __getattr__("update_analytics_match_skill_snapshots")
-refresh_mat_derived_match_skill_deltas = __getattr__("refresh_mat_derived_match_skill_deltas")
-update_analytics_player_page_json = __getattr__("update_analytics_player_page_json")
\ No newline at end of file
+update_derived_match_skill_deltas = __getattr__("update_derived_match_skill_deltas")
+rebuild_derived_match_skill_deltas = __getattr__("rebuild_derived_match_skill_deltas")
+update_analytics_player_page_json = __getattr__("update_analytics_player_page_json")
+select_analytics_player_page_json_state = __getattr__("select_analytics_player_page_json_state")
+delete_stale_analytics_player_page_json = __getattr__("delete_stale_analytics_player_page_json")
+update_snapshot_metadata_watermark = __getattr__("update_snapshot_metadata_watermark")
+update_analytics_player_daily_stats = __getattr__("update_analytics_player_daily_stats")
+select_player_daily_stats_days = __getattr__("select_player_daily_stats_days")
+delete_stale_player_daily_stats = __getattr__("delete_stale_player_daily_stats")
+update_analytics_player_page_json_from_daily = __getattr__("update_analytics_player_page_json_from_daily")
@@ -0,0 +1,40 @@
+-- rebuild_derived_match_skill_deltas.sql
+-- Full recompute of derived.match_skill_deltas from every snapshot, in one transaction.
+-- Fallback for update_derived_match_skill_deltas.sql, e.g. after snapshots were edited or deleted.
+WITH latest AS (
+    SELECT DISTINCT ON (user_id, category) user_id, category, skill, start_time
+    FROM analytics.match_skill_snapshots
+    ORDER BY user_id, category, start_time DESC
+),
+upserted AS (
+    INSERT INTO derived.match_skill_deltas (user_id, category, latest_skill, latest_played_time, updated_at)
+    SELECT user_id, category, skill, start_time, NOW()
+    FROM latest
+    ON CONFLICT (user_id, category) DO UPDATE
+    SET
+        latest_skill       = EXCLUDED.latest_skill,
+        latest_played_time = EXCLUDED.latest_played_time,
+        updated_at         = EXCLUDED.updated_at
+    WHERE (derived.match_skill_deltas.latest_skill, derived.match_skill_deltas.latest_played_time)
+          IS DISTINCT FROM (EXCLUDED.latest_skill, EXCLUDED.latest_played_time)
+    RETURNING 1
+),
+removed AS (
+    -- Pairs that no longer have any snapshot
+    DELETE FROM derived.match_skill_deltas d
+    WHERE NOT EXISTS (
+        SELECT 1 FROM latest l
+        WHERE l.user_id = d.user_id AND l.category = d.category
+    )
+    RETURNING 1
+),
+watermark AS (
+    INSERT INTO analytics.snapshot_metadata (key, last_loaded_at)
+    VALUES ('match_skill_deltas', NOW())
+    ON CONFLICT (key) DO UPDATE SET last_loaded_at = EXCLUDED.last_loaded_at
+    RETURNING 1
+)
+SELECT
+    (SELECT count(*) FROM upserted) AS upserted,
+    (SELECT count(*) FROM removed) AS removed,
+    (SELECT count(*) FROM watermark) AS watermarks;
@@ -1 +0,0 @@
-REFRESH MATERIALIZED VIEW CONCURRENTLY derived.match_skill_deltas;
\ No newline at end of file
@@ -0,0 +1,4 @@
+-- Moves the raw.replays_cache partitions that ended more than %(older_than)s ago into
+-- raw.replays and drops them. One row per retired partition: (partition_name, moved).
+SELECT partition_name, moved
+FROM maintenance.retire_cache_partitions(%(older_than)s::interval);
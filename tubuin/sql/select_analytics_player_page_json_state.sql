@@ -0,0 +1,27 @@
+-- select_analytics_player_page_json_state.sql
+-- Decides between a delta and a full player page rebuild: the delta watermark, and whether
+-- any stored page was built for a different date window than the one requested, belongs to a
+-- window that is no longer configured, or a configured window has no pages yet.
+-- checked_at becomes the next watermark once the rebuild committed.
+WITH windows AS (
+    SELECT w.window_key, w.from_date
+    FROM unnest(%(window_keys)s::text[], %(window_froms)s::timestamptz[]) AS w(window_key, from_date)
+)
+SELECT
+    now() AS checked_at,
+    (SELECT last_loaded_at
+     FROM analytics.snapshot_metadata
+     WHERE key = 'player_page_json') AS last_loaded_at,
+    EXISTS (
+        SELECT 1
+        FROM analytics.player_page_json_v4 p
+        LEFT JOIN windows w ON w.window_key = p.window_key
+        WHERE w.window_key IS NULL
+           OR p.data_start_date <> w.from_date::date
+           OR p.data_end_date <> %(timestamptz_to)s::date
+    )
+    OR EXISTS (
+        SELECT 1
+        FROM windows w
+        WHERE NOT EXISTS (SELECT 1 FROM analytics.player_page_json_v4 p WHERE p.window_key = w.window_key)
+    ) AS window_changed;
@@ -0,0 +1,57 @@
+-- select_player_daily_stats_days.sql
+-- The days of timestamptz_from..timestamptz_to that update_analytics_player_daily_stats.sql has
+-- to (re)build: never built, built in another time zone, last refreshed less than settle
+-- after the day ended (replays are ingested late), or with source rows that changed since.
+-- rebuild selects every day. checked_at becomes the 'player_daily_stats' watermark once every
+-- selected day committed.
+
+-- Changed source rows are raw replays by ingested_at and skill snapshots by inserted_at, e.g. a
+-- backfill of old replays. Same watermark pattern as update_derived_replays_incremental.sql:
+-- derived rows of a replay only exist some time after it was ingested, so a day stays selected
+-- until it was rebuilt settle after its newest change, and the scan starts settle before the
+-- watermark. Source rows deleted or edited in place leave no trace here, those need rebuild.
+WITH bounds AS (
+    SELECT
+        %(timestamptz_from)s::date::timestamptz AS from_timestamptz,
+        (%(timestamptz_to)s::date + 1)::timestamptz AS to_timestamptz,
+        -- No watermark yet: every day of the window is unbuilt or predates this check anyway
+        COALESCE(
+            (SELECT last_loaded_at FROM analytics.snapshot_metadata WHERE key = 'player_daily_stats'),
+            now()
+        ) - %(settle)s::interval AS changed_since
+),
+changed AS (
+    SELECT r.start_time, r.ingested_at AS changed_at
+    FROM raw.replays r CROSS JOIN bounds b
+    WHERE r.ingested_at >= b.changed_since
+      AND r.start_time >= b.from_timestamptz AND r.start_time < b.to_timestamptz
+    UNION ALL
+    SELECT rc.start_time, rc.ingested_at
+    FROM raw.replays_cache rc CROSS JOIN bounds b
+    WHERE rc.ingested_at >= b.changed_since
+      AND rc.start_time >= b.from_timestamptz AND rc.start_time < b.to_timestamptz
+    UNION ALL
+    SELECT mss.start_time, mss.inserted_at
+    FROM analytics.match_skill_snapshots mss CROSS JOIN bounds b
+    WHERE mss.inserted_at >= b.changed_since
+      AND mss.start_time >= b.from_timestamptz AND mss.start_time < b.to_timestamptz
+),
+changed_days AS (
+    SELECT start_time::date AS day, MAX(changed_at) AS changed_at
+    FROM changed
+    GROUP BY 1
+)
+SELECT d::date AS day, now() AS checked_at
+FROM generate_series(
+    %(timestamptz_from)s::date::timestamp,
+    %(timestamptz_to)s::date::timestamp,
+    INTERVAL '1 day'
+) AS d
+LEFT JOIN analytics.player_daily_stats_days pdsd ON pdsd.day = d::date
+LEFT JOIN changed_days cd ON cd.day = d::date
+WHERE %(rebuild)s::boolean
+   OR pdsd.day IS NULL
+   OR pdsd.time_zone <> current_setting('TimeZone')
+   OR pdsd.refreshed_at < (d::date + 1)::timestamptz + %(settle)s::interval
+   OR pdsd.refreshed_at < cd.changed_at + %(settle)s::interval
+ORDER BY 1;
@@ -0,0 +1,5 @@
+-- One row: (partitioned). True once 005_partition_by_start_time.sql has been applied.
+SELECT EXISTS (
+    SELECT 1 FROM pg_partitioned_table
+    WHERE partrelid = to_regclass('raw.replays_cache')
+) AS partitioned;
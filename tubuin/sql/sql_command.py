@@ -1,8 +1,16 @@
 from abc import ABC, abstractmethod
-from typing import LiteralString
+from typing import LiteralString, Optional
 
 class SQLCommand(ABC):
     label: str
     query: str
     commit: bool = True
+    prepare: bool = True  # server-side prepared statement, utility statements can't be prepared
+    explain: bool = True  # EXPLAIN ANALYZE can be sampled, utility statements can't be explained
+    fetch: bool = False  # keep the result rows on command.rows after run
+    rowcount_from: Optional[str] = None  # result column holding the real row count, for CTE statements ending in a SELECT
     params: dict = {}
+    rows: Optional[list] = None
+
+    def __init__(self, params: Optional[dict] = None):
+        self.params = dict(params) if params else {}
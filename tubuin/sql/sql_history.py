@@ -0,0 +1,143 @@
+# tubuin\sql\sql_history.py
+# Append-only JSONL history of SQLRunner executions, one line per statement run, so step
+# timings can be compared across pipeline runs to find the one that regressed.
+
+import os
+import argparse
+import threading
+import statistics
+from collections import defaultdict
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import orjson
+
+# --- Configuration ---
+SQL_HISTORY_PATH = Path(os.getenv("SQL_HISTORY_PATH", "./sql_history.jsonl"))
+REGRESSION_RATIO = 1.5  # compare flags a step whose latest run is this much slower than its median
+
+
+@dataclass
+class SQLRunRecord:
+    run_id: str  # groups every statement executed by one process / pipeline run
+    label: str
+    started_at: str
+    elapsed_s: float
+    rowcount: int
+    ok: bool
+    params: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    plan_summary: Optional[Dict[str, Any]] = None  # only on sampled EXPLAIN runs
+    plan: Optional[Any] = None
+
+
+def summarize_plan(plan_json: Any) -> Dict[str, Any]:
+    """
+    Pulls the headline numbers out of EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) output.
+    Buffer counts on the top node already include every child node.
+    """
+    explained = plan_json[0] if isinstance(plan_json, list) else plan_json
+    top = explained.get("Plan", {})
+    return {
+        "planning_ms": explained.get("Planning Time"),
+        "execution_ms": explained.get("Execution Time"),
+        "top_node": top.get("Node Type"),
+        "shared_hit_blocks": top.get("Shared Hit Blocks"),
+        "shared_read_blocks": top.get("Shared Read Blocks"),
+        "shared_written_blocks": top.get("Shared Written Blocks"),
+        "temp_read_blocks": top.get("Temp Read Blocks"),
+        "temp_written_blocks": top.get("Temp Written Blocks"),
+    }
+
+
+class SQLHistory:
+    def __init__(self, path: Path = SQL_HISTORY_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def append(self, record: SQLRunRecord):
+        # datetimes/dates in params serialize natively, anything else falls back to str
+        line = orjson.dumps(asdict(record), default=str) + b"\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(line)
+
+    def read(self, label: Optional[str] = None) -> List[Dict[str, Any]]:
+        if not self.path.exists():
+            return []
+        records = []
+        with open(self.path, "rb") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue  # torn last line from a killed process
+                if label is None or record.get("label") == label:
+                    records.append(record)
+        return records
+
+
+def compare(records: List[Dict[str, Any]], baseline_runs: int = 5) -> List[str]:
+    """
+    Compares each label's most recent successful run against the median of its previous
+    baseline_runs runs. Returns report lines, slowest ratio first.
+    """
+    by_label: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for record in records:
+        if record.get("ok"):
+            by_label[record["label"]].append(record)
+
+    rows = []
+    for label, runs in by_label.items():
+        runs.sort(key=lambda r: r["started_at"])
+        latest, previous = runs[-1], runs[-1 - baseline_runs:-1]
+        if previous:
+            median_s = statistics.median(r["elapsed_s"] for r in previous)
+            median_rows = statistics.median(r["rowcount"] for r in previous)
+            ratio = latest["elapsed_s"] / median_s if median_s else float("inf")
+        else:
+            median_s = median_rows = ratio = None
+        rows.append((label, latest, median_s, median_rows, ratio))
+
+    rows.sort(key=lambda r: r[4] if r[4] is not None else 0.0, reverse=True)
+    lines = []
+    for label, latest, median_s, median_rows, ratio in rows:
+        line = f"{label} | latest: {latest['elapsed_s']:.3f}s rows: {latest['rowcount']}"
+        if ratio is not None:
+            flag = "  <-- REGRESSED" if ratio >= REGRESSION_RATIO else ""
+            line += f" | median: {median_s:.3f}s rows: {median_rows:.0f} | x{ratio:.2f}{flag}"
+        else:
+            line += " | no baseline yet"
+        summary = latest.get("plan_summary")
+        if summary:
+            line += (
+                f" | plan: exec {summary.get('execution_ms')}ms"
+                f" hit {summary.get('shared_hit_blocks')} read {summary.get('shared_read_blocks')}"
+                f" temp {summary.get('temp_written_blocks')}"
+            )
+        lines.append(line)
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare SQLRunner timings across runs.")
+    parser.add_argument("--path", type=Path, default=SQL_HISTORY_PATH, help="History JSONL file")
+    parser.add_argument("--label", help="Only show runs for this SQLCommand label")
+    parser.add_argument("--baseline", type=int, default=5, help="How many previous runs form the baseline")
+    parser.add_argument("--failures", action="store_true", help="List failed runs instead")
+    args = parser.parse_args()
+
+    history = SQLHistory(args.path)
+    records = history.read(args.label)
+    if args.failures:
+        for record in records:
+            if not record.get("ok"):
+                print(f"{record['started_at']} {record['label']} | {record['elapsed_s']:.3f}s | {record.get('error')}")
+    else:
+        for line in compare(records, args.baseline):
+            print(line)
@@ -1,21 +1,248 @@
-from sql_command import SQLCommand
-from config.db_conn import db_conn
+# tubuin\sql\sql_runner.py
+# Single execution path for SQLCommands: runs, commits, times and records every statement
+# to the SQL history, with EXPLAIN (ANALYZE, BUFFERS) captured on sampled runs.
+# AsyncSQLRunner runs independent commands concurrently on psycopg AsyncConnections.
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Iterable, List, Mapping, Optional
+
+from sql.sql_command import SQLCommand
+from sql.sql_history import SQLHistory, SQLRunRecord, summarize_plan
+from config.db_conn import db_conn, async_db_pool
+from sql.statement_registry import statements
+
+# --- Configuration ---
+# Fraction of runs that also capture EXPLAIN ANALYZE. The explained statement really executes and
+# is then rolled back, so a sampled run costs roughly twice as much.
+SQL_EXPLAIN_SAMPLE_RATE = float(os.getenv("SQL_EXPLAIN_SAMPLE_RATE", "0.0"))
+SQL_HISTORY_RUN_ID = os.getenv("SQL_HISTORY_RUN_ID") or uuid.uuid4().hex  # one id per process
+SQL_MAX_CONCURRENCY = int(os.getenv("SQL_MAX_CONCURRENCY", "4"))
+
+EXPLAIN_PREFIX = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
 
 
 class SQLRunner:
-    def __init__ (self, db_conn_factory = db_conn):
+    def __init__(
+        self,
+        db_conn_factory=db_conn,
+        history: Optional[SQLHistory] = None,
+        explain_sample_rate: float = SQL_EXPLAIN_SAMPLE_RATE,
+        logger=None,
+    ):
         self._conn_factory = db_conn_factory
-    
-    def run(self, command: SQLCommand):
-        with self._conn_factory() as conn:
-            with conn.cursor() as cur:
-                try:
-                    cur.execute(command.query, command.params)
+        self.history = history if history is not None else SQLHistory()
+        self.explain_sample_rate = explain_sample_rate
+        self.logger = logger or logging.getLogger(__name__)
+
+    def _should_explain(self, command: SQLCommand, explain: Optional[bool]) -> bool:
+        if not command.explain:
+            return False
+        if explain is not None:
+            return explain
+        return self.explain_sample_rate > 0 and random.random() < self.explain_sample_rate
+
+    def _new_record(self, command: SQLCommand, params) -> SQLRunRecord:
+        return SQLRunRecord(
+            run_id=SQL_HISTORY_RUN_ID,
+            label=command.label,
+            started_at=datetime.now(timezone.utc).isoformat(),
+            elapsed_s=0.0,
+            rowcount=-1,
+            ok=False,
+            params=dict(params) if isinstance(params, Mapping) else {},
+        )
+
+    def _finish(self, record: SQLRunRecord, elapsed_s: float):
+        record.elapsed_s = elapsed_s
+        try:
+            self.history.append(record)
+        except OSError as e:
+            self.logger.warning(f"[sql] could not write history to {self.history.path}: {e}")
+        status = "ok" if record.ok else "failed"
+        self.logger.info(
+            f"[sql] {record.label} | {status} | rows: {record.rowcount} | {record.elapsed_s:.3f}s"
+            + (f" | plan exec {record.plan_summary['execution_ms']}ms" if record.plan_summary else "")
+        )
+
+    def _explain(self, conn, cur, command: SQLCommand, params):
+        # EXPLAIN ANALYZE executes the statement, roll it back so the real run below sees the same data
+        try:
+            cur.execute(EXPLAIN_PREFIX + statements.query_for(command), params, prepare=False)
+            return cur.fetchone()[0]
+        finally:
+            conn.rollback()
+
+    def run(self, command: SQLCommand, params=None, explain: Optional[bool] = None) -> int:
+        """
+        Executes command (with params, or command.params) and returns its rowcount.
+        Every run is appended to the SQL history; errors are recorded and re-raised.
+        """
+        params = (command.params or None) if params is None else params
+        record = self._new_record(command, params)
+
+        started = time.perf_counter()
+        try:
+            with self._conn_factory() as conn:
+                with conn.cursor() as cur:
+                    if self._should_explain(command, explain):
+                        record.plan = self._explain(conn, cur, command, params)
+                        record.plan_summary = summarize_plan(record.plan)
+                        started = time.perf_counter()  # time the real run only
+
+                    statements.execute_command(cur, command, params)
+                    record.rowcount = _collect_result(cur, command, cur.fetchall)
                     if command.commit:
                         conn.commit()
-                        return cur.rowcount
+                    else:
+                        conn.rollback()
+            record.ok = True
+            return record.rowcount
+        except Exception as e:
+            record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self._finish(record, time.perf_counter() - started)
+
+
+class AsyncSQLRunner(SQLRunner):
+    """
+    SQLRunner on psycopg AsyncConnections. run_many() runs commands concurrently,
+    each on its own pooled connection, with at most max_concurrency statements in flight.
+    Commands run in separate transactions, so only group commands that don't depend on each
+    other's uncommitted writes.
+    """
+
+    def __init__(
+        self,
+        pool=None,
+        history: Optional[SQLHistory] = None,
+        explain_sample_rate: float = SQL_EXPLAIN_SAMPLE_RATE,
+        logger=None,
+        max_concurrency: int = SQL_MAX_CONCURRENCY,
+    ):
+        super().__init__(
+            db_conn_factory=None,
+            history=history,
+            explain_sample_rate=explain_sample_rate,
+            logger=logger,
+        )
+        self._pool = pool
+        self.max_concurrency = max_concurrency
+
+    @asynccontextmanager
+    async def _pool_scope(self):
+        # Borrow the caller's pool, or open one sized for this batch and close it afterwards
+        if self._pool is not None:
+            yield self._pool
+            return
+        async with async_db_pool(max_size=self.max_concurrency) as pool:
+            self._pool = pool
+            try:
+                yield pool
+            finally:
+                self._pool = None
+
+    async def _explain_async(self, conn, cur, command: SQLCommand, params):
+        try:
+            await cur.execute(EXPLAIN_PREFIX + statements.query_for(command), params, prepare=False)
+            return (await cur.fetchone())[0]
+        finally:
+            await conn.rollback()
+
+    async def run_async(self, command: SQLCommand, params=None, explain: Optional[bool] = None) -> int:
+        params = (command.params or None) if params is None else params
+        record = self._new_record(command, params)
+
+        started = time.perf_counter()
+        try:
+            async with self._pool_scope() as pool:
+                async with pool.connection() as conn:
+                    async with conn.cursor() as cur:
+                        if self._should_explain(command, explain):
+                            record.plan = await self._explain_async(conn, cur, command, params)
+                            record.plan_summary = summarize_plan(record.plan)
+                            started = time.perf_counter()
+
+                        await statements.execute_command_async(cur, command, params)
+                        rows = await cur.fetchall() if _wants_rows(command) else None
+                        record.rowcount = _collect_result(cur, command, lambda: rows)
+                        if command.commit:
+                            await conn.commit()
+                        else:
+                            await conn.rollback()
+            record.ok = True
+            return record.rowcount
+        except Exception as e:
+            record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self._finish(record, time.perf_counter() - started)
+
+    async def run_many(
+        self,
+        commands: Iterable[SQLCommand],
+        max_concurrency: Optional[int] = None,
+        retries: int = 0,
+        retry_delay_s: float = 10.0,
+    ) -> List[int]:
+        """
+        Runs independent commands concurrently and returns their rowcounts in order.
+        Each command commits on its own and is retried on its own up to retries times.
+        Every command runs to completion; the first error is raised afterwards.
+        """
+        commands = list(commands)
+        limit = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+
+        async def _run(command: SQLCommand) -> int:
+            for attempt in range(retries + 1):
+                try:
+                    async with limit:
+                        return await self.run_async(command)
                 except Exception as e:
-                    conn.rollback()
-                    conn.close()
-                    return 0
-        return 0
\ No newline at end of file
+                    if attempt == retries:
+                        raise
+                    self.logger.warning(
+                        f"[sql] {command.label} failed ({e}), retry {attempt + 1}/{retries} in {retry_delay_s:.0f}s"
+                    )
+                    await asyncio.sleep(retry_delay_s)
+
+        async with self._pool_scope():
+            results = await asyncio.gather(*(_run(c) for c in commands), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+
+def _wants_rows(command: SQLCommand) -> bool:
+    return command.fetch or command.rowcount_from is not None
+
+
+def _collect_result(cur, command: SQLCommand, fetchall) -> int:
+    """
+    Stores the result rows on command.rows when asked to and returns the rowcount to record.
+    """
+    if not _wants_rows(command):
+        return cur.rowcount
+    command.rows = fetchall()
+    if command.rowcount_from is None:
+        return cur.rowcount
+    column = [d.name for d in cur.description].index(command.rowcount_from)
+    return sum(row[column] or 0 for row in command.rows)
+
+
+def run_async(coro):
+    """
+    asyncio.run() for the async runner. psycopg's async connections need a selector event
+    loop, which is not the default on Windows.
+    """
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    return asyncio.run(coro)
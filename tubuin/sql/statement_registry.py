@@ -0,0 +1,129 @@
+# tubuin\sql\statement_registry.py
+# Composes each statement once per process and executes it as a server-side prepared
+# statement, keeping per-statement timing counters.
+import time
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Union
+
+from psycopg import sql
+from sql.sql_command import SQLCommand
+
+Query = Union[str, sql.Composable]
+
+
+@dataclass
+class StatementStats:
+    calls: int = 0
+    rows: int = 0
+    total_s: float = 0.0
+    max_s: float = 0.0
+
+    @property
+    def avg_s(self) -> float:
+        return self.total_s / self.calls if self.calls else 0.0
+
+
+class StatementRegistry:
+    def __init__(self):
+        self._builders: Dict[str, Callable[[], Query]] = {}
+        self._statements: Dict[str, str] = {}
+        self._stats: Dict[str, StatementStats] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, builder: Callable[[], Query]):
+        """
+        Registers a builder for name. It is called once, on first use.
+        """
+        with self._lock:
+            self._builders[name] = builder
+            self._statements.pop(name, None)
+
+    def get(self, name: str) -> str:
+        statement = self._statements.get(name)
+        if statement is None:
+            with self._lock:
+                query = self._builders[name]()
+                # Render Composed objects once, psycopg would otherwise re-render them per execute
+                statement = query if isinstance(query, str) else query.as_string(None)
+                self._statements[name] = statement
+        return statement
+
+    def execute(self, cursor, name: str, params=None, prepare: Optional[bool] = True):
+        """
+        Executes a registered statement. prepare=True makes psycopg prepare it server-side on
+        first use per connection, so pooled connections only parse and plan it once.
+        """
+        query = self.get(name)
+        started = time.perf_counter()
+        try:
+            cursor.execute(query, params, prepare=prepare)
+        finally:
+            self._record(name, time.perf_counter() - started, cursor.rowcount)
+        return cursor
+
+    async def execute_async(self, cursor, name: str, params=None, prepare: Optional[bool] = True):
+        """
+        execute() for psycopg AsyncCursors.
+        """
+        query = self.get(name)
+        started = time.perf_counter()
+        try:
+            await cursor.execute(query, params, prepare=prepare)
+        finally:
+            self._record(name, time.perf_counter() - started, cursor.rowcount)
+        return cursor
+
+    def query_for(self, command: SQLCommand) -> str:
+        """
+        Registers command under its label on first use and returns the rendered statement.
+        """
+        if command.label not in self._builders:
+            query = command.query
+            self.register(command.label, lambda: query)
+        return self.get(command.label)
+
+    def execute_command(self, cursor, command: SQLCommand, params=None):
+        self.query_for(command)
+        return self.execute(
+            cursor,
+            command.label,
+            (command.params or None) if params is None else params,
+            prepare=command.prepare,
+        )
+
+    async def execute_command_async(self, cursor, command: SQLCommand, params=None):
+        self.query_for(command)
+        return await self.execute_async(
+            cursor,
+            command.label,
+            (command.params or None) if params is None else params,
+            prepare=command.prepare,
+        )
+
+    def _record(self, name: str, elapsed: float, rowcount: int):
+        with self._lock:
+            stats = self._stats.setdefault(name, StatementStats())
+            stats.calls += 1
+            stats.rows += max(rowcount, 0)
+            stats.total_s += elapsed
+            stats.max_s = max(stats.max_s, elapsed)
+
+    def stats(self) -> Dict[str, StatementStats]:
+        with self._lock:
+            return {name: StatementStats(**vars(s)) for name, s in self._stats.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    def summary_lines(self) -> List[str]:
+        return [
+            f"[sql] {name} | calls: {s.calls} rows: {s.rows} | "
+            f"total: {s.total_s:.3f}s avg: {s.avg_s * 1000:.2f}ms max: {s.max_s * 1000:.2f}ms"
+            for name, s in sorted(self.stats().items(), key=lambda kv: kv[1].total_s, reverse=True)
+        ]
+
+
+# Process-wide registry
+statements = StatementRegistry()
@@ -43,7 +43,7 @@ candidate_set AS (
         mp.skill,
         r.start_time
     FROM derived.match_players_unlogged mp
-    JOIN candidate_replays r USING (replay_id)
+    JOIN candidate_replays r USING (replay_id, start_time)
     WHERE mp.user_id IS NOT NULL
 ),
 -- Step 6: Insert the data.
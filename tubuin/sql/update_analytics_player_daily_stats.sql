@@ -0,0 +1,175 @@
+-- update_analytics_player_daily_stats.sql
+-- Rebuilds one day (%(day)s, a session time zone day) of analytics.player_daily_stats and
+-- analytics.player_daily_skill from that day's matches and skill snapshots, and records it in
+-- analytics.player_daily_stats_days. Each column is the day's share of a player page component
+-- of update_analytics_player_page_json.sql, in a form update_analytics_player_page_json_from_daily.sql
+-- can merge across days: counts that add up, maxima, and the day's newest MATCH_HISTORY matches.
+-- Closed days are built once they settled; only the recent ones are rebuilt every run.
+WITH day_bounds AS (
+    SELECT
+        %(day)s::date AS day,
+        (%(day)s::date)::TIMESTAMPTZ AS from_timestamptz,
+        (%(day)s::date + 1)::TIMESTAMPTZ AS to_timestamptz
+),
+constants AS ( -- Same as the page statement
+    SELECT
+        28.0::REAL AS hard_game_os_threshold,
+        ARRAY(SELECT generate_series(0, 58, 2)) AS lobby_os_bins,
+        10 AS match_history_length
+),
+day_matches AS ( -- category NULL included, those matches still make a player active
+    SELECT
+        mpu.user_id, mpu.replay_id, mpu.name AS username_in_match,
+        mpu.skill AS player_skill_in_match, mpu.won, mpu.faction,
+        r.start_time, r.category, r.map_name, r.ranked, r.avg_lobby_skill
+    FROM derived.match_players_unlogged mpu
+    JOIN derived.replays r ON mpu.replay_id = r.replay_id AND mpu.start_time = r.start_time
+    CROSS JOIN day_bounds db
+    WHERE mpu.user_id IS NOT NULL
+      AND r.start_time >= db.from_timestamptz
+      AND r.start_time < db.to_timestamptz
+      AND mpu.start_time >= db.from_timestamptz
+      AND mpu.start_time < db.to_timestamptz
+),
+-- Components for: skillPerMode, winLossSummary, activityData
+day_counts AS (
+    SELECT
+        dm.user_id,
+        dm.category,
+        MAX(dm.start_time) AS last_start_time,
+        COUNT(*) AS games,
+        COUNT(*) FILTER (WHERE dm.won) AS wins,
+        COUNT(*) FILTER (WHERE NOT dm.won) AS losses,
+        COUNT(*) FILTER (WHERE dm.avg_lobby_skill >= c.hard_game_os_threshold) AS ga,
+        COUNT(*) FILTER (WHERE dm.avg_lobby_skill >= c.hard_game_os_threshold AND dm.won) AS wa,
+        COUNT(*) FILTER (WHERE dm.avg_lobby_skill < c.hard_game_os_threshold) AS gb,
+        COUNT(*) FILTER (WHERE dm.avg_lobby_skill < c.hard_game_os_threshold AND dm.won) AS wb,
+        -- AVG(real) accumulates in double precision, so does the merged SUM / COUNT
+        SUM(dm.player_skill_in_match::DOUBLE PRECISION) AS skill_sum,
+        COUNT(dm.player_skill_in_match) AS skill_count
+    FROM day_matches dm
+    CROSS JOIN constants c
+    GROUP BY dm.user_id, dm.category
+),
+-- Component for: lobbyData
+day_lobby_binned AS (
+    SELECT dm.user_id, dm.category,
+           width_bucket(dm.avg_lobby_skill, c.lobby_os_bins) -1 AS bin_index,
+           COUNT(dm.replay_id) AS game_count
+    FROM day_matches dm CROSS JOIN constants c
+    WHERE dm.category IS NOT NULL AND dm.avg_lobby_skill IS NOT NULL
+    GROUP BY dm.user_id, dm.category, bin_index
+),
+day_lobby AS (
+    SELECT
+        user_cats.user_id, user_cats.category,
+        array_agg(COALESCE(dlb.game_count, 0)::int ORDER BY all_bins.bin_idx) AS lobby_bins
+    FROM (SELECT DISTINCT user_id, category FROM day_lobby_binned) user_cats
+    CROSS JOIN generate_series(0, array_length((SELECT lobby_os_bins FROM constants), 1) -1 ) all_bins(bin_idx)
+    LEFT JOIN day_lobby_binned dlb
+      ON user_cats.user_id = dlb.user_id AND user_cats.category = dlb.category AND all_bins.bin_idx = dlb.bin_index
+    GROUP BY user_cats.user_id, user_cats.category
+),
+-- Component for: factionData
+day_factions AS (
+    SELECT f.user_id, f.category, jsonb_object_agg(f.faction, jsonb_build_array(f.wins, f.losses)) AS factions
+    FROM (
+        SELECT dm.user_id, dm.category, dm.faction,
+               COUNT(*) FILTER (WHERE dm.won) AS wins, COUNT(*) FILTER (WHERE NOT dm.won) AS losses
+        FROM day_matches dm
+        WHERE dm.category IS NOT NULL AND dm.faction IS NOT NULL
+        GROUP BY dm.user_id, dm.category, dm.faction
+    ) f
+    GROUP BY f.user_id, f.category
+),
+-- Component for: usernames
+day_usernames AS (
+    SELECT n.user_id, n.category, jsonb_object_agg(n.name, n.last_seen) AS usernames
+    FROM (
+        SELECT dm.user_id, dm.category, dm.username_in_match AS name,
+               (extract(epoch FROM MAX(dm.start_time)) * 1000000)::BIGINT AS last_seen
+        FROM day_matches dm
+        WHERE dm.category IS NOT NULL AND dm.username_in_match IS NOT NULL
+        GROUP BY dm.user_id, dm.category, dm.username_in_match
+    ) n
+    GROUP BY n.user_id, n.category
+),
+-- Component for: matchHistory, no day can contribute more than the page keeps
+day_recent_matches AS (
+    SELECT m.user_id, m.category,
+           jsonb_agg(jsonb_build_object(
+               't', (extract(epoch FROM m.start_time) * 1000000)::BIGINT,
+               'date', to_char(m.start_time, 'DD Mon YYYY'), 'mode', m.category, 'map', m.map_name,
+               'result', CASE WHEN m.won THEN 'Win' ELSE 'Loss' END, 'faction', m.faction,
+               'ranked', m.ranked, 'username', m.username_in_match
+           ) ORDER BY m.rn) AS recent_matches
+    FROM (
+        SELECT dm.*, ROW_NUMBER() OVER (PARTITION BY dm.user_id, dm.category ORDER BY dm.start_time DESC) AS rn
+        FROM day_matches dm
+        WHERE dm.category IS NOT NULL
+    ) m
+    WHERE m.rn <= (SELECT match_history_length FROM constants)
+    GROUP BY m.user_id, m.category
+),
+-- Rows of the day are replaced as a whole. Both modifying CTEs see the table as it was before
+-- the statement, so the DELETE never removes the rows inserted here.
+deleted AS (
+    DELETE FROM analytics.player_daily_stats
+    WHERE day = (SELECT day FROM day_bounds)
+    RETURNING 1
+),
+inserted AS (
+    INSERT INTO analytics.player_daily_stats (
+        day, user_id, category, last_start_time, games, wins, losses, ga, wa, gb, wb,
+        skill_sum, skill_count, lobby_bins, factions, usernames, recent_matches
+    )
+    SELECT
+        db.day, dc.user_id, dc.category, dc.last_start_time, dc.games,
+        -- category NULL rows only record that the player was active
+        CASE WHEN dc.category IS NOT NULL THEN dc.wins END,
+        CASE WHEN dc.category IS NOT NULL THEN dc.losses END,
+        CASE WHEN dc.category IS NOT NULL THEN dc.ga END,
+        CASE WHEN dc.category IS NOT NULL THEN dc.wa END,
+        CASE WHEN dc.category IS NOT NULL THEN dc.gb END,
+        CASE WHEN dc.category IS NOT NULL THEN dc.wb END,
+        CASE WHEN dc.category IS NOT NULL THEN dc.skill_sum END,
+        CASE WHEN dc.category IS NOT NULL THEN dc.skill_count END,
+        dl.lobby_bins, df.factions, du.usernames, drm.recent_matches
+    FROM day_counts dc
+    CROSS JOIN day_bounds db
+    LEFT JOIN day_lobby dl ON dc.user_id = dl.user_id AND dc.category = dl.category
+    LEFT JOIN day_factions df ON dc.user_id = df.user_id AND dc.category = df.category
+    LEFT JOIN day_usernames du ON dc.user_id = du.user_id AND dc.category = du.category
+    LEFT JOIN day_recent_matches drm ON dc.user_id = drm.user_id AND dc.category = drm.category
+    RETURNING 1
+),
+-- Component for: skillHistoryRaw
+skill_deleted AS (
+    DELETE FROM analytics.player_daily_skill
+    WHERE day = (SELECT day FROM day_bounds)
+    RETURNING 1
+),
+skill_inserted AS (
+    INSERT INTO analytics.player_daily_skill (day, user_id, category, avg_skill)
+    SELECT db.day, mss.user_id, mss.category, ROUND(AVG(mss.skill)::numeric, 1)
+    FROM analytics.match_skill_snapshots mss
+    CROSS JOIN day_bounds db
+    WHERE mss.start_time >= db.from_timestamptz
+      AND mss.start_time < db.to_timestamptz
+    GROUP BY db.day, mss.user_id, mss.category
+    RETURNING 1
+),
+refreshed AS (
+    -- now() is the transaction start, a replay committed during the statement is picked up next run
+    INSERT INTO analytics.player_daily_stats_days (day, refreshed_at, time_zone)
+    SELECT day, now(), current_setting('TimeZone') FROM day_bounds
+    ON CONFLICT (day) DO UPDATE SET
+        refreshed_at = EXCLUDED.refreshed_at,
+        time_zone = EXCLUDED.time_zone
+    RETURNING 1
+)
+SELECT
+    (SELECT count(*) FROM inserted) AS inserted,
+    (SELECT count(*) FROM deleted) AS deleted,
+    (SELECT count(*) FROM skill_inserted) AS skill_rows,
+    (SELECT count(*) FROM refreshed) AS days;
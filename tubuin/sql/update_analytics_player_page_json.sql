@@ -25,6 +25,14 @@
 -- 2.  For those few players, it will then look back **6 months** into our pre-calculated `analytics` tables to get their full skill history and other long-term stats.
 
 -- This makes our daily job very fast and light, while still providing the rich, historical data we need for the player pages. The next step is to break our big SQL script into these smaller, independent "helper" scripts and have Prefect run them.
+-- Helper 1 is the active_since parameter below: populate_analytics_player_json_task passes the 'player_page_json' watermark
+-- (minus a lookback) hourly, and NULL for the full rebuild whenever the 24 week window moves.
+-- The task runs the statement once per user_id hash shard (shard / num_shards), concurrently, and
+-- advances the watermark itself once every shard committed. Pass shard 0 of 1 to run it whole.
+-- Named windows (logic/player_windows.py): timestamptz_from is the widest window's start and the
+-- only range scanned; window_keys / window_froms name every window (7d, 30d, 24w, ...) inside it.
+-- Each matched row joins the windows it falls in, every component groups by window_key as well,
+-- and one page per (window_key, user_id) is written. More windows add aggregation, not scans.
 -- #############################################################################
 -- # 4.1 - SET-BASED SQL with DENSE SKILL HISTORY
 -- # Aims for closer parity with Python script's skillHistory output.
@@ -36,7 +44,14 @@ WITH processing_params AS (
         -- DATE '2025-01-01' AS from_date, -- Front end view is coupled to this range, 6 months here = 6 months front end view
         -- DATE '2025-05-31' AS to_date
         %(timestamptz_from)s::timestamptz AS from_date,
-        %(timestamptz_to)s::timestamptz AS to_date
+        %(timestamptz_to)s::timestamptz AS to_date,
+        -- Delta mode: only users with a match since this time get their page rebuilt (still from
+        -- the whole window). NULL rebuilds every user active in the window.
+        COALESCE(%(active_since)s::timestamptz, '-infinity'::timestamptz) AS active_since
+),
+windows AS (
+    SELECT w.window_key, w.from_date, (w.from_date)::TIMESTAMPTZ AS from_timestamptz
+    FROM unnest(%(window_keys)s::text[], %(window_froms)s::timestamptz[]) AS w(window_key, from_date)
 ),
 date_boundaries AS (
     SELECT
@@ -51,13 +66,20 @@ constants AS (
         10.0::REAL AS k_factor,
         0.3::REAL AS min_hard_game_pct, ARRAY(SELECT generate_series(0, 58, 2)) AS lobby_os_bins
 ),
-active_users AS (
-    SELECT DISTINCT mpu.user_id
+active_users AS ( -- (window_key, user_id): a match in that window, since active_since
+    SELECT DISTINCT w.window_key, mpu.user_id
     FROM derived.match_players_unlogged mpu
-    JOIN derived.replays r ON mpu.replay_id = r.replay_id
+    JOIN derived.replays r ON mpu.replay_id = r.replay_id AND mpu.start_time = r.start_time
     CROSS JOIN date_boundaries db
+    JOIN windows w ON r.start_time >= GREATEST(w.from_timestamptz, (SELECT active_since FROM processing_params))
     WHERE mpu.user_id IS NOT NULL
-      AND r.start_time >= db.from_timestamptz AND r.start_time < db.to_timestamptz
+      AND r.start_time >= GREATEST(db.from_timestamptz, (SELECT active_since FROM processing_params))
+      AND r.start_time < db.to_timestamptz
+      AND mpu.start_time >= GREATEST(db.from_timestamptz, (SELECT active_since FROM processing_params))
+      AND mpu.start_time < db.to_timestamptz
+      -- Hash shard of user_id, so the task can run num_shards of these statements in parallel.
+      -- hashint4 is signed, shift it to 0..2^32-1 before taking the remainder.
+      AND mod(hashint4(mpu.user_id)::bigint + 2147483648, %(num_shards)s::bigint) = %(shard)s::bigint
 ),
 all_relevant_matches AS (
     SELECT
@@ -65,14 +87,23 @@ all_relevant_matches AS (
         mpu.skill AS player_skill_in_match, mpu.won, mpu.faction,
         r.start_time, r.category, r.map_name, r.ranked, r.avg_lobby_skill
     FROM derived.match_players_unlogged mpu
-    JOIN derived.replays r ON mpu.replay_id = r.replay_id
+    JOIN derived.replays r ON mpu.replay_id = r.replay_id AND mpu.start_time = r.start_time
     WHERE mpu.user_id IN (SELECT user_id FROM active_users)
       AND r.start_time >= (SELECT from_timestamptz FROM date_boundaries)
       AND r.start_time < (SELECT to_timestamptz FROM date_boundaries)
+      AND mpu.start_time >= (SELECT from_timestamptz FROM date_boundaries)
+      AND mpu.start_time < (SELECT to_timestamptz FROM date_boundaries)
       AND r.category IS NOT NULL
 ),
+-- The one scan above, fanned out to the windows each row falls in
+window_matches AS (
+    SELECT au.window_key, arm.*
+    FROM all_relevant_matches arm
+    JOIN windows w ON arm.start_time >= w.from_timestamptz
+    JOIN active_users au ON au.window_key = w.window_key AND au.user_id = arm.user_id
+),
 --  Component for: OS, gets final os per mode
---      now uses (and relies on derived.match_skill_deltas, a materialized view)
+--      now uses (and relies on derived.match_skill_deltas, an incrementally maintained table)
 -- latest_skill_from_deltas AS (
 --     SELECT DISTINCT ON (user_id, category)
 --         user_id, category, latest_skill AS skill_from_deltas_table
@@ -109,6 +140,7 @@ final_skill_per_mode AS (
 -- Component for: skillPerMode
 users_skill_per_mode_components AS (
     SELECT
+        arm.window_key,
         arm.user_id,
         arm.category,
         -- Aggregation remains the same
@@ -118,12 +150,13 @@ users_skill_per_mode_components AS (
         COUNT(*) FILTER (WHERE arm.avg_lobby_skill < c.hard_game_os_threshold) AS gb,
         COUNT(*) FILTER (WHERE arm.avg_lobby_skill < c.hard_game_os_threshold AND arm.won) AS wb_count,
         COUNT(*) AS total_games_in_mode
-    FROM all_relevant_matches arm
+    FROM window_matches arm
     CROSS JOIN constants c
-    GROUP BY arm.user_id, arm.category
+    GROUP BY arm.window_key, arm.user_id, arm.category
 ),
 users_skill_per_mode_with_as AS (
     SELECT
+        s.window_key,
         s.user_id,
         s.category,
         -- Get the final skill from our new CTE, with a final fallback to 0.0
@@ -143,102 +176,103 @@ users_skill_per_mode_with_as AS (
     CROSS JOIN constants c
 ),
 users_skill_per_mode_json AS (
-    SELECT user_id, jsonb_object_agg(category, jsonb_build_object('mode', category, 'os', ROUND(current_os::numeric, 1), 'as', ROUND(adjusted_os::numeric, 2), 'ga', ga, 'wa', wa_rate, 'gb', gb, 'wb', wb_rate, 'lastPlayed', to_char(last_played_timestamp_in_period, 'YYYY-MM-DD'))) AS data
-    FROM users_skill_per_mode_with_as GROUP BY user_id
+    SELECT window_key, user_id, jsonb_object_agg(category, jsonb_build_object('mode', category, 'os', ROUND(current_os::numeric, 1), 'as', ROUND(adjusted_os::numeric, 2), 'ga', ga, 'wa', wa_rate, 'gb', gb, 'wb', wb_rate, 'lastPlayed', to_char(last_played_timestamp_in_period, 'YYYY-MM-DD'))) AS data
+    FROM users_skill_per_mode_with_as GROUP BY window_key, user_id
 ),
 -- Component for: winLossSummary (perMode and total)
 users_win_loss_summary_components AS (
-    SELECT arm.user_id, arm.category, COUNT(*) FILTER (WHERE arm.won) AS wins, COUNT(*) FILTER (WHERE NOT arm.won) AS losses
-    FROM all_relevant_matches arm GROUP BY arm.user_id, arm.category
+    SELECT arm.window_key, arm.user_id, arm.category, COUNT(*) FILTER (WHERE arm.won) AS wins, COUNT(*) FILTER (WHERE NOT arm.won) AS losses
+    FROM window_matches arm GROUP BY arm.window_key, arm.user_id, arm.category
 ),
 users_win_loss_summary_json AS (
-    SELECT user_id,
+    SELECT window_key, user_id,
            jsonb_build_object(
                'total', jsonb_build_object('wins', SUM(wins), 'losses', SUM(losses), 'games', SUM(wins+losses), 'winRate', CASE WHEN SUM(wins+losses) > 0 THEN ROUND((SUM(wins)::DECIMAL*100 / SUM(wins+losses)),1) ELSE 0 END),
                'perMode', jsonb_object_agg(category, jsonb_build_object('mode', category, 'wins', wins, 'losses', losses, 'rate', CASE WHEN wins+losses > 0 THEN ROUND((wins::DECIMAL*100 / (wins+losses)),1) ELSE 0 END) ORDER BY category)
            ) AS data
-    FROM users_win_loss_summary_components GROUP BY user_id
+    FROM users_win_loss_summary_components GROUP BY window_key, user_id
 ),
 -- Component for: matchHistory
 users_match_history_ranked AS (
-    SELECT arm.user_id,
+    SELECT arm.window_key, arm.user_id,
            to_char(arm.start_time, 'DD Mon YYYY') AS date_str, arm.category AS mode, arm.map_name AS map,
            CASE WHEN arm.won THEN 'Win' ELSE 'Loss' END AS result, arm.faction, arm.ranked, arm.username_in_match AS username,
-           ROW_NUMBER() OVER (PARTITION BY arm.user_id ORDER BY arm.start_time DESC) as rn
-    FROM all_relevant_matches arm
+           ROW_NUMBER() OVER (PARTITION BY arm.window_key, arm.user_id ORDER BY arm.start_time DESC) as rn
+    FROM window_matches arm
 ),
 users_match_history_json AS (
-    SELECT user_id, jsonb_agg(jsonb_build_object('date', date_str, 'mode', mode, 'map', map, 'result', result, 'faction', faction, 'ranked', ranked, 'username', username) ORDER BY rn ASC) AS data
-    FROM users_match_history_ranked WHERE rn <= 10 GROUP BY user_id
+    SELECT window_key, user_id, jsonb_agg(jsonb_build_object('date', date_str, 'mode', mode, 'map', map, 'result', result, 'faction', faction, 'ranked', ranked, 'username', username) ORDER BY rn ASC) AS data
+    FROM users_match_history_ranked WHERE rn <= 10 GROUP BY window_key, user_id
 ),
 -- Component for: usernames
 users_usernames_agg AS (
-    SELECT arm.user_id, arm.username_in_match AS name, MAX(arm.start_time) AS last_seen_timestamp
-    FROM all_relevant_matches arm WHERE arm.username_in_match IS NOT NULL GROUP BY arm.user_id, arm.username_in_match
+    SELECT arm.window_key, arm.user_id, arm.username_in_match AS name, MAX(arm.start_time) AS last_seen_timestamp
+    FROM window_matches arm WHERE arm.username_in_match IS NOT NULL GROUP BY arm.window_key, arm.user_id, arm.username_in_match
 ),
 users_usernames_json AS (
-    SELECT user_id, jsonb_agg(jsonb_build_object('name', name, 'lastSeen', to_char(last_seen_timestamp, 'YYYY-MM-DD')) ORDER BY last_seen_timestamp DESC) AS data
-    FROM users_usernames_agg GROUP BY user_id
+    SELECT window_key, user_id, jsonb_agg(jsonb_build_object('name', name, 'lastSeen', to_char(last_seen_timestamp, 'YYYY-MM-DD')) ORDER BY last_seen_timestamp DESC) AS data
+    FROM users_usernames_agg GROUP BY window_key, user_id
 ),
 -- Component for: activityData
 users_activity_data_daily_agg AS (
-    SELECT arm.user_id, date_trunc('day', arm.start_time) AS activity_date, COUNT(*) AS games, AVG(arm.player_skill_in_match) AS avg_skill
-    FROM all_relevant_matches arm GROUP BY arm.user_id, date_trunc('day', arm.start_time)
+    SELECT arm.window_key, arm.user_id, date_trunc('day', arm.start_time) AS activity_date, COUNT(*) AS games, AVG(arm.player_skill_in_match) AS avg_skill
+    FROM window_matches arm GROUP BY arm.window_key, arm.user_id, date_trunc('day', arm.start_time)
 ),
 users_activity_data_json_intermediate AS (
-    SELECT user_id, activity_date, games, avg_skill,
-           ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY activity_date DESC) as rn
+    SELECT window_key, user_id, activity_date, games, avg_skill,
+           ROW_NUMBER() OVER (PARTITION BY window_key, user_id ORDER BY activity_date DESC) as rn
     FROM users_activity_data_daily_agg
 ),
 users_activity_data_json AS (
-    SELECT user_id, jsonb_object_agg(to_char(activity_date, 'YYYY-MM-DD'), jsonb_build_object('games', games, 'avgSkill', ROUND(avg_skill::numeric,1)) ORDER BY activity_date DESC) AS data
+    SELECT window_key, user_id, jsonb_object_agg(to_char(activity_date, 'YYYY-MM-DD'), jsonb_build_object('games', games, 'avgSkill', ROUND(avg_skill::numeric,1)) ORDER BY activity_date DESC) AS data
     FROM users_activity_data_json_intermediate
-    WHERE rn <= 84 GROUP BY user_id
+    WHERE rn <= 84 GROUP BY window_key, user_id
 ),
 -- Component for: lobbyData
 users_lobby_data_binned AS (
-    SELECT arm.user_id, arm.category,
+    SELECT arm.window_key, arm.user_id, arm.category,
            width_bucket(arm.avg_lobby_skill, c.lobby_os_bins) -1  as bin_index,
            COUNT(arm.replay_id) as game_count
-    FROM all_relevant_matches arm CROSS JOIN constants c
-    WHERE arm.avg_lobby_skill IS NOT NULL GROUP BY arm.user_id, arm.category, bin_index
+    FROM window_matches arm CROSS JOIN constants c
+    WHERE arm.avg_lobby_skill IS NOT NULL GROUP BY arm.window_key, arm.user_id, arm.category, bin_index
     
     UNION ALL -- Add this block
 
-    SELECT arm.user_id, 'All' AS category, -- Hardcode the 'All' category
+    SELECT arm.window_key, arm.user_id, 'All' AS category, -- Hardcode the 'All' category
            width_bucket(arm.avg_lobby_skill, c.lobby_os_bins) -1  as bin_index,
            COUNT(arm.replay_id) as game_count
-    FROM all_relevant_matches arm CROSS JOIN constants c
-    WHERE arm.avg_lobby_skill IS NOT NULL GROUP BY arm.user_id, bin_index -- Group without category
+    FROM window_matches arm CROSS JOIN constants c
+    WHERE arm.avg_lobby_skill IS NOT NULL GROUP BY arm.window_key, arm.user_id, bin_index -- Group without category
 ),
 users_lobby_data_inner_json AS ( -- Step 1 for lobbyData: aggregate counts per user/category
     SELECT
-        all_user_cats.user_id, all_user_cats.category,
+        all_user_cats.window_key, all_user_cats.user_id, all_user_cats.category,
         COALESCE(jsonb_agg(COALESCE(game_count, 0) ORDER BY bin_idx), '[]'::jsonb) as counts_json_array
-    FROM (SELECT DISTINCT user_id, category FROM users_lobby_data_binned) all_user_cats
+    FROM (SELECT DISTINCT window_key, user_id, category FROM users_lobby_data_binned) all_user_cats
     CROSS JOIN generate_series(0, array_length((SELECT lobby_os_bins FROM constants), 1) -1 ) all_bins(bin_idx)
     CROSS JOIN constants c
     LEFT JOIN users_lobby_data_binned uldb
-      ON all_user_cats.user_id = uldb.user_id AND all_user_cats.category = uldb.category AND all_bins.bin_idx = uldb.bin_index
-    GROUP BY all_user_cats.user_id, all_user_cats.category
+      ON all_user_cats.window_key = uldb.window_key AND all_user_cats.user_id = uldb.user_id
+     AND all_user_cats.category = uldb.category AND all_bins.bin_idx = uldb.bin_index
+    GROUP BY all_user_cats.window_key, all_user_cats.user_id, all_user_cats.category
 ),
 users_lobby_data_json AS ( -- Step 2 for lobbyData: aggregate category JSONs per user
-    SELECT user_id, jsonb_object_agg(category, counts_json_array ORDER BY CASE WHEN category = 'All' THEN 0 ELSE 1 END, category) AS data
-    FROM users_lobby_data_inner_json GROUP BY user_id
+    SELECT window_key, user_id, jsonb_object_agg(category, counts_json_array ORDER BY CASE WHEN category = 'All' THEN 0 ELSE 1 END, category) AS data
+    FROM users_lobby_data_inner_json GROUP BY window_key, user_id
 ),
 -- Component for: factionData (Applying Refinement 2)
 users_faction_data_agg AS (
-    SELECT arm.user_id, arm.category, arm.faction, COUNT(*) FILTER (WHERE arm.won) AS wins, COUNT(*) FILTER (WHERE NOT arm.won) AS losses
-    FROM all_relevant_matches arm WHERE arm.faction IS NOT NULL GROUP BY arm.user_id, arm.category, arm.faction
+    SELECT arm.window_key, arm.user_id, arm.category, arm.faction, COUNT(*) FILTER (WHERE arm.won) AS wins, COUNT(*) FILTER (WHERE NOT arm.won) AS losses
+    FROM window_matches arm WHERE arm.faction IS NOT NULL GROUP BY arm.window_key, arm.user_id, arm.category, arm.faction
 
     UNION ALL -- Add this block
 
-    SELECT arm.user_id, 'All' AS category, arm.faction, COUNT(*) FILTER (WHERE arm.won) AS wins, COUNT(*) FILTER (WHERE NOT arm.won) AS losses
-    FROM all_relevant_matches arm WHERE arm.faction IS NOT NULL GROUP BY arm.user_id, arm.faction -- Group without category
+    SELECT arm.window_key, arm.user_id, 'All' AS category, arm.faction, COUNT(*) FILTER (WHERE arm.won) AS wins, COUNT(*) FILTER (WHERE NOT arm.won) AS losses
+    FROM window_matches arm WHERE arm.faction IS NOT NULL GROUP BY arm.window_key, arm.user_id, arm.faction -- Group without category
 ),
 users_faction_data_inner_json AS ( -- Step 1 for factionData: build JSON for each category within each user
     SELECT
-        user_id, category,
+        window_key, user_id, category,
         jsonb_build_object(
             'labels',   COALESCE(jsonb_agg(DISTINCT faction ORDER BY faction), '[]'::jsonb),
             'datasets', jsonb_build_array(
@@ -247,89 +281,50 @@ users_faction_data_inner_json AS ( -- Step 1 for factionData: build JSON for eac
                         )
         ) as category_faction_data_json
     FROM users_faction_data_agg
-    GROUP BY user_id, category
+    GROUP BY window_key, user_id, category
 ),
 users_faction_data_json AS ( -- Step 2 for factionData: aggregate category JSONs per user
-    SELECT user_id, jsonb_object_agg(category, category_faction_data_json ORDER BY CASE WHEN category = 'All' THEN 0 ELSE 1 END, category) AS data
+    SELECT window_key, user_id, jsonb_object_agg(category, category_faction_data_json ORDER BY CASE WHEN category = 'All' THEN 0 ELSE 1 END, category) AS data
     FROM users_faction_data_inner_json
-    GROUP BY user_id
+    GROUP BY window_key, user_id
 ),
--- Component for: skillHistory (Dense Grid with Carry-Forward)
+-- Component for: skillHistoryRaw (sparse; densified at export, see logic/skill_history.py)
 -- Step 1: Get daily average skills for each user/category within the period
 users_daily_avg_skill_snapshots AS (
     SELECT
+        au.window_key,
         mss.user_id,
         mss.category,
         date_trunc('day', mss.start_time)::DATE AS history_date,
         AVG(mss.skill) AS avg_daily_skill
     FROM analytics.match_skill_snapshots mss
     CROSS JOIN date_boundaries db
-    WHERE mss.user_id IN (SELECT user_id FROM active_users) -- Only for active users
-      AND mss.start_time >= db.from_timestamptz
+    JOIN windows w ON mss.start_time >= w.from_timestamptz
+    JOIN active_users au ON au.window_key = w.window_key AND au.user_id = mss.user_id -- Only for active users
+    WHERE mss.start_time >= db.from_timestamptz
       AND mss.start_time < db.to_timestamptz
-    GROUP BY mss.user_id, mss.category, date_trunc('day', mss.start_time)::DATE
-),
--- Step 2: Generate all dates in the processing period (for global labels)
-all_period_dates AS (
-    SELECT generate_series(
-               (SELECT from_date FROM processing_params),
-               (SELECT to_date FROM processing_params),
-               '1 day'::interval
-           )::DATE AS history_date
+    GROUP BY au.window_key, mss.user_id, mss.category, date_trunc('day', mss.start_time)::DATE
 ),
--- Step 3: Create a grid of (user_id, category, all_period_dates)
--- Only for user/category combinations that actually have some data in users_daily_avg_skill_snapshots
-user_category_date_grid AS (
-    SELECT
-        ucp.user_id,
-        ucp.category,
-        apd.history_date
-    FROM (SELECT DISTINCT user_id, category FROM users_daily_avg_skill_snapshots) ucp
-    CROSS JOIN all_period_dates apd
-),
--- Step 4: Left join actual skills to the grid and apply LAG to carry forward
-user_skill_history_filled_grid AS (
-    SELECT
-        ucdg.user_id,
-        ucdg.category,
-        ucdg.history_date,
-        COALESCE(
-            udass.avg_daily_skill,
-            LAG(udass.avg_daily_skill, 1, 0.0) OVER (PARTITION BY ucdg.user_id, ucdg.category ORDER BY ucdg.history_date)
-        ) AS filled_avg_skill
-    FROM user_category_date_grid ucdg
-    LEFT JOIN users_daily_avg_skill_snapshots udass
-        ON ucdg.user_id = udass.user_id
-       AND ucdg.category = udass.category
-       AND ucdg.history_date = udass.history_date
-),
--- Step 5: Aggregate into the final JSON structure per user
-users_skill_history_json AS (
-    SELECT
-        g.user_id,
-        jsonb_build_object(
-            'labels', (SELECT COALESCE(jsonb_agg(to_char(apd.history_date, 'YYYY-MM-DD') ORDER BY apd.history_date), '[]'::jsonb)
-                       FROM all_period_dates apd),
-            'datasets', COALESCE(jsonb_agg(
-                            jsonb_build_object(
-                                'label', g.category,
-                                'data', g.skill_data_array
-                            ) ORDER BY g.category
-                        ), '[]'::jsonb)
-        ) AS data
+-- Step 2: One {"dates": [...], "skills": [...]} per category, only the days with data.
+-- Rounded here so the export fills the gaps with exactly the values the old dense grid held.
+users_skill_history_raw_json AS (
+    SELECT g.window_key, g.user_id, jsonb_object_agg(g.category, jsonb_build_object('dates', g.dates, 'skills', g.skills)) AS data
     FROM (
         SELECT
+            window_key,
             user_id,
             category,
-            jsonb_agg(ROUND(filled_avg_skill::numeric, 1) ORDER BY history_date) AS skill_data_array
-        FROM user_skill_history_filled_grid
-        GROUP BY user_id, category
+            jsonb_agg(to_char(history_date, 'YYYY-MM-DD') ORDER BY history_date) AS dates,
+            jsonb_agg(ROUND(avg_daily_skill::numeric, 1) ORDER BY history_date) AS skills
+        FROM users_daily_avg_skill_snapshots
+        GROUP BY window_key, user_id, category
     ) g
-    GROUP BY g.user_id
+    GROUP BY g.window_key, g.user_id
 )
 -- == FINAL ASSEMBLY AND INSERT ==
-INSERT INTO analytics.player_page_json_v4 (user_id, json_data, data_start_date, data_end_date, last_generated_at)
+INSERT INTO analytics.player_page_json_v4 (window_key, user_id, json_data, data_start_date, data_end_date, last_generated_at)
 SELECT
+    au.window_key,
     au.user_id,
     jsonb_build_object(
         '_version', 1, '_generated', now(), 'userId', au.user_id,
@@ -340,22 +335,23 @@ SELECT
         'activityData', COALESCE(uadj.data, '{}'::jsonb),
         'lobbyData', COALESCE(uldj.data, '{}'::jsonb),
         'factionData', COALESCE(ufdj.data, '{}'::jsonb),
-        'skillHistory', COALESCE(ushj.data, jsonb_build_object('labels', '[]'::jsonb, 'datasets', '[]'::jsonb)) -- Using the new dense skill history
+        'skillHistoryRaw', COALESCE(ushrj.data, '{}'::jsonb) -- Becomes the dense skillHistory at export
 --        'toxicity', '{"composite": {"value": 0.42, "delta": "+0.05", "percentile": "84th"}, "total": {"value": 1375, "delta": "+82", "percentile": "76th"}, "uhOhs": {"value": 47, "delta": "+3", "percentile": "68th"}}'::jsonb
     ) AS final_generated_json,
-    (SELECT from_date FROM processing_params),
+    w.from_date,
     (SELECT to_date FROM processing_params),
     now()
 FROM active_users au
-LEFT JOIN users_skill_per_mode_json uspmj ON au.user_id = uspmj.user_id
-LEFT JOIN users_win_loss_summary_json uwlsj ON au.user_id = uwlsj.user_id
-LEFT JOIN users_match_history_json umhj ON au.user_id = umhj.user_id
-LEFT JOIN users_usernames_json uuj ON au.user_id = uuj.user_id
-LEFT JOIN users_activity_data_json uadj ON au.user_id = uadj.user_id
-LEFT JOIN users_lobby_data_json uldj ON au.user_id = uldj.user_id
-LEFT JOIN users_faction_data_json ufdj ON au.user_id = ufdj.user_id
-LEFT JOIN users_skill_history_json ushj ON au.user_id = ushj.user_id -- This now joins the dense skill history
-ON CONFLICT (user_id) DO UPDATE SET
+JOIN windows w ON w.window_key = au.window_key
+LEFT JOIN users_skill_per_mode_json uspmj ON au.window_key = uspmj.window_key AND au.user_id = uspmj.user_id
+LEFT JOIN users_win_loss_summary_json uwlsj ON au.window_key = uwlsj.window_key AND au.user_id = uwlsj.user_id
+LEFT JOIN users_match_history_json umhj ON au.window_key = umhj.window_key AND au.user_id = umhj.user_id
+LEFT JOIN users_usernames_json uuj ON au.window_key = uuj.window_key AND au.user_id = uuj.user_id
+LEFT JOIN users_activity_data_json uadj ON au.window_key = uadj.window_key AND au.user_id = uadj.user_id
+LEFT JOIN users_lobby_data_json uldj ON au.window_key = uldj.window_key AND au.user_id = uldj.user_id
+LEFT JOIN users_faction_data_json ufdj ON au.window_key = ufdj.window_key AND au.user_id = ufdj.user_id
+LEFT JOIN users_skill_history_raw_json ushrj ON au.window_key = ushrj.window_key AND au.user_id = ushrj.user_id
+ON CONFLICT (window_key, user_id) DO UPDATE SET
     json_data = EXCLUDED.json_data,
     data_start_date = EXCLUDED.data_start_date,
     data_end_date = EXCLUDED.data_end_date,
@@ -0,0 +1,259 @@
+-- update_analytics_player_page_json_from_daily.sql
+-- The pages of update_analytics_player_page_json.sql (same parameters, same JSON, same upsert),
+-- merged from the per day partial aggregates of analytics.player_daily_stats and
+-- analytics.player_daily_skill instead of a scan of every match in the window. The hourly run
+-- only rebuilds the days that changed (update_analytics_player_daily_stats.sql), a window moving
+-- a day forward just stops reading the day that left it. A page reads one row per day and
+-- category the player played, not one per match.
+-- Delta mode (active_since) and the user_id hash shards work as in the scanning statement.
+WITH processing_params AS (
+    SELECT
+        %(timestamptz_from)s::timestamptz AS from_date,
+        %(timestamptz_to)s::timestamptz AS to_date,
+        COALESCE(%(active_since)s::timestamptz, '-infinity'::timestamptz) AS active_since
+),
+windows AS (
+    SELECT w.window_key, w.from_date, (w.from_date)::DATE AS from_day
+    FROM unnest(%(window_keys)s::text[], %(window_froms)s::timestamptz[]) AS w(window_key, from_date)
+),
+date_boundaries AS (
+    SELECT (pp.from_date)::DATE AS from_day, (pp.to_date)::DATE AS to_day
+    FROM processing_params pp
+),
+constants AS (
+    SELECT
+        28.0::REAL AS hard_game_os_threshold,
+        10.0::REAL AS k_factor,
+        0.3::REAL AS min_hard_game_pct
+),
+active_users AS ( -- (window_key, user_id): a match in that window since active_since, or on a
+                   -- day rebuilt since, e.g. after a backfill of old replays
+    SELECT DISTINCT w.window_key, pds.user_id
+    FROM analytics.player_daily_stats pds
+    CROSS JOIN date_boundaries db
+    JOIN windows w ON pds.day >= w.from_day
+    WHERE pds.day >= db.from_day
+      AND pds.day <= db.to_day
+      AND (pds.last_start_time >= (SELECT active_since FROM processing_params)
+           OR pds.day IN (SELECT pdsd.day FROM analytics.player_daily_stats_days pdsd
+                          WHERE pdsd.refreshed_at >= (SELECT active_since FROM processing_params)))
+      AND mod(hashint4(pds.user_id)::bigint + 2147483648, %(num_shards)s::bigint) = %(shard)s::bigint
+),
+-- The window's days of the active users, fanned out to the windows each day falls in
+window_days AS (
+    SELECT au.window_key, pds.*
+    FROM analytics.player_daily_stats pds
+    CROSS JOIN date_boundaries db
+    JOIN windows w ON pds.day >= w.from_day
+    JOIN active_users au ON au.window_key = w.window_key AND au.user_id = pds.user_id
+    WHERE pds.user_id IN (SELECT user_id FROM active_users)
+      AND pds.day >= db.from_day
+      AND pds.day <= db.to_day
+      AND pds.category IS NOT NULL
+),
+final_skill_per_mode AS (
+    SELECT user_id, category, latest_skill AS current_os
+    FROM derived.match_skill_deltas
+    WHERE user_id IN (SELECT user_id FROM active_users)
+),
+-- Component for: skillPerMode
+users_skill_per_mode_components AS (
+    SELECT
+        wd.window_key,
+        wd.user_id,
+        wd.category,
+        MAX(wd.last_start_time) AS last_played_timestamp_in_period,
+        SUM(wd.ga) AS ga,
+        SUM(wd.wa) AS wa_count,
+        SUM(wd.gb) AS gb,
+        SUM(wd.wb) AS wb_count,
+        SUM(wd.games) AS total_games_in_mode
+    FROM window_days wd
+    GROUP BY wd.window_key, wd.user_id, wd.category
+),
+users_skill_per_mode_with_as AS (
+    SELECT
+        s.window_key,
+        s.user_id,
+        s.category,
+        COALESCE(fspm.current_os, 0.0) AS current_os,
+        s.last_played_timestamp_in_period, s.ga, s.gb, s.total_games_in_mode,
+        s.wa_count, s.wb_count,
+        CASE WHEN s.ga > 0 THEN ROUND((s.wa_count::DECIMAL / s.ga), 2) ELSE 0.0 END AS wa_rate,
+        CASE WHEN s.gb > 0 THEN ROUND((s.wb_count::DECIMAL / s.gb), 2) ELSE 0.0 END AS wb_rate,
+        CASE
+            WHEN s.total_games_in_mode = 0 THEN COALESCE(fspm.current_os, 0.0)
+            WHEN s.ga::REAL / NULLIF(s.total_games_in_mode, 0) < c.min_hard_game_pct THEN COALESCE(fspm.current_os, 0.0) - c.k_factor * 0.5
+            ELSE COALESCE(fspm.current_os, 0.0) + ((((CASE WHEN s.ga > 0 THEN s.wa_count::REAL / s.ga ELSE 0 END * s.ga) + (CASE WHEN s.gb > 0 THEN s.wb_count::REAL / s.gb ELSE 0 END * s.gb)) / NULLIF(s.total_games_in_mode, 0)) - 0.5) * c.k_factor + (CASE WHEN (CASE WHEN s.ga > 0 THEN s.wa_count::REAL / s.ga ELSE 0 END) > (CASE WHEN s.gb > 0 THEN s.wb_count::REAL / s.gb ELSE 0 END) THEN ((CASE WHEN s.ga > 0 THEN s.wa_count::REAL / s.ga ELSE 0 END) - (CASE WHEN s.gb > 0 THEN s.wb_count::REAL / s.gb ELSE 0 END)) * (c.k_factor * 0.25) ELSE 0 END)
+        END AS adjusted_os
+    FROM users_skill_per_mode_components s
+    LEFT JOIN final_skill_per_mode fspm ON s.user_id = fspm.user_id AND s.category = fspm.category
+    CROSS JOIN constants c
+),
+users_skill_per_mode_json AS (
+    SELECT window_key, user_id, jsonb_object_agg(category, jsonb_build_object('mode', category, 'os', ROUND(current_os::numeric, 1), 'as', ROUND(adjusted_os::numeric, 2), 'ga', ga, 'wa', wa_rate, 'gb', gb, 'wb', wb_rate, 'lastPlayed', to_char(last_played_timestamp_in_period, 'YYYY-MM-DD'))) AS data
+    FROM users_skill_per_mode_with_as GROUP BY window_key, user_id
+),
+-- Component for: winLossSummary (perMode and total)
+users_win_loss_summary_components AS (
+    SELECT wd.window_key, wd.user_id, wd.category, SUM(wd.wins) AS wins, SUM(wd.losses) AS losses
+    FROM window_days wd GROUP BY wd.window_key, wd.user_id, wd.category
+),
+users_win_loss_summary_json AS (
+    SELECT window_key, user_id,
+           jsonb_build_object(
+               'total', jsonb_build_object('wins', SUM(wins), 'losses', SUM(losses), 'games', SUM(wins+losses), 'winRate', CASE WHEN SUM(wins+losses) > 0 THEN ROUND((SUM(wins)::DECIMAL*100 / SUM(wins+losses)),1) ELSE 0 END),
+               'perMode', jsonb_object_agg(category, jsonb_build_object('mode', category, 'wins', wins, 'losses', losses, 'rate', CASE WHEN wins+losses > 0 THEN ROUND((wins::DECIMAL*100 / (wins+losses)),1) ELSE 0 END) ORDER BY category)
+           ) AS data
+    FROM users_win_loss_summary_components GROUP BY window_key, user_id
+),
+-- Component for: matchHistory, the newest of every day's newest matches
+users_match_history_ranked AS (
+    SELECT wd.window_key, wd.user_id, m.match,
+           ROW_NUMBER() OVER (PARTITION BY wd.window_key, wd.user_id ORDER BY (m.match->>'t')::BIGINT DESC) AS rn
+    FROM window_days wd
+    CROSS JOIN LATERAL jsonb_array_elements(wd.recent_matches) AS m(match)
+),
+users_match_history_json AS (
+    SELECT window_key, user_id, jsonb_agg(match - 't' ORDER BY rn ASC) AS data
+    FROM users_match_history_ranked WHERE rn <= 10 GROUP BY window_key, user_id
+),
+-- Component for: usernames, lastSeen is the day of the row holding the latest sighting
+users_usernames_agg AS (
+    SELECT DISTINCT ON (wd.window_key, wd.user_id, n.name)
+        wd.window_key, wd.user_id, n.name, n.last_seen::BIGINT AS last_seen, wd.day AS last_seen_day
+    FROM window_days wd
+    CROSS JOIN LATERAL jsonb_each_text(wd.usernames) AS n(name, last_seen)
+    ORDER BY wd.window_key, wd.user_id, n.name, n.last_seen::BIGINT DESC
+),
+users_usernames_json AS (
+    SELECT window_key, user_id, jsonb_agg(jsonb_build_object('name', name, 'lastSeen', to_char(last_seen_day, 'YYYY-MM-DD')) ORDER BY last_seen DESC) AS data
+    FROM users_usernames_agg GROUP BY window_key, user_id
+),
+-- Component for: activityData
+users_activity_data_daily_agg AS (
+    SELECT wd.window_key, wd.user_id, wd.day AS activity_date, SUM(wd.games) AS games,
+           SUM(wd.skill_sum) / NULLIF(SUM(wd.skill_count), 0) AS avg_skill
+    FROM window_days wd GROUP BY wd.window_key, wd.user_id, wd.day
+),
+users_activity_data_json_intermediate AS (
+    SELECT window_key, user_id, activity_date, games, avg_skill,
+           ROW_NUMBER() OVER (PARTITION BY window_key, user_id ORDER BY activity_date DESC) as rn
+    FROM users_activity_data_daily_agg
+),
+users_activity_data_json AS (
+    SELECT window_key, user_id, jsonb_object_agg(to_char(activity_date, 'YYYY-MM-DD'), jsonb_build_object('games', games, 'avgSkill', ROUND(avg_skill::numeric,1)) ORDER BY activity_date DESC) AS data
+    FROM users_activity_data_json_intermediate
+    WHERE rn <= 84 GROUP BY window_key, user_id
+),
+-- Component for: lobbyData, the days' bin counts added up per bin
+users_lobby_data_summed AS (
+    SELECT wd.window_key, wd.user_id, wd.category, b.bin_idx, SUM(b.game_count) AS game_count
+    FROM window_days wd
+    CROSS JOIN LATERAL unnest(wd.lobby_bins) WITH ORDINALITY AS b(game_count, bin_idx)
+    GROUP BY wd.window_key, wd.user_id, wd.category, b.bin_idx
+
+    UNION ALL
+
+    SELECT wd.window_key, wd.user_id, 'All' AS category, b.bin_idx, SUM(b.game_count) AS game_count
+    FROM window_days wd
+    CROSS JOIN LATERAL unnest(wd.lobby_bins) WITH ORDINALITY AS b(game_count, bin_idx)
+    GROUP BY wd.window_key, wd.user_id, b.bin_idx
+),
+users_lobby_data_inner_json AS (
+    SELECT window_key, user_id, category, jsonb_agg(game_count ORDER BY bin_idx) AS counts_json_array
+    FROM users_lobby_data_summed
+    GROUP BY window_key, user_id, category
+),
+users_lobby_data_json AS (
+    SELECT window_key, user_id, jsonb_object_agg(category, counts_json_array ORDER BY CASE WHEN category = 'All' THEN 0 ELSE 1 END, category) AS data
+    FROM users_lobby_data_inner_json GROUP BY window_key, user_id
+),
+-- Component for: factionData
+users_faction_data_agg AS (
+    SELECT wd.window_key, wd.user_id, wd.category, f.faction,
+           SUM((f.counts->>0)::BIGINT) AS wins, SUM((f.counts->>1)::BIGINT) AS losses
+    FROM window_days wd
+    CROSS JOIN LATERAL jsonb_each(wd.factions) AS f(faction, counts)
+    GROUP BY wd.window_key, wd.user_id, wd.category, f.faction
+
+    UNION ALL
+
+    SELECT wd.window_key, wd.user_id, 'All' AS category, f.faction,
+           SUM((f.counts->>0)::BIGINT) AS wins, SUM((f.counts->>1)::BIGINT) AS losses
+    FROM window_days wd
+    CROSS JOIN LATERAL jsonb_each(wd.factions) AS f(faction, counts)
+    GROUP BY wd.window_key, wd.user_id, f.faction
+),
+users_faction_data_inner_json AS (
+    SELECT
+        window_key, user_id, category,
+        jsonb_build_object(
+            'labels',   COALESCE(jsonb_agg(DISTINCT faction ORDER BY faction), '[]'::jsonb),
+            'datasets', jsonb_build_array(
+                            jsonb_build_object('label', 'Wins', 'data', COALESCE(jsonb_agg(COALESCE(wins,0) ORDER BY faction), '[]'::jsonb)),
+                            jsonb_build_object('label', 'Losses', 'data', COALESCE(jsonb_agg(COALESCE(losses,0) ORDER BY faction), '[]'::jsonb))
+                        )
+        ) as category_faction_data_json
+    FROM users_faction_data_agg
+    GROUP BY window_key, user_id, category
+),
+users_faction_data_json AS (
+    SELECT window_key, user_id, jsonb_object_agg(category, category_faction_data_json ORDER BY CASE WHEN category = 'All' THEN 0 ELSE 1 END, category) AS data
+    FROM users_faction_data_inner_json
+    GROUP BY window_key, user_id
+),
+-- Component for: skillHistoryRaw (sparse; densified at export, see logic/skill_history.py)
+users_skill_history_raw_json AS (
+    SELECT g.window_key, g.user_id, jsonb_object_agg(g.category, jsonb_build_object('dates', g.dates, 'skills', g.skills)) AS data
+    FROM (
+        SELECT
+            au.window_key,
+            pdsk.user_id,
+            pdsk.category,
+            jsonb_agg(to_char(pdsk.day, 'YYYY-MM-DD') ORDER BY pdsk.day) AS dates,
+            jsonb_agg(pdsk.avg_skill ORDER BY pdsk.day) AS skills
+        FROM analytics.player_daily_skill pdsk
+        CROSS JOIN date_boundaries db
+        JOIN windows w ON pdsk.day >= w.from_day
+        JOIN active_users au ON au.window_key = w.window_key AND au.user_id = pdsk.user_id
+        WHERE pdsk.day >= db.from_day
+          AND pdsk.day <= db.to_day
+        GROUP BY au.window_key, pdsk.user_id, pdsk.category
+    ) g
+    GROUP BY g.window_key, g.user_id
+)
+-- == FINAL ASSEMBLY AND INSERT ==
+INSERT INTO analytics.player_page_json_v4 (window_key, user_id, json_data, data_start_date, data_end_date, last_generated_at)
+SELECT
+    au.window_key,
+    au.user_id,
+    jsonb_build_object(
+        '_version', 1, '_generated', now(), 'userId', au.user_id,
+        'skillPerMode', COALESCE(uspmj.data, '{}'::jsonb),
+        'winLossSummary', COALESCE(uwlsj.data, jsonb_build_object('total',jsonb_build_object('wins',0,'losses',0,'games',0,'winRate',0.0),'perMode','{}'::jsonb)),
+        'matchHistory', COALESCE(umhj.data, '[]'::jsonb),
+        'usernames', COALESCE(uuj.data, '[]'::jsonb),
+        'activityData', COALESCE(uadj.data, '{}'::jsonb),
+        'lobbyData', COALESCE(uldj.data, '{}'::jsonb),
+        'factionData', COALESCE(ufdj.data, '{}'::jsonb),
+        'skillHistoryRaw', COALESCE(ushrj.data, '{}'::jsonb)
+    ) AS final_generated_json,
+    w.from_date,
+    (SELECT to_date FROM processing_params),
+    now()
+FROM active_users au
+JOIN windows w ON w.window_key = au.window_key
+LEFT JOIN users_skill_per_mode_json uspmj ON au.window_key = uspmj.window_key AND au.user_id = uspmj.user_id
+LEFT JOIN users_win_loss_summary_json uwlsj ON au.window_key = uwlsj.window_key AND au.user_id = uwlsj.user_id
+LEFT JOIN users_match_history_json umhj ON au.window_key = umhj.window_key AND au.user_id = umhj.user_id
+LEFT JOIN users_usernames_json uuj ON au.window_key = uuj.window_key AND au.user_id = uuj.user_id
+LEFT JOIN users_activity_data_json uadj ON au.window_key = uadj.window_key AND au.user_id = uadj.user_id
+LEFT JOIN users_lobby_data_json uldj ON au.window_key = uldj.window_key AND au.user_id = uldj.user_id
+LEFT JOIN users_faction_data_json ufdj ON au.window_key = ufdj.window_key AND au.user_id = ufdj.user_id
+LEFT JOIN users_skill_history_raw_json ushrj ON au.window_key = ushrj.window_key AND au.user_id = ushrj.user_id
+ON CONFLICT (window_key, user_id) DO UPDATE SET
+    json_data = EXCLUDED.json_data,
+    data_start_date = EXCLUDED.data_start_date,
+    data_end_date = EXCLUDED.data_end_date,
+    last_generated_at = now();
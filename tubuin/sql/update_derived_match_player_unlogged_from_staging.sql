@@ -0,0 +1,39 @@
+-- update_derived_match_player_unlogged_from_staging.sql
+-- Drains raw.replay_players_staging into derived.match_players_unlogged.
+-- The rows were extracted once at ingest time, so no raw_jsonb is detoasted here.
+-- Rows staged after this statement's snapshot are left for the next run.
+WITH staged AS (
+	DELETE FROM raw.replay_players_staging
+	RETURNING
+	    user_id, replay_id, start_time, name, player_id,
+	    ally_team_id, skill, rank,
+	    country_code, faction, won
+),
+first_insert as (
+	-- 1) insert all the real users (uses mpu_rup_unotnull)
+	INSERT INTO derived.match_players_unlogged (
+	  user_id, replay_id, start_time, name, player_id,
+	  ally_team_id, skill, rank,
+	  country_code, faction, won
+	)
+	SELECT
+	  user_id, replay_id, start_time, name, player_id,
+	  ally_team_id, skill, rank,
+	  country_code, faction, won
+	FROM staged
+	WHERE user_id IS NOT NULL
+	ON CONFLICT (replay_id, user_id, player_id, start_time) where (user_id is not null) DO NOTHING
+)
+-- 2) insert all the null users (uses mpu_rp_uisnull)
+INSERT INTO derived.match_players_unlogged (
+  user_id, replay_id, start_time, name, player_id,
+  ally_team_id, skill, rank,
+  country_code, faction, won
+)
+SELECT
+  user_id, replay_id, start_time, name, player_id,
+  ally_team_id, skill, rank,
+  country_code, faction, won
+FROM staged
+WHERE user_id IS NULL
+ON CONFLICT (replay_id, player_id, start_time) where (user_id is null) DO NOTHING;
@@ -0,0 +1,111 @@
+-- update_derived_match_player_unlogged_incremental.sql
+-- Derives player rows for replays ingested since the last successful run, for replays that
+-- did not come through raw.replay_players_staging (see update_derived_match_player_unlogged_from_staging.sql).
+-- Work scales with newly ingested replays instead of with retention.
+
+-- Same watermark pattern as update_analytics_match_skill_snapshots.sql:
+-- lookback_interval re-scans a little behind the watermark for ingest transactions that
+-- committed late (ingested_at is their start time), process_delay skips the last moments.
+WITH config AS (
+    SELECT
+        '2 hours'::INTERVAL AS lookback_interval,
+        '1 minute'::INTERVAL AS process_delay
+),
+last_watermark AS (
+    SELECT last_loaded_at
+    FROM analytics.snapshot_metadata
+    WHERE key = 'match_players_unlogged'
+),
+scan_window AS (
+    SELECT
+        -- No watermark yet: sweep everything once
+        COALESCE((SELECT last_loaded_at FROM last_watermark), '-infinity'::timestamptz)
+            - (SELECT lookback_interval FROM config) AS start_ts,
+        NOW() - (SELECT process_delay FROM config) AS end_ts
+),
+ingested AS (
+    SELECT replay_id, start_time, raw_jsonb
+    FROM raw.replays_cache
+    WHERE ingested_at >= (SELECT start_ts FROM scan_window)
+      AND ingested_at <  (SELECT end_ts FROM scan_window)
+    UNION ALL
+    SELECT replay_id, start_time, raw_jsonb
+    FROM raw.replays
+    WHERE ingested_at >= (SELECT start_ts FROM scan_window)
+      AND ingested_at <  (SELECT end_ts FROM scan_window)
+),
+candidates AS (
+    SELECT DISTINCT ON (replay_id) replay_id, start_time, raw_jsonb
+    FROM ingested i
+    WHERE i.raw_jsonb -> 'AllyTeams' IS NOT NULL
+      -- Replay level check, split so each half can use its partial unique index
+      AND NOT EXISTS (
+          SELECT 1 FROM derived.match_players_unlogged b
+          WHERE b.replay_id = i.replay_id AND b.start_time = i.start_time AND b.user_id IS NOT NULL
+      )
+      AND NOT EXISTS (
+          SELECT 1 FROM derived.match_players_unlogged b
+          WHERE b.replay_id = i.replay_id AND b.start_time = i.start_time AND b.user_id IS NULL
+      )
+    ORDER BY replay_id, start_time ASC
+),
+source AS (
+    SELECT
+        NULLIF(player ->> 'userId', '')::int AS user_id,
+        r.replay_id AS replay_id,
+        r.start_time AS start_time,
+        player ->> 'name' AS name,
+        NULLIF(player ->> 'playerId', '')::int AS player_id,
+        NULLIF(team ->> 'allyTeamId', '')::int AS ally_team_id,
+        NULLIF(regexp_replace(player ->> 'skill', '[\[\]#~()\s]+', '', 'g'), '')::real AS skill,
+        NULLIF(player ->> 'rank', '')::int AS rank,
+        player ->> 'countryCode' AS country_code,
+        player ->> 'faction' AS faction,
+        (team ->> 'winningTeam')::boolean AS won
+    FROM candidates r
+    JOIN LATERAL jsonb_array_elements(r.raw_jsonb -> 'AllyTeams') AS team(team) ON true
+    JOIN LATERAL jsonb_array_elements(team -> 'Players') AS player(player) ON true
+),
+first_insert AS (
+	-- 1) insert all the real users (uses mpu_rup_unotnull)
+	INSERT INTO derived.match_players_unlogged (
+	  user_id, replay_id, start_time, name, player_id,
+	  ally_team_id, skill, rank,
+	  country_code, faction, won
+	)
+	SELECT
+	  user_id, replay_id, start_time, name, player_id,
+	  ally_team_id, skill, rank,
+	  country_code, faction, won
+	FROM source
+	WHERE user_id IS NOT NULL
+	ON CONFLICT (replay_id, user_id, player_id, start_time) where (user_id is not null) DO NOTHING
+	RETURNING 1
+),
+second_insert AS (
+	-- 2) insert all the null users (uses mpu_rp_uisnull)
+	INSERT INTO derived.match_players_unlogged (
+	  user_id, replay_id, start_time, name, player_id,
+	  ally_team_id, skill, rank,
+	  country_code, faction, won
+	)
+	SELECT
+	  user_id, replay_id, start_time, name, player_id,
+	  ally_team_id, skill, rank,
+	  country_code, faction, won
+	FROM source
+	WHERE user_id IS NULL
+	ON CONFLICT (replay_id, player_id, start_time) where (user_id is null) DO NOTHING
+	RETURNING 1
+),
+watermark AS (
+    -- The new watermark is the END of the scan window, committed together with the rows
+    INSERT INTO analytics.snapshot_metadata (key, last_loaded_at)
+    VALUES ('match_players_unlogged', (SELECT end_ts FROM scan_window))
+    ON CONFLICT (key) DO UPDATE SET last_loaded_at = EXCLUDED.last_loaded_at
+    RETURNING 1
+)
+SELECT
+    (SELECT count(*) FROM first_insert) + (SELECT count(*) FROM second_insert) AS inserted,
+    (SELECT count(*) FROM candidates) AS replays,
+    (SELECT count(*) FROM watermark) AS watermarks;
@@ -0,0 +1,65 @@
+-- update_derived_match_skill_deltas.sql
+-- Upserts the latest skill only for (user, category) pairs that got new rows in
+-- analytics.match_skill_snapshots since the last run, instead of refreshing every user.
+-- Full recompute fallback: rebuild_derived_match_skill_deltas.sql.
+
+-- Same watermark pattern as update_analytics_match_skill_snapshots.sql. inserted_at is the
+-- inserting transaction's start time, the lookback covers ones that committed late.
+WITH config AS (
+    SELECT
+        '1 hour'::INTERVAL AS lookback_interval
+),
+last_watermark AS (
+    SELECT last_loaded_at
+    FROM analytics.snapshot_metadata
+    WHERE key = 'match_skill_deltas'
+),
+scan_window AS (
+    SELECT
+        COALESCE((SELECT last_loaded_at FROM last_watermark), '-infinity'::timestamptz)
+            - (SELECT lookback_interval FROM config) AS start_ts,
+        NOW() AS end_ts
+),
+changed_pairs AS (
+    SELECT DISTINCT user_id, category
+    FROM analytics.match_skill_snapshots
+    WHERE inserted_at >= (SELECT start_ts FROM scan_window)
+      AND inserted_at <  (SELECT end_ts FROM scan_window)
+),
+latest AS (
+    -- Newest snapshot per changed pair, a backward scan of the (user_id, category, start_time) index
+    SELECT p.user_id, p.category, s.skill, s.start_time
+    FROM changed_pairs p
+    CROSS JOIN LATERAL (
+        SELECT mss.skill, mss.start_time
+        FROM analytics.match_skill_snapshots mss
+        WHERE mss.user_id = p.user_id
+          AND mss.category = p.category
+        ORDER BY mss.start_time DESC
+        LIMIT 1
+    ) s
+),
+upserted AS (
+    INSERT INTO derived.match_skill_deltas (user_id, category, latest_skill, latest_played_time, updated_at)
+    SELECT user_id, category, skill, start_time, NOW()
+    FROM latest
+    ON CONFLICT (user_id, category) DO UPDATE
+    SET
+        latest_skill       = EXCLUDED.latest_skill,
+        latest_played_time = EXCLUDED.latest_played_time,
+        updated_at         = EXCLUDED.updated_at
+    -- Skip pairs whose latest snapshot didn't actually change
+    WHERE (derived.match_skill_deltas.latest_skill, derived.match_skill_deltas.latest_played_time)
+          IS DISTINCT FROM (EXCLUDED.latest_skill, EXCLUDED.latest_played_time)
+    RETURNING 1
+),
+watermark AS (
+    INSERT INTO analytics.snapshot_metadata (key, last_loaded_at)
+    VALUES ('match_skill_deltas', (SELECT end_ts FROM scan_window))
+    ON CONFLICT (key) DO UPDATE SET last_loaded_at = EXCLUDED.last_loaded_at
+    RETURNING 1
+)
+SELECT
+    (SELECT count(*) FROM upserted) AS upserted,
+    (SELECT count(*) FROM changed_pairs) AS changed_pairs,
+    (SELECT count(*) FROM watermark) AS watermarks;
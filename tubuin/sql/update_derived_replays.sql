@@ -1,85 +1,72 @@
-with combined_replays as (
-	WITH uniq_small AS (
-	    SELECT DISTINCT ON (replay_id)
-	    rrc.id,
-	    rrc.replay_id,
-	    rrc.start_time,
-	    rrc.raw_jsonb
-	    FROM raw.replays_cache rrc
-	    ORDER BY
-	    replay_id,
-	    start_time ASC    -- keep the latest per replay_id
-	)
-	-- 2) Full-join to get all large rows + any small-only rows:
-	select
-	    COALESCE(l.id, u.id) as id,
-	    COALESCE(l.replay_id, u.replay_id) AS replay_id,
-	    COALESCE(l.start_time, u.start_time) as start_time,
-	    coalesce(l.raw_jsonb, u.raw_jsonb) as raw_jsonb
-	FROM (
-		select * from raw.replays
-		-- filter here
-		where 
-		start_time >= %(timestamptz_from)s::timestamptz
-		and not exists (
-		        select 1
-		        from derived.replays b
-		        where b.replay_id = raw.replays.replay_id
-		    )
-		-- end filter
-	) as l
-	FULL JOIN uniq_small AS u
-	    ON l.replay_id = u.replay_id
-	order by start_time desc
+-- update_derived_replays.sql
+-- Backfill: (re)classifies replays started in [timestamptz_from, timestamptz_to). The flow runs
+-- it over a long range in chunks, each committed on its own. With only_missing, replays that
+-- are already in derived.replays are skipped, otherwise they are recomputed and upserted.
+-- The hourly path is update_derived_replays_incremental.sql.
+WITH in_range AS (
+    -- Filter each source on start_time first, then merge; raw.replays wins like the old
+    -- FULL JOIN's COALESCE(l.*, u.*)
+    SELECT replay_id, start_time, raw_jsonb, 0 AS source_rank
+    FROM raw.replays
+    WHERE start_time >= %(timestamptz_from)s::timestamptz
+      AND start_time <  %(timestamptz_to)s::timestamptz
+    UNION ALL
+    SELECT replay_id, start_time, raw_jsonb, 1 AS source_rank
+    FROM raw.replays_cache
+    WHERE start_time >= %(timestamptz_from)s::timestamptz
+      AND start_time <  %(timestamptz_to)s::timestamptz
 ),
-filtered_mp as (
-	select * from derived.match_players_unlogged
-	where exists (
-		select 1 from combined_replays
-		where derived.match_players_unlogged.replay_id = combined_replays.replay_id
-	) 
+candidates AS (
+    SELECT DISTINCT ON (replay_id) replay_id, start_time, raw_jsonb
+    FROM in_range i
+    WHERE NOT %(only_missing)s::boolean
+       OR NOT EXISTS (
+           SELECT 1 FROM derived.replays b WHERE b.replay_id = i.replay_id AND b.start_time = i.start_time
+       )
+    ORDER BY replay_id, source_rank, start_time ASC
 ),
-player_groups as (
+player_groups AS (
+  -- Only the candidates' player rows, via the partial index on (replay_id, user_id, player_id, start_time)
   SELECT
     mp.replay_id,
     COUNT(distinct mp.player_id) AS player_count,
     COUNT(DISTINCT mp.ally_team_id) AS team_count,
     AVG(mp.skill)::real    AS avg_skill
-  FROM filtered_mp mp
+  FROM derived.match_players_unlogged mp
+  JOIN candidates c ON c.replay_id = mp.replay_id AND c.start_time = mp.start_time
   where mp.user_id IS NOT null and mp.skill is not null
   GROUP BY mp.replay_id
 ),
 replay_meta AS (
-	select * from (
-	  SELECT
-	    r.replay_id,
-	    r.start_time,
-	    -- JSON extracts
-	    (r.raw_jsonb ->> 'mapId')::int                             AS map_id,
-	    (r.raw_jsonb -> 'Map' ->> 'scriptName')                    AS map_name,
-	    (r.raw_jsonb -> 'gameSettings' ->> 'ranked_game')::boolean AS ranked,
-	    -- classify by player/team counts
-	    CASE
-	      WHEN pg.player_count = 2 THEN '1v1'
-	      WHEN pg.team_count > 2 THEN 'FFA'
-	      WHEN pg.player_count BETWEEN 4 AND 10 THEN 'SmallTeam'
-	      WHEN pg.player_count BETWEEN 11 AND 16 THEN 'LargeTeam'
-	      ELSE NULL
-	    END                                                         AS category,
-	    -- lobby aggregates
-	    avg_skill 												AS avg_lobby_skill,
-	    pg.player_count                              			AS player_count,
-	    pg.team_count                           				AS team_count,
-	    -- more JSON fields
-	    (r.raw_jsonb ->> 'hasBots')::boolean                      AS has_bots,
-	    (r.raw_jsonb ->> 'durationMs')::int                       AS duration_ms,
-	    r.raw_jsonb ->> 'engineVersion'                           AS engine_version,
-	    r.raw_jsonb ->> 'gameVersion'                             AS game_version,
-	    jsonb_array_length(r.raw_jsonb -> 'Spectators')           AS spectator_count
-	  FROM combined_replays AS r
-	  JOIN player_groups AS pg
-	    ON pg.replay_id = r.replay_id
-  )
+  SELECT
+    r.replay_id,
+    r.start_time,
+    -- JSON extracts
+    (r.raw_jsonb ->> 'mapId')::int                             AS map_id,
+    (r.raw_jsonb -> 'Map' ->> 'scriptName')                    AS map_name,
+    (r.raw_jsonb -> 'gameSettings' ->> 'ranked_game')::boolean AS ranked,
+    -- classify by player/team counts
+    CASE
+      WHEN pg.player_count = 2 THEN '1v1'
+      WHEN pg.team_count > 2 THEN 'FFA'
+      WHEN pg.player_count BETWEEN 4 AND 10 THEN 'SmallTeam'
+      WHEN pg.player_count BETWEEN 11 AND 16 THEN 'LargeTeam'
+      ELSE NULL
+    END                                                         AS category,
+    -- lobby aggregates
+    avg_skill                                                   AS avg_lobby_skill,
+    pg.player_count                                             AS player_count,
+    pg.team_count                                               AS team_count,
+    -- more JSON fields
+    (r.raw_jsonb ->> 'hasBots')::boolean                      AS has_bots,
+    (r.raw_jsonb ->> 'durationMs')::int                       AS duration_ms,
+    r.raw_jsonb ->> 'engineVersion'                           AS engine_version,
+    r.raw_jsonb ->> 'gameVersion'                             AS game_version,
+    jsonb_array_length(r.raw_jsonb -> 'Spectators')           AS spectator_count
+  FROM candidates AS r
+  -- Replays without player rows yet are skipped
+  JOIN player_groups AS pg
+    ON pg.replay_id = r.replay_id
 )
 INSERT INTO derived.replays (
   replay_id,
@@ -114,8 +101,8 @@ SELECT
   spectator_count
 FROM replay_meta
 ORDER BY start_time ASC
-ON CONFLICT (replay_id) DO UPDATE
+ON CONFLICT (replay_id, start_time) DO UPDATE
 SET
   category         = EXCLUDED.category,
   avg_lobby_skill  = EXCLUDED.avg_lobby_skill,
-  team_count       = EXCLUDED.team_count;
\ No newline at end of file
+  team_count       = EXCLUDED.team_count;
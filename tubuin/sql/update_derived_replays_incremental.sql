@@ -0,0 +1,140 @@
+-- update_derived_replays_incremental.sql
+-- Classifies and inserts only replay IDs ingested since the last successful run that are not
+-- in derived.replays yet. Runtime follows the number of new replays, not the cache size.
+
+-- Same watermark pattern as update_analytics_match_skill_snapshots.sql. The lookback is wide
+-- because a replay is only classified once its player rows exist; replays skipped for that
+-- reason are retried on every run until they fall out of the lookback.
+WITH config AS (
+    SELECT
+        '36 hours'::INTERVAL AS lookback_interval,
+        '1 minute'::INTERVAL AS process_delay
+),
+last_watermark AS (
+    SELECT last_loaded_at
+    FROM analytics.snapshot_metadata
+    WHERE key = 'derived_replays'
+),
+scan_window AS (
+    SELECT
+        -- No watermark yet: sweep everything once
+        COALESCE((SELECT last_loaded_at FROM last_watermark), '-infinity'::timestamptz)
+            - (SELECT lookback_interval FROM config) AS start_ts,
+        NOW() - (SELECT process_delay FROM config) AS end_ts
+),
+ingested AS (
+    -- raw.replays first, so its copy wins like the old FULL JOIN's COALESCE(l.*, u.*)
+    SELECT replay_id, start_time, raw_jsonb, 0 AS source_rank
+    FROM raw.replays
+    WHERE ingested_at >= (SELECT start_ts FROM scan_window)
+      AND ingested_at <  (SELECT end_ts FROM scan_window)
+    UNION ALL
+    SELECT replay_id, start_time, raw_jsonb, 1 AS source_rank
+    FROM raw.replays_cache
+    WHERE ingested_at >= (SELECT start_ts FROM scan_window)
+      AND ingested_at <  (SELECT end_ts FROM scan_window)
+),
+candidates AS (
+    SELECT DISTINCT ON (replay_id) replay_id, start_time, raw_jsonb
+    FROM ingested i
+    WHERE NOT EXISTS (
+        -- primary key lookup
+        SELECT 1 FROM derived.replays b WHERE b.replay_id = i.replay_id AND b.start_time = i.start_time
+    )
+    ORDER BY replay_id, source_rank, start_time ASC
+),
+player_groups AS (
+  -- Only the candidates' player rows, via the partial index on (replay_id, user_id, player_id, start_time)
+  SELECT
+    mp.replay_id,
+    COUNT(distinct mp.player_id) AS player_count,
+    COUNT(DISTINCT mp.ally_team_id) AS team_count,
+    AVG(mp.skill)::real    AS avg_skill
+  FROM derived.match_players_unlogged mp
+  JOIN candidates c ON c.replay_id = mp.replay_id AND c.start_time = mp.start_time
+  where mp.user_id IS NOT null and mp.skill is not null
+  GROUP BY mp.replay_id
+),
+replay_meta AS (
+  SELECT
+    r.replay_id,
+    r.start_time,
+    -- JSON extracts
+    (r.raw_jsonb ->> 'mapId')::int                             AS map_id,
+    (r.raw_jsonb -> 'Map' ->> 'scriptName')                    AS map_name,
+    (r.raw_jsonb -> 'gameSettings' ->> 'ranked_game')::boolean AS ranked,
+    -- classify by player/team counts
+    CASE
+      WHEN pg.player_count = 2 THEN '1v1'
+      WHEN pg.team_count > 2 THEN 'FFA'
+      WHEN pg.player_count BETWEEN 4 AND 10 THEN 'SmallTeam'
+      WHEN pg.player_count BETWEEN 11 AND 16 THEN 'LargeTeam'
+      ELSE NULL
+    END                                                         AS category,
+    -- lobby aggregates
+    avg_skill                                                   AS avg_lobby_skill,
+    pg.player_count                                             AS player_count,
+    pg.team_count                                               AS team_count,
+    -- more JSON fields
+    (r.raw_jsonb ->> 'hasBots')::boolean                      AS has_bots,
+    (r.raw_jsonb ->> 'durationMs')::int                       AS duration_ms,
+    r.raw_jsonb ->> 'engineVersion'                           AS engine_version,
+    r.raw_jsonb ->> 'gameVersion'                             AS game_version,
+    jsonb_array_length(r.raw_jsonb -> 'Spectators')           AS spectator_count
+  FROM candidates AS r
+  -- Replays without player rows yet are skipped, the lookback picks them up next run
+  JOIN player_groups AS pg
+    ON pg.replay_id = r.replay_id
+),
+inserted AS (
+INSERT INTO derived.replays (
+  replay_id,
+  start_time,
+  map_id,
+  map_name,
+  ranked,
+  category,
+  avg_lobby_skill,
+  player_count,
+  team_count,
+  has_bots,
+  duration_ms,
+  engine_version,
+  game_version,
+  spectator_count
+)
+SELECT
+  replay_id,
+  start_time,
+  map_id,
+  map_name,
+  ranked,
+  category,
+  avg_lobby_skill,
+  player_count,
+  team_count,
+  has_bots,
+  duration_ms,
+  engine_version,
+  game_version,
+  spectator_count
+FROM replay_meta
+ORDER BY start_time ASC
+ON CONFLICT (replay_id, start_time) DO UPDATE
+SET
+  category         = EXCLUDED.category,
+  avg_lobby_skill  = EXCLUDED.avg_lobby_skill,
+  team_count       = EXCLUDED.team_count
+RETURNING 1
+),
+watermark AS (
+    -- The new watermark is the END of the scan window, committed together with the rows
+    INSERT INTO analytics.snapshot_metadata (key, last_loaded_at)
+    VALUES ('derived_replays', (SELECT end_ts FROM scan_window))
+    ON CONFLICT (key) DO UPDATE SET last_loaded_at = EXCLUDED.last_loaded_at
+    RETURNING 1
+)
+SELECT
+    (SELECT count(*) FROM inserted) AS inserted,
+    (SELECT count(*) FROM candidates) AS candidates,
+    (SELECT count(*) FROM watermark) AS watermarks;
@@ -0,0 +1,6 @@
+-- update_snapshot_metadata_watermark.sql
+-- Sets a watermark in analytics.snapshot_metadata, for jobs that run as several statements
+-- and can only advance it once all of them committed. last_loaded_at NULL stamps now().
+INSERT INTO analytics.snapshot_metadata (key, last_loaded_at)
+VALUES (%(key)s, COALESCE(%(last_loaded_at)s::timestamptz, now()))
+ON CONFLICT (key) DO UPDATE SET last_loaded_at = EXCLUDED.last_loaded_at;